@@ -1,13 +1,53 @@
 # consumers.py
 
-from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.generic.websocket import WebsocketConsumer
+import asyncio
 import json
 
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from Inventory import events, presence
+
+STATUS_GROUP = 'user_status_group'
+
+
+class StatusBroadcaster:
+    """
+    Collects status changes and sends them to the group as one
+    ``{username: status}`` diff every ``interval`` seconds, instead of one
+    group message per change. Only the latest status per user is kept.
+    """
+
+    def __init__(self, group, interval=1.0):
+        self.group = group
+        self.interval = interval
+        self.pending = {}
+        self._flush = None
+
+    def changed(self, channel_layer, username, status):
+        self.pending[username] = status
+        loop = asyncio.get_running_loop()
+        if self._flush is None or self._flush.done() or self._flush.get_loop() is not loop:
+            self._flush = loop.create_task(self._send_later(channel_layer))
+
+    async def _send_later(self, channel_layer):
+        await asyncio.sleep(self.interval)
+        changes, self.pending = self.pending, {}
+        if changes:
+            await channel_layer.group_send(self.group, {'type': 'user_status.batch', 'changes': changes})
+
+
+broadcaster = StatusBroadcaster(STATUS_GROUP)
+
+
 class UserStatusConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        # Create or join a group for user status updates
-        self.room_group_name = 'user_status_group'
+        # Only logged-in staff get status updates
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.room_group_name = STATUS_GROUP
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -16,51 +56,76 @@ class UserStatusConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         # Remove from the group on disconnect
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        if hasattr(self, 'room_group_name'):
+            await self.channel_layer.group_discard(
+                self.room_group_name,
+                self.channel_name
+            )
 
     async def receive(self, text_data):
         # Receive message from WebSocket
-        data = json.loads(text_data)
-        status = data['status']
-        user = data['user']
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            return
+        user = self.scope['user']
 
-        # Broadcast the status change to all clients in the group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_status_update',
-                'status': status,
-                'user': user
-            }
-        )
+        if data.get('type') == 'heartbeat':
+            # Keep the presence row fresh; only a return from offline is news
+            if await database_sync_to_async(presence.seen)(user):
+                broadcaster.changed(self.channel_layer, user.username, 'online')
+            return
+
+        # The status is for the socket's own user, whatever the message says
+        if data.get('status') == 'offline':
+            await database_sync_to_async(presence.went_offline)(user)
+            broadcaster.changed(self.channel_layer, user.username, 'offline')
+        else:
+            await database_sync_to_async(presence.seen)(user)
+            broadcaster.changed(self.channel_layer, user.username, 'online')
+
+    # Handle batched status changes for all clients
+    async def user_status_batch(self, event):
+        await self.send(text_data=json.dumps({'changes': event['changes']}))
+
+
+class InventoryConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes stock changes to open pages. Changes are merged per drug,
+    cannister and lock, keeping the latest state, and sent at most once per
+    ``flush_interval`` seconds.
+    """
+    flush_interval = 0.5
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.pending = self._empty()
+        self._flush = None
+        await self.channel_layer.group_add(events.INVENTORY_GROUP, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'pending'):
+            await self.channel_layer.group_discard(events.INVENTORY_GROUP, self.channel_name)
+            if self._flush is not None:
+                self._flush.cancel()
+
+    @staticmethod
+    def _empty():
+        return {'drugs': {}, 'cannisters': {}, 'locks': {}, 'counters': None}
+
+    async def inventory_changes(self, event):
+        self.pending['drugs'].update(event['drugs'])
+        self.pending['cannisters'].update(event['cannisters'])
+        self.pending['locks'].update(event['locks'])
+        self.pending['counters'] = event['counters']
+        if self._flush is None or self._flush.done():
+            self._flush = asyncio.ensure_future(self._send_later())
 
-    # Handle broadcasted messages to all clients
-    async def user_status_update(self, event):
-        status = event['status']
-        user = event['user']
-
-        # Send status update to WebSocket
-        await self.send(text_data=json.dumps({
-            'status': status,
-            'user': user
-        }))
-class UserStatusConsumer(WebsocketConsumer):
-    def connect(self):
-        self.accept()
-
-    def disconnect(self, close_code):
-        pass
-
-    def receive(self, text_data):
-        data = json.loads(text_data)
-        username = data['user']
-        status = data['status']
-        
-        # Broadcast the status change to all connected clients
-        self.send(text_data=json.dumps({
-            'user': username,
-            'status': status
-        }))
\ No newline at end of file
+    async def _send_later(self):
+        await asyncio.sleep(self.flush_interval)
+        pending, self.pending = self.pending, self._empty()
+        await self.send(text_data=json.dumps(pending))
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/user_status/', consumers.UserStatusConsumer.as_asgi()),
+    path('ws/inventory/', consumers.InventoryConsumer.as_asgi()),
+]
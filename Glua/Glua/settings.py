@@ -40,13 +40,17 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.humanize',
     'Inventory',
+    'channels',
     'crispy_forms',
     'crispy_bootstrap4',
 ]
 
 MIDDLEWARE = [
+    # First, so the timings include the queries of the middleware below
+    'Inventory.timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'Inventory.sessions.SessionRefreshMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -58,7 +62,8 @@ ROOT_URLCONF = 'Glua.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for Server-Timing
+        'BACKEND': 'Inventory.timing.TimedDjangoTemplates',
         'DIRS': [
             BASE_DIR / 'templates',  # Global templates directory (optional)
             BASE_DIR / 'Inventory/templates',  # App-specific templates directory
@@ -76,18 +81,111 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Glua.wsgi.application'
+ASGI_APPLICATION = 'Glua.asgi.application'
+
+# Cache: Redis when REDIS_URL is set, otherwise files under CACHE_DIR. Both
+# are shared by every worker, which the cached pages rely on: a version bump
+# (Inventory/caching.py) made in per-process memory would leave the other
+# workers serving stale pages.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'cache'),
+        },
+    }
+
+# Tests get a scratch cache of their own; see Inventory/testing.py.
+TEST_RUNNER = 'Inventory.testing.TestRunner'
+
+# Websocket channel layer: Redis when REDIS_URL is set, otherwise an
+# in-process layer, which only reaches clients of the same worker.
+if os.environ.get('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.environ['REDIS_URL']]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+# SQLite tuned for several workers writing at once; see Glua/sqlite/base.py.
+# WAL lets readers and one writer work side by side, and writers queue for
+# up to SQLITE_BUSY_TIMEOUT ms instead of failing with "database is locked".
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'Glua.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'transaction_mode': os.environ.get('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+            'pragmas': {
+                'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+                # Safe with WAL: a power cut can lose the last commits, never corrupt
+                'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+                'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20000)),
+                # Negative sizes are KiB: 64 MB of page cache per connection
+                'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+                'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+                'temp_store': 'memory',
+            },
+        },
+        # Keep connections (and their warm page cache) across requests. Set
+        # DB_CONN_MAX_AGE=0 when serving over ASGI, where each request may
+        # run on a new thread.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # Threaded tests need a real file; the in-memory test database
+        # uses a shared cache that fails instead of waiting on locks.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Report and export views read from a snapshot of the database when
+# REPORTS_DB names one; see Inventory/replica.py. Keep it fresh with
+# `manage.py refresh_replica --interval 60` (or from cron). Snapshots older
+# than REPLICA_MAX_AGE seconds are ignored and the reports read the primary.
+if os.environ.get('REPORTS_DB'):
+    DATABASES['reports'] = {
+        'ENGINE': 'Glua.sqlite',
+        'NAME': os.environ['REPORTS_DB'],
+        'OPTIONS': {
+            'pragmas': {
+                'query_only': 1,
+                'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20000)),
+                'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+                'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+            },
+        },
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['Inventory.replica.ReportRouter']
+REPLICA_MAX_AGE = int(os.environ.get('REPLICA_MAX_AGE', 600))
+
+# Hours a lock holds stock for a client without a LockPolicy of its own.
+# `manage.py expire_locks --interval 300` puts expired locks back into stock.
+LOCK_TTL_HOURS = float(os.environ.get('LOCK_TTL_HOURS', 72))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -121,9 +219,23 @@ USE_L10N = True
 
 USE_TZ = True
 
+# Sessions are only written when they change, plus once per
+# SESSION_REFRESH_INTERVAL to slide the expiry forward
+# (Inventory.sessions.SessionRefreshMiddleware). They are read through the
+# shared cache when there is one, and with SESSION_STORE=cookie they live in a
+# signed cookie with no server-side storage. Nothing else deletes expired
+# rows: run `manage.py purge_sessions --interval 3600` (or it from cron).
+if os.environ.get('SESSION_STORE') == 'cookie':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+elif os.environ.get('REDIS_URL'):
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+else:
+    # A per-process cache would keep serving sessions logged out elsewhere.
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 3600  # 1 hour in seconds
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_REFRESH_INTERVAL = 300  # seconds
 
 
 
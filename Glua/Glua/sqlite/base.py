@@ -0,0 +1,59 @@
+"""
+SQLite backend with production settings, used as ENGINE 'Glua.sqlite'.
+
+Two extra OPTIONS keys are read here and not passed to sqlite3.connect():
+
+``pragmas``
+    ``{name: value}`` run as ``PRAGMA name = value`` on every new
+    connection, e.g. WAL journaling and a busy timeout.
+``transaction_mode``
+    How atomic blocks begin: ``DEFERRED`` (SQLite's default), ``IMMEDIATE``
+    or ``EXCLUSIVE``. A deferred transaction that reads before it writes
+    cannot wait for another writer: SQLite fails it with "database is
+    locked" at once, whatever the busy timeout. IMMEDIATE takes the write
+    lock at BEGIN, where the busy timeout applies.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = dict(options.get('pragmas', {}))
+        self.transaction_mode = (options.get('transaction_mode') or 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f'transaction_mode must be one of {", ".join(TRANSACTION_MODES)}, not {self.transaction_mode!r}.')
+        for name in self.pragmas:
+            if not name.replace('_', '').isalnum():
+                raise ImproperlyConfigured(f'{name!r} is not a PRAGMA name.')
+
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            # PRAGMA arguments can't be bound parameters.
+            conn.execute(f'PRAGMA {name} = {_literal(value)}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
+
+
+def _literal(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value
+    value = str(value)
+    if not value.replace('_', '').replace('-', '').isalnum():
+        raise ImproperlyConfigured(f'{value!r} is not a PRAGMA value.')
+    return value
@@ -1,29 +1,45 @@
 from django.contrib import admin
 from django.core.exceptions import PermissionDenied
-from .models import Drug, Sale, Stocked, Measurement, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister
+from .models import Drug, Sale, Stocked, Measurement, LockedProduct, LockPolicy, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister, StockMovement
 
 
 class LockedProductAdmin(admin.ModelAdmin):
     # Optionally, add fields to the admin panel
-    list_display = ('drug', 'locked_by', 'date_locked', 'quantity', 'client')
+    list_display = ('drug', 'locked_by', 'date_locked', 'quantity', 'client', 'expires_at')
 
     def save_model(self, request, obj, form, change):
         # Check if the object is being updated (change == True)
         if change:
-            original = LockedProduct.objects.get(pk=obj.pk)
             # If the product is locked, prevent any changes to it
-            if original.date_locked and obj.drug != original.drug:
+            if obj.date_locked and 'drug' in obj.changed_fields:
                 raise PermissionDenied("Cannot update locked drugs.")
 
         # Call the parent method to save the object
         super().save_model(request, obj, form, change)
 
 
+class StockMovementAdmin(admin.ModelAdmin):
+    # The ledger is append-only, so it is read-only here too
+    list_display = ('timestamp', 'item_type', 'item_id', 'kind', 'quantity', 'balance', 'user', 'reference')
+    list_filter = ('item_type', 'kind')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Drug)  # If you want to use the default admin for Drug
 admin.site.register(Sale)  # If you want to use the default admin for Sale
 admin.site.register(MarketingItem)  # If you want to use the default admin for marketItem
 admin.site.register(IssuedItem)  # If you want to use the default admin for IssuedItem
 admin.site.register(LockedProduct, LockedProductAdmin)
+admin.site.register(LockPolicy)
 admin.site.register(PickingList)
 admin.site.register(Cannister)
-admin.site.register(IssuedCannister)
\ No newline at end of file
+admin.site.register(IssuedCannister)
+admin.site.register(StockMovement, StockMovementAdmin)
\ No newline at end of file
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class InventoryConfig(AppConfig):
     name = 'Inventory'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,106 @@
+import time
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils.functional import cached_property
+
+from . import replica
+from .models import (
+    Drug, Sale, Stocked, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister,
+    SaleRollup, ProductSalesTotal,
+)
+
+# Models whose rows cached pages are built from. Every write to one of them
+# bumps its version, which changes the key of everything cached from it.
+MODELS = [
+    Drug, Sale, Stocked, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister,
+    SaleRollup, ProductSalesTotal,
+]
+
+# Entries can't go stale, so this only bounds how long unused ones linger.
+TIMEOUT = 60 * 60
+
+
+def _version_key(model):
+    return f'inventory:version:{model._meta.label_lower}'
+
+
+def _fresh_version():
+    # Not 1: a version key evicted from the cache must not come back with a
+    # number that older entries were stored under.
+    return time.time_ns()
+
+
+def versions(*models):
+    """
+    The current versions of ``models`` as one string, for cache keys and
+    ``{% cache %}`` fragments. One cache round-trip.
+    """
+    keys = [_version_key(model) for model in models]
+    found = cache.get_many(keys)
+    missing = {key: _fresh_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    parts = [str(found[key]) for key in keys]
+    # Rows read from the report replica change when it is refreshed.
+    if replica.active():
+        parts.append(f'r{replica.snapshot()}')
+    return '-'.join(parts)
+
+
+def bump(*models):
+    for model in models:
+        key = _version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), None)
+
+
+def changed(*models):
+    """
+    Note a write to ``models``. The versions move now, for reads later in
+    the same transaction, and again on commit, so a page cached from the
+    old rows while the transaction was open is not served afterwards.
+    """
+    bump(*models)
+    transaction.on_commit(lambda: bump(*models))
+
+
+def key(name, models, *parts):
+    return ':'.join(['inventory', name, versions(*models)] + [str(part) for part in parts])
+
+
+def cached(name, models, compute, *parts):
+    """
+    ``compute()``, cached until one of ``models`` changes. ``parts`` (page
+    number, filters, ...) tell apart the entries of one name.
+    """
+    entry = key(name, models, *parts)
+    value = cache.get(entry)
+    if value is None:
+        value = compute()
+        cache.set(entry, value, TIMEOUT)
+    return value
+
+
+class VersionedPaginator(Paginator):
+    """
+    Paginator whose row count and page rows are cached until one of
+    ``models`` changes. For ListView.get_paginator().
+    """
+
+    def __init__(self, object_list, per_page, name, models, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_name = name
+        self.models = models
+
+    @cached_property
+    def count(self):
+        return cached(f'{self.cache_name}:count', self.models, lambda: Paginator.count.func(self))
+
+    def _get_page(self, object_list, number, paginator):
+        rows = cached(f'{self.cache_name}:page', self.models, lambda: list(object_list), self.per_page, number)
+        return super()._get_page(rows, number, paginator)
@@ -0,0 +1,99 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from . import summary
+from .models import Drug, Cannister, InventorySummary, LockedProduct
+
+logger = logging.getLogger(__name__)
+
+# Channel group every open inventory page listens on, see Glua/consumers.py.
+INVENTORY_GROUP = 'inventory'
+
+DRUG_FIELDS = ('name', 'batch_no', 'stock', 'expiry_date', 'reorder_level')
+
+COUNTER_FIELDS = [
+    field.name for field in InventorySummary._meta.concrete_fields
+    if field.get_internal_type() == 'IntegerField'
+]
+
+
+class _Batch:
+    """Rows changed in the current transaction, published together on commit."""
+
+    def __init__(self):
+        self.changes = {}
+
+    def add(self, model, pk):
+        self.changes.setdefault(model, set()).add(pk)
+
+
+def _flush(connection):
+    batch = getattr(connection, 'inventory_batch', None)
+    if batch is not None:
+        connection.inventory_batch = None
+        publish(batch.changes)
+
+
+def changed(model, pk):
+    """
+    Note that a row of ``model`` changed. Everything noted in one transaction
+    goes out as one message once it commits; nothing is sent on rollback.
+    Rows noted by a rolled back transaction go out with the next message,
+    which only ever carries their current state.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        publish({model: {pk}})
+        return
+    # The batch lives on the (per-thread) connection. Each change registers
+    # its own hook: the first to run publishes the batch and the rest find
+    # it gone. A hook per change, not per batch, so a rolled back savepoint
+    # can't take the batch's only hook with it.
+    batch = getattr(connection, 'inventory_batch', None)
+    if batch is None:
+        batch = connection.inventory_batch = _Batch()
+    batch.add(model, pk)
+    transaction.on_commit(lambda: _flush(connection))
+
+
+def message(changes):
+    """
+    The group message for ``changes``: current state of each changed drug,
+    cannister and lock (None once deleted) and the dashboard counters.
+    """
+    drug_ids = changes.get(Drug, set())
+    drugs = {str(pk): None for pk in drug_ids}
+    for row in Drug.objects.filter(pk__in=drug_ids).values('pk', *DRUG_FIELDS):
+        row['expiry_date'] = row['expiry_date'].isoformat() if row['expiry_date'] else None
+        drugs[str(row.pop('pk'))] = row
+
+    cannister_ids = changes.get(Cannister, set())
+    cannisters = {str(pk): None for pk in cannister_ids}
+    for pk, stock in Cannister.objects.filter(pk__in=cannister_ids).values_list('pk', 'stock'):
+        cannisters[str(pk)] = {'stock': stock}
+
+    lock_ids = changes.get(LockedProduct, set())
+    locks = {str(pk): None for pk in lock_ids}
+    for pk, quantity in LockedProduct.objects.filter(pk__in=lock_ids).values_list('pk', 'quantity'):
+        locks[str(pk)] = {'quantity': quantity}
+
+    inventory = summary.get_summary()
+    counters = {field: getattr(inventory, field) for field in COUNTER_FIELDS}
+    counters['total_expiring'] = inventory.total_expiring
+
+    return {'type': 'inventory.changes', 'drugs': drugs, 'cannisters': cannisters, 'locks': locks,
+            'counters': counters}
+
+
+def publish(changes):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(INVENTORY_GROUP, message(changes))
+    except Exception:
+        # The write already committed; open pages just miss this update.
+        logger.exception('Could not publish inventory changes')
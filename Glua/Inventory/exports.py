@@ -0,0 +1,183 @@
+import csv
+import zlib
+from datetime import datetime, timedelta, time
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from django.utils.timezone import localtime, make_aware
+
+from .models import Sale, Stocked, LockedProduct, IssuedItem, IssuedCannister
+
+# Rows fetched per round-trip from the database cursor.
+CHUNK_SIZE = 2000
+
+# CSV text is handed to the response in blocks of about this many characters.
+FLUSH_SIZE = 64 * 1024
+
+
+class ExportSpec:
+    """
+    What one export contains: the model, its date column, the columns searched
+    by ``?search=`` and the ``(header, lookup)`` pairs written to each row.
+    """
+
+    def __init__(self, model, date_field, search_fields, columns, filename):
+        self.model = model
+        self.date_field = date_field
+        self.search_fields = search_fields
+        self.columns = columns
+        self.filename = filename
+
+    def queryset(self, start_date=None, end_date=None, search=None):
+        rows = self.model.objects.all()
+        if start_date:
+            rows = rows.filter(**{f'{self.date_field}__gte': _day_start(start_date)})
+        if end_date:
+            rows = rows.filter(**{f'{self.date_field}__lt': _day_start(end_date + timedelta(days=1))})
+        if search:
+            query = Q()
+            for field in self.search_fields:
+                query |= Q(**{f'{field}__icontains': search})
+            rows = rows.filter(query)
+        return rows.order_by(self.date_field, 'id').values_list(*[lookup for _, lookup in self.columns])
+
+    def headers(self):
+        return [header for header, _ in self.columns]
+
+
+EXPORTS = {
+    'sales': ExportSpec(
+        Sale, 'date_sold', ['client', 'drug_sold', 'batch_no'],
+        [
+            ('Date Sold', 'date_sold'),
+            ('Client', 'client'),
+            ('Staff on Duty', 'seller__username'),
+            ('Product', 'drug_sold'),
+            ('Batch No', 'batch_no'),
+            ('Quantity Out', 'quantity'),
+            ('Balance', 'remaining_quantity'),
+        ],
+        'bin_report'),
+    'stock-additions': ExportSpec(
+        Stocked, 'date_added', ['drug_name__name', 'drug_name__batch_no', 'supplier'],
+        [
+            ('Date Stocked', 'date_added'),
+            ('Added By', 'staff__username'),
+            ('Supplier', 'supplier'),
+            ('Product', 'drug_name__name'),
+            ('Batch No', 'drug_name__batch_no'),
+            ('Quantity Added', 'number_added'),
+            ('Total', 'total'),
+        ],
+        'stock_additions'),
+    'locked-products': ExportSpec(
+        LockedProduct, 'date_locked', ['drug__name', 'client', 'locked_by__username'],
+        [
+            ('Date Locked', 'date_locked'),
+            ('Product', 'drug__name'),
+            ('Batch No', 'drug__batch_no'),
+            ('Locked By', 'locked_by__username'),
+            ('Quantity', 'quantity'),
+            ('Client', 'client'),
+            ('Expires', 'expires_at'),
+        ],
+        'locked_products'),
+    'issued-items': ExportSpec(
+        IssuedItem, 'date_issued', ['item', 'issued_to', 'issued_by__username'],
+        [
+            ('Date Issued', 'date_issued'),
+            ('Item', 'item'),
+            ('Issued To', 'issued_to'),
+            ('Quantity Issued', 'quantity_issued'),
+            ('Balance', 'stock'),
+            ('Issued By', 'issued_by__username'),
+        ],
+        'issued_items_report'),
+    'cannisters': ExportSpec(
+        IssuedCannister, 'date_issued', ['name', 'batch_no', 'client', 'staff_on_duty__username'],
+        [
+            ('Date Issued', 'date_issued'),
+            ('Cannister', 'name'),
+            ('Batch No', 'batch_no'),
+            ('Client', 'client'),
+            ('Quantity', 'quantity'),
+            ('Balance', 'balance'),
+            ('Staff on Duty', 'staff_on_duty__username'),
+            ('Returned', 'action'),
+            ('Date Returned', 'date_returned'),
+            ('Returned By', 'returned_by__username'),
+        ],
+        'cannister_bin_card'),
+}
+
+
+def _day_start(day):
+    return make_aware(datetime.combine(day, time()))
+
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+class _Echo:
+    """File-like object whose write() just returns the text, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(headers, rows):
+    """
+    Yield CSV text for ``headers`` and ``rows`` in blocks of about FLUSH_SIZE.
+    """
+    writer = csv.writer(_Echo())
+    block = [writer.writerow(headers)]
+    size = len(block[0])
+    for row in rows:
+        line = writer.writerow([_cell(value) for value in row])
+        block.append(line)
+        size += len(line)
+        if size >= FLUSH_SIZE:
+            yield ''.join(block)
+            block, size = [], 0
+    if block:
+        yield ''.join(block)
+
+
+def gzip_chunks(chunks):
+    """
+    Gzip a stream of text blocks without holding the whole file.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def parse_filters(params):
+    """
+    Read ``start_date``, ``end_date`` (YYYY-MM-DD) and ``search`` from a QueryDict.
+    Invalid dates are ignored, like the report views do.
+    """
+    def day(name):
+        try:
+            return parse_date(params.get(name) or '')
+        except ValueError:
+            return None
+
+    return {
+        'start_date': day('start_date'),
+        'end_date': day('end_date'),
+        'search': (params.get('search') or '').strip() or None,
+    }
+
+
+def rows(spec, start_date=None, end_date=None, search=None):
+    """
+    Stream the export rows with a server-side cursor.
+    """
+    return spec.queryset(start_date, end_date, search).iterator(chunk_size=CHUNK_SIZE)
@@ -0,0 +1,71 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Drug, Sale, IssuedItem, IssuedCannister, Cannister
+
+# FTS5 tables created by migration 0029. SQLite triggers keep them in step
+# with every insert, update and delete on the source tables, including
+# bulk_create and queryset updates. A later migration that makes SQLite
+# rebuild one of the source tables drops its triggers and must recreate them.
+FTS_TABLES = {
+    Drug: 'inventory_drug_fts',
+    Sale: 'inventory_sale_fts',
+    IssuedItem: 'inventory_issueditem_fts',
+    IssuedCannister: 'inventory_issuedcannister_fts',
+    Cannister: 'inventory_cannister_fts',
+}
+
+# Most rows a ranked search returns.
+SEARCH_LIMIT = 200
+
+
+def match_expression(query, columns=None):
+    """
+    Turn free text into an FTS5 query: every word must match as a prefix,
+    e.g. ``newc nc-0`` finds "Newcastle" batch "NC-01". Returns None when
+    there is nothing searchable in ``query``.
+    """
+    terms = [word for word in (query or '').split() if any(char.isalnum() for char in word)]
+    if not terms:
+        return None
+    expression = ' '.join('"%s"*' % word.replace('"', '""') for word in terms)
+    if columns:
+        expression = '{%s} : (%s)' % (' '.join(columns), expression)
+    return expression
+
+
+def match_ids(model, query, columns=None):
+    """
+    Subquery of the primary keys of ``model`` rows matching ``query``,
+    for use as ``pk__in=``.
+    """
+    table = FTS_TABLES[model]
+    return RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [match_expression(query, columns)])
+
+
+def matching(queryset, query, columns=None):
+    """
+    Narrow ``queryset`` to rows matching ``query``, keeping its ordering.
+    An empty query leaves it unchanged.
+    """
+    if match_expression(query, columns) is None:
+        return queryset
+    return queryset.filter(pk__in=match_ids(queryset.model, query, columns))
+
+
+def ranked(queryset, query, columns=None, limit=SEARCH_LIMIT):
+    """
+    The best ``limit`` rows of ``queryset`` for ``query``, most relevant first.
+    """
+    expression = match_expression(query, columns)
+    if expression is None:
+        return []
+    table = FTS_TABLES[queryset.model]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rank LIMIT %s',
+            [expression, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    rows = queryset.in_bulk(ids)
+    return [rows[pk] for pk in ids if pk in rows]
@@ -0,0 +1,241 @@
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, When
+from django.utils.dateparse import parse_date
+
+from . import caching, events, ledger, summary
+from .models import Drug, Stocked, StockMovement
+
+# Rows per bulk INSERT/UPDATE and per batch-number lookup.
+CHUNK_SIZE = 500
+
+REQUIRED_COLUMNS = ['name', 'batch', 'expiry', 'quantity', 'supplier']
+
+# Only needed for batches of products the inventory has never seen.
+OPTIONAL_COLUMNS = ['dose_pack', 'reorder_level']
+
+# Largest number a line may hold; well inside SQLite's 64-bit integers.
+MAX_NUMBER = 10 ** 9
+
+
+class IntakeError(Exception):
+    """The file itself can't be read as an intake CSV."""
+
+
+class IntakeReport:
+    """Outcome of an import: what was written and the rejected lines."""
+
+    def __init__(self):
+        self.lines = 0
+        self.stocked = 0
+        self.created = 0
+        self.quantity = 0
+        self.rejected = []  # (line number, message)
+
+    def reject(self, line, message):
+        self.rejected.append((line, message))
+
+
+class Line:
+    def __init__(self, number, name, batch_no, expiry_date, quantity, supplier, dose_pack, reorder_level):
+        self.number = number
+        self.name = name
+        self.batch_no = batch_no
+        self.expiry_date = expiry_date
+        self.quantity = quantity
+        self.supplier = supplier
+        self.dose_pack = dose_pack
+        self.reorder_level = reorder_level
+
+    @property
+    def key(self):
+        return (self.name, self.batch_no)
+
+
+def _number(value, kind):
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'{kind} must be a number')
+    # Decimal accepts NaN and Infinity, which break int() and comparisons.
+    if not number.is_finite():
+        raise ValueError(f'{kind} must be a number')
+    if number <= 0:
+        raise ValueError(f'{kind} must be greater than zero')
+    if number > MAX_NUMBER:
+        raise ValueError(f'{kind} must be at most {MAX_NUMBER}')
+    return number
+
+
+def _parse(number, row):
+    name = (row.get('name') or '').strip()
+    batch_no = (row.get('batch') or '').strip()
+    if not name or not batch_no:
+        raise ValueError('name and batch are required')
+
+    expiry = (row.get('expiry') or '').strip()
+    expiry_date = None
+    if expiry:
+        try:
+            expiry_date = parse_date(expiry)
+        except ValueError:
+            expiry_date = None
+        if expiry_date is None:
+            raise ValueError(f'expiry "{expiry}" is not a YYYY-MM-DD date')
+
+    quantity = _number((row.get('quantity') or '').strip(), 'quantity')
+    if quantity != int(quantity):
+        raise ValueError('quantity must be a whole number')
+
+    extra = {}
+    for column in OPTIONAL_COLUMNS:
+        value = (row.get(column) or '').strip()
+        extra[column] = float(_number(value, column)) if value else None
+
+    # Stocked.save() capitalizes the supplier; bulk_create skips save().
+    supplier = (row.get('supplier') or '').strip().capitalize() or None
+    return Line(number, name, batch_no, expiry_date, int(quantity), supplier, **extra)
+
+
+def read(file):
+    """
+    Parse an intake CSV (text file object) into valid lines and a report
+    holding the rejected ones. Header names are case-insensitive.
+    """
+    reader = csv.DictReader(file)
+    if reader.fieldnames is None:
+        raise IntakeError('The file is empty.')
+    reader.fieldnames = [column.strip().lower() for column in reader.fieldnames]
+    missing = [column for column in REQUIRED_COLUMNS if column not in reader.fieldnames]
+    if missing:
+        raise IntakeError(f'Missing column(s): {", ".join(missing)}.')
+
+    report, lines = IntakeReport(), []
+    for row in reader:
+        # Line numbers as a spreadsheet shows them, the header being line 1.
+        number = reader.line_num
+        if not any((value or '').strip() for value in row.values() if isinstance(value, str)):
+            continue
+        report.lines += 1
+        try:
+            lines.append(_parse(number, row))
+        except (ValueError, ArithmeticError) as e:
+            report.reject(number, str(e))
+    return lines, report
+
+
+def _existing(keys):
+    """The oldest Drug row for each (name, batch_no) in ``keys``."""
+    found = {}
+    batch_numbers = sorted({batch_no for _, batch_no in keys})
+    for start in range(0, len(batch_numbers), CHUNK_SIZE):
+        chunk = batch_numbers[start:start + CHUNK_SIZE]
+        for drug in Drug.objects.filter(batch_no__in=chunk).order_by('-id'):
+            if (drug.name, drug.batch_no) in keys:
+                found[(drug.name, drug.batch_no)] = drug
+    return found
+
+
+def _product_defaults(names):
+    """dose_pack and reorder_level of the newest batch of each product name."""
+    defaults = {}
+    for drug in Drug.objects.filter(name__in=names).order_by('id').only('name', 'dose_pack', 'reorder_level'):
+        defaults[drug.name] = (drug.dose_pack, drug.reorder_level)
+    return defaults
+
+
+def receive(lines, report, staff, dry_run=False):
+    """
+    Write the intake in one transaction: new Drug batches, the stock
+    increments and a Stocked row per line, all in chunked bulk queries.
+    Lines that conflict with the stored batch are added to ``report``
+    and skipped. ``dry_run`` rolls everything back at the end.
+    """
+    with transaction.atomic():
+        drugs = _existing({line.key for line in lines})
+        defaults = _product_defaults({line.name for line in lines if line.key not in drugs})
+
+        accepted, new = [], {}
+        for line in lines:
+            drug = drugs.get(line.key) or new.get(line.key)
+            if drug is not None:
+                if line.expiry_date and drug.expiry_date and line.expiry_date != drug.expiry_date:
+                    report.reject(line.number, f'expiry differs from batch {line.batch_no} on record '
+                                               f'({drug.expiry_date:%Y-%m-%d})')
+                    continue
+            else:
+                dose_pack, reorder_level = defaults.get(line.name, (None, None))
+                dose_pack = line.dose_pack or dose_pack
+                reorder_level = line.reorder_level or reorder_level
+                if dose_pack is None or reorder_level is None:
+                    report.reject(line.number, f'{line.name} is a new product: give dose_pack and reorder_level')
+                    continue
+                new[line.key] = Drug(name=line.name, batch_no=line.batch_no, stock=0, dose_pack=dose_pack,
+                                     reorder_level=reorder_level, expiry_date=line.expiry_date)
+            accepted.append(line)
+        if not accepted:
+            return report
+
+        Drug.objects.bulk_create(new.values(), batch_size=CHUNK_SIZE)
+        drugs.update(new)
+
+        added = {}
+        for line in accepted:
+            drug = drugs[line.key]
+            added[drug.pk] = added.get(drug.pk, 0) + line.quantity
+        # Relative increments, so sales made meanwhile are kept.
+        ids = list(added)
+        for start in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[start:start + CHUNK_SIZE]
+            Drug.objects.filter(pk__in=chunk).update(stock=Case(
+                *[When(pk=pk, then=F('stock') + added[pk]) for pk in chunk], output_field=IntegerField()))
+
+        current = {}
+        for start in range(0, len(ids), CHUNK_SIZE):
+            current.update(Drug.objects.in_bulk(ids[start:start + CHUNK_SIZE]))
+
+        # Each line's Stocked.total is the batch's running total after it.
+        totals = {pk: current[pk].stock - added[pk] for pk in ids}
+        stocked, movements = [], []
+        for line in accepted:
+            drug = current[drugs[line.key].pk]
+            totals[drug.pk] += line.quantity
+            stocked.append(Stocked(drug_name=drug, supplier=line.supplier, staff=staff,
+                                   number_added=line.quantity, total=totals[drug.pk]))
+            movements.append(ledger.movement(StockMovement.RECEIPT, drug, line.quantity, totals[drug.pk],
+                                             staff, line.supplier))
+        Stocked.objects.bulk_create(stocked, batch_size=CHUNK_SIZE)
+        StockMovement.objects.bulk_create(movements, batch_size=CHUNK_SIZE)
+
+        # Bulk queries skip the signals that keep the dashboard current.
+        created = {drug.pk for drug in new.values()}
+        changes = []
+        for pk in ids:
+            drug = current[pk]
+            after = (drug.stock, drug.reorder_level, drug.expiry_date)
+            changes.append((None if pk in created else (drug.stock - added[pk],) + after[1:], after))
+        summary.drugs_changed(changes)
+        caching.changed(Drug, Stocked)
+        for pk in ids:
+            events.changed(Drug, pk)
+
+        report.stocked = len(stocked)
+        report.created = len(new)
+        report.quantity = sum(added.values())
+        if dry_run:
+            transaction.set_rollback(True)
+    return report
+
+
+def import_csv(file, staff, dry_run=False):
+    """
+    Read and receive an intake CSV, or with ``dry_run`` only check it.
+    Returns the IntakeReport; raises IntakeError when the file has the
+    wrong shape.
+    """
+    lines, report = read(file)
+    receive(lines, report, staff, dry_run)
+    report.rejected.sort()
+    return report
@@ -0,0 +1,46 @@
+from django.utils import timezone
+
+from .models import Drug, MarketingItem, Cannister, StockMovement
+
+ITEM_TYPES = {
+    Drug: StockMovement.DRUG,
+    MarketingItem: StockMovement.MARKETING_ITEM,
+    Cannister: StockMovement.CANNISTER,
+}
+
+
+def movement(kind, item, quantity, balance, user=None, reference=None):
+    """
+    An unsaved StockMovement of ``quantity`` (signed) for ``item``, whose
+    stock is ``balance`` afterwards.
+    """
+    return StockMovement(
+        item_type=ITEM_TYPES[type(item)], item_id=item.pk, timestamp=timezone.now(), kind=kind,
+        quantity=quantity, balance=balance, user=user, reference=reference)
+
+
+def record(*movements):
+    """
+    Append ``movements`` with one INSERT. Call inside the transaction that
+    changed the stock, after the change, so the balances are current.
+    """
+    return StockMovement.objects.bulk_create(movements)
+
+
+def history(item, start=None, end=None):
+    """``item``'s movements, oldest first, optionally between two datetimes."""
+    movements = StockMovement.objects.filter(item_type=ITEM_TYPES[type(item)], item_id=item.pk)
+    if start is not None:
+        movements = movements.filter(timestamp__gte=start)
+    if end is not None:
+        movements = movements.filter(timestamp__lte=end)
+    return movements.order_by('timestamp', 'id')
+
+
+def balance(item, at=None):
+    """
+    ``item``'s stock after its last movement up to ``at`` (default: now),
+    or None before its first one.
+    """
+    movements = history(item, end=at or timezone.now())
+    return movements.reverse().values_list('balance', flat=True).first()
@@ -0,0 +1,115 @@
+import time
+from http.cookies import SimpleCookie
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import resolve, reverse
+
+from Inventory import exports
+from Inventory.models import Drug, LockedProduct, Cannister, IssuedCannister
+from Inventory.timing import percentile
+from Inventory.urls import urlpatterns
+
+# URL arguments filled with the newest row of these models.
+ARGUMENTS = {
+    'pk': Drug,
+    'drug_id': Drug,
+    'lock_id': LockedProduct,
+    'cannister_id': Cannister,
+    'issued_cannister_id': IssuedCannister,
+}
+
+
+def targets():
+    """
+    (url name, path) for every URL in Inventory/urls.py, with ids taken from
+    the database. URLs whose rows don't exist yet are left out.
+    """
+    for pattern in urlpatterns:
+        names = list(pattern.pattern.converters)
+        if names == ['kind']:
+            for kind in exports.EXPORTS:
+                yield f'{pattern.name}:{kind}', reverse(pattern.name, args=[kind])
+            continue
+        args = []
+        for name in names:
+            pk = ARGUMENTS[name].objects.order_by('-pk').values_list('pk', flat=True).first()
+            if pk is None:
+                break
+            args.append(pk)
+        else:
+            yield pattern.name, reverse(pattern.name, args=args)
+
+
+class Command(BaseCommand):
+    help = (
+        'GET every Inventory URL as a staff user and report p50/p95 time and query counts. '
+        'Each request runs in a transaction that is rolled back, so nothing is changed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Only these URL names')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed requests per URL (default 10)')
+        parser.add_argument('--warmup', type=int, default=1, help='Untimed requests per URL first (default 1)')
+        parser.add_argument('--user', help='Username to log in as (default: the first superuser)')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1: percentiles need a timed request.')
+        if options['warmup'] < 0:
+            raise CommandError('--warmup must not be negative.')
+        users = User.objects.order_by('pk')
+        user = (users.filter(username=options['user']) if options['user'] else users.filter(is_superuser=True)).first()
+        if user is None:
+            raise CommandError('No user to log in as; pass --user or create a superuser.')
+
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        cookies = client.cookies.output(header='')
+
+        rows = []
+        for name, path in targets():
+            if options['names'] and name.split(':')[0] not in options['names']:
+                continue
+            times, queries, status = [], 0, None
+            for run in range(options['warmup'] + options['repeat']):
+                # Views that log out would otherwise drop the session for the rest.
+                client.cookies = SimpleCookie(cookies)
+                elapsed, queries, status = self.fetch(client, path)
+                if run >= options['warmup']:
+                    times.append(elapsed)
+            budget = getattr(resolve(path).func, 'query_budget', None)
+            rows.append((name, path, status, percentile(times, 0.5), percentile(times, 0.95), queries, budget))
+            self.stderr.write(f'{name}: {status}', ending='\r')
+
+        self.report(rows)
+
+    def fetch(self, client, path):
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with transaction.atomic():
+            # Counted here rather than by the timing middleware, to include
+            # the queries of streamed responses.
+            with connection.execute_wrapper(count):
+                started = time.perf_counter()
+                response = client.get(path)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = (time.perf_counter() - started) * 1000
+            transaction.set_rollback(True)
+        return elapsed, len(queries), response.status_code
+
+    def report(self, rows):
+        width = max([len(row[0]) for row in rows] + [4])
+        self.stdout.write(f'{"URL":<{width}}  {"status":>6}  {"p50 ms":>9}  {"p95 ms":>9}  {"queries":>7}  {"budget":>6}  path')
+        for name, path, status, p50, p95, queries, budget in sorted(rows, key=lambda row: row[4], reverse=True):
+            line = (f'{name:<{width}}  {status:>6}  {p50:>9.1f}  {p95:>9.1f}  {queries:>7}  '
+                    f'{"-" if budget is None else budget:>6}  {path}')
+            failed = status >= 500 or (budget is not None and queries > budget)
+            self.stdout.write(self.style.ERROR(line) if failed else line)
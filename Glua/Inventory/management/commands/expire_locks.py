@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Inventory import stock
+
+
+class Command(BaseCommand):
+    help = (
+        'Release locked products whose expiry has passed and put their quantities back into stock. '
+        'With --interval, keep sweeping every so many seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Sweep every this many seconds until stopped')
+
+    def handle(self, *args, **options):
+        while True:
+            released, seconds = stock.expire_locks()
+            self.stdout.write(f'Released {released} expired lock(s) in {seconds * 1000:.0f} ms')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
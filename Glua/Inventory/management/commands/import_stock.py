@@ -0,0 +1,34 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from Inventory import intake
+
+
+class Command(BaseCommand):
+    help = (
+        'Receive a supplier delivery from a CSV with name, batch, expiry, quantity and supplier '
+        'columns (plus dose_pack and reorder_level for new products).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='Path to the delivery CSV')
+        parser.add_argument('--user', required=True, help='Username recorded as the receiving staff member')
+        parser.add_argument('--dry-run', action='store_true', help='Check the file without writing anything')
+
+    def handle(self, *args, **options):
+        staff = User.objects.filter(username=options['user']).first()
+        if staff is None:
+            raise CommandError(f'No user named {options["user"]}.')
+
+        try:
+            with open(options['csv_file'], newline='', encoding='utf-8-sig') as file:
+                report = intake.import_csv(file, staff, dry_run=options['dry_run'])
+        except (OSError, intake.IntakeError) as e:
+            raise CommandError(str(e))
+
+        for line, message in report.rejected:
+            self.stderr.write(f'line {line}: {message}')
+        verb = 'Would receive' if options['dry_run'] else 'Received'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {report.quantity} units on {report.stocked} lines ({report.created} new batches); '
+            f'{len(report.rejected)} of {report.lines} lines rejected.'))
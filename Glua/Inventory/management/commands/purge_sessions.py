@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Inventory import sessions
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired sessions from the session table. '
+        'With --interval, keep purging every so many seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Purge every this many seconds until stopped')
+
+    def handle(self, *args, **options):
+        while True:
+            removed, seconds = sessions.purge_expired()
+            self.stdout.write(f'Removed {removed} expired session(s) in {seconds * 1000:.0f} ms')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from Inventory import summary
+
+
+class Command(BaseCommand):
+    help = 'Recount the dashboard summary and roll the expiry buckets over to today. Run daily from cron.'
+
+    def handle(self, *args, **options):
+        inventory = summary.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'{inventory}: {inventory.total_products} products, {inventory.expired} expired, '
+            f'{inventory.expiring_soon} expiring soon'))
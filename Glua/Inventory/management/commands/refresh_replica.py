@@ -0,0 +1,33 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Inventory import replica
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the database into the read-only report replica (REPORTS_DB) with the SQLite backup API. '
+        'With --interval, keep doing so every so many seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Refresh every this many seconds until stopped')
+
+    def handle(self, *args, **options):
+        if not replica.configured():
+            raise CommandError('No replica configured; set REPORTS_DB to the snapshot file.')
+
+        while True:
+            try:
+                seconds = replica.refresh()
+            except sqlite3.Error as e:
+                if not options['interval']:
+                    raise CommandError(f'Could not refresh {replica.path()}: {e}')
+                self.stderr.write(f'Could not refresh {replica.path()}: {e}')
+            else:
+                self.stdout.write(f'Refreshed {replica.path()} in {seconds * 1000:.0f} ms')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,216 @@
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import capfirst
+
+from Inventory import caching, ledger, rollup, summary
+from Inventory.models import (
+    Drug, Sale, Stocked, LockedProduct, IssuedItem, PickingList, Cannister, IssuedCannister, MarketingItem,
+    StockMovement,
+)
+
+VACCINES = [
+    'Newcastle', 'Gumboro', 'Fowl Pox', 'Mareks', 'Lasota', 'Fowl Typhoid', 'Anthrax', 'Blackquarter',
+    'Rabies', 'Lumpy Skin', 'Rift Valley', 'Foot and Mouth', 'Brucella', 'Orf', 'Sheep Pox', 'Enterotoxaemia',
+]
+MARKETING = ['Caps', 'T-Shirts', 'Calendars', 'Brochures', 'Pens', 'Diaries', 'Banners', 'Stickers']
+COUNTIES = ['Nakuru', 'Kiambu', 'Nyeri', 'Meru', 'Machakos', 'Kisumu', 'Eldoret', 'Kericho', 'Nanyuki', 'Thika']
+
+
+@contextmanager
+def keep_dates(*fields):
+    """
+    Let bulk_create store the dates we generate in auto_now_add fields.
+    The fields get their previous setting back even if an insert fails.
+    """
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now_add in saved:
+            field.auto_now_add = auto_now_add
+
+
+def field(model, name):
+    return model._meta.get_field(name)
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a synthetic year of inventory data for load testing. '
+        'Adds to whatever is there; use a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drugs', type=int, default=2000, help='Drug batches (default 2000)')
+        parser.add_argument('--sales', type=int, default=1000000, help='Sale rows (default 1000000)')
+        parser.add_argument('--stocked', type=int, default=50000, help='Stock additions (default 50000)')
+        parser.add_argument('--locks', type=int, default=500, help='Locked products (default 500)')
+        parser.add_argument('--issued-items', type=int, default=20000, help='Issued marketing items (default 20000)')
+        parser.add_argument('--picking', type=int, default=20000, help='Picking list lines (default 20000)')
+        parser.add_argument('--cannisters', type=int, default=200, help='Cannisters (default 200)')
+        parser.add_argument('--issued-cannisters', type=int, default=20000, help='Issued cannisters (default 20000)')
+        parser.add_argument('--staff', type=int, default=10, help='Staff accounts (default 10)')
+        parser.add_argument('--days', type=int, default=365, help='Days of history, ending today (default 365)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT (default 5000)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed, for repeatable data')
+
+    def handle(self, *args, **options):
+        if options['staff'] < 1:
+            raise CommandError('--staff must be at least 1: stock additions and issues need a staff member.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.days = options['days']
+        self.today = summary.today()
+
+        staff = self.create_staff(options['staff'])
+        last_pks = {model: model.objects.aggregate(last=Max('pk'))['last'] or 0 for model in ledger.ITEM_TYPES}
+        drugs = self.create_drugs(options['drugs'])
+        cannisters = self.create_cannisters(options['cannisters'])
+        for model, last_pk in last_pks.items():
+            self.open_ledger(model, last_pk)
+
+        if drugs:
+            self.bulk(Sale, options['sales'], lambda: self.sale(drugs, staff), keep=[field(Sale, 'date_sold')])
+            self.bulk(Stocked, options['stocked'], lambda: self.stocked(drugs, staff),
+                      keep=[field(Stocked, 'date_added')])
+            self.bulk(LockedProduct, options['locks'], lambda: self.lock(drugs, staff),
+                      keep=[field(LockedProduct, 'date_locked')])
+            self.bulk(PickingList, options['picking'], lambda: self.picking_line(drugs))
+        self.bulk(IssuedItem, options['issued_items'], lambda: self.issued_item(staff))
+        if cannisters:
+            self.bulk(IssuedCannister, options['issued_cannisters'], lambda: self.issued_cannister(cannisters, staff))
+
+        self.stdout.write('Rebuilding sales rollups and the dashboard summary...')
+        rollup.rebuild()
+        summary.rebuild()
+        caching.changed(*caching.MODELS)
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def when(self):
+        """A random moment in the last ``days`` days, local time."""
+        day = self.today - timedelta(days=self.random.randrange(max(self.days, 1)))
+        moment = datetime.combine(day, time(self.random.randrange(7, 19), self.random.randrange(60)))
+        return timezone.make_aware(moment)
+
+    def bulk(self, model, count, make, keep=()):
+        """Insert ``count`` rows built by ``make()``, ``batch_size`` per transaction."""
+        created = 0
+        label = capfirst(model._meta.verbose_name_plural)
+        with keep_dates(*keep):
+            while created < count:
+                rows = [make() for _ in range(min(self.batch_size, count - created))]
+                with transaction.atomic():
+                    model.objects.bulk_create(rows)
+                created += len(rows)
+                self.stdout.write(f'{label}: {created}/{count}', ending='\r')
+        self.stdout.write(f'{label}: {count} created')
+
+    def create_staff(self, count):
+        names = [f'seed_staff_{n}' for n in range(count)]
+        existing = set(User.objects.filter(username__in=names).values_list('username', flat=True))
+        users = [User(username=name) for name in names if name not in existing]
+        for user in users:
+            user.set_unusable_password()
+        User.objects.bulk_create(users)
+        return list(User.objects.filter(username__in=names))
+
+    def create_drugs(self, count):
+        start = Drug.objects.count()
+
+        def drug():
+            n = start + len(made)
+            made.append(n)
+            stock = self.random.choice([0, self.random.randint(1, 5), self.random.randint(6, 500)])
+            return Drug(
+                name=f'{self.random.choice(VACCINES)} {self.random.choice([100, 500, 1000, 2000])}',
+                batch_no=f'SD-{n:06d}',
+                stock=stock,
+                dose_pack=self.random.choice([100, 500, 1000]),
+                reorder_level=self.random.choice([5, 10, 20]),
+                expiry_date=self.today + timedelta(days=self.random.randint(-90, 720)),
+            )
+
+        made = []
+        self.bulk(Drug, count, drug)
+        return list(Drug.objects.order_by('-id').values_list('id', 'name', 'batch_no')[:count])
+
+    def open_ledger(self, model, last_pk):
+        """
+        An opening-balance movement for each ``model`` row after ``last_pk``,
+        so ledger balances match the seeded stock. bulk_create skips the
+        signals that would record them.
+        """
+        items = list(model.objects.filter(pk__gt=last_pk).only('stock').order_by('pk'))
+        label = f'{capfirst(model._meta.verbose_name)} opening balances'
+        for start in range(0, len(items), self.batch_size):
+            with transaction.atomic():
+                ledger.record(*[
+                    ledger.movement(StockMovement.ADJUSTMENT, item, item.stock, item.stock,
+                                    reference='Opening balance')
+                    for item in items[start:start + self.batch_size]
+                ])
+        self.stdout.write(f'{label}: {len(items)} created')
+
+    def create_cannisters(self, count):
+        start = Cannister.objects.count()
+
+        def cannister():
+            n = start + len(made)
+            made.append(n)
+            return Cannister(name=f'Liquid Nitrogen {n}', batch_no=f'SC-{n:06d}',
+                             stock=self.random.randint(0, 30), litres=self.random.choice(['3', '10', '35']))
+
+        made = []
+        if not MarketingItem.objects.exists():
+            MarketingItem.objects.bulk_create(MarketingItem(name=name, stock=500) for name in MARKETING)
+        self.bulk(Cannister, count, cannister)
+        return list(Cannister.objects.order_by('-id').values_list('name', 'batch_no')[:count])
+
+    def client(self):
+        return f'{self.random.choice(COUNTIES)} Farm {self.random.randrange(300)}'
+
+    def sale(self, drugs, staff):
+        drug_id, name, batch_no = self.random.choice(drugs)
+        return Sale(drug_id=drug_id, drug_sold=name, batch_no=batch_no, date_sold=self.when(),
+                    client=self.client(), seller=self.random.choice(staff), quantity=self.random.randint(1, 20),
+                    remaining_quantity=self.random.randint(0, 500))
+
+    def stocked(self, drugs, staff):
+        added = self.random.randint(10, 200)
+        return Stocked(drug_name_id=self.random.choice(drugs)[0], date_added=self.when(),
+                       supplier=self.random.choice(['Kevevapi', 'Ceva', 'Hipra', 'Zoetis']),
+                       staff=self.random.choice(staff), number_added=added, total=added + self.random.randint(0, 500))
+
+    def lock(self, drugs, staff):
+        return LockedProduct(drug_id=self.random.choice(drugs)[0], locked_by=self.random.choice(staff),
+                             date_locked=self.when(), quantity=self.random.randint(1, 10), client=self.client())
+
+    def issued_item(self, staff):
+        quantity = self.random.randint(1, 20)
+        return IssuedItem(item=self.random.choice(MARKETING), stock=self.random.randint(0, 500),
+                          issued_to=self.client(), quantity_issued=quantity, date_issued=self.when(),
+                          issued_by=self.random.choice(staff))
+
+    def picking_line(self, drugs):
+        drug_id, name, batch_no = self.random.choice(drugs)
+        return PickingList(date=self.when().date(), client=self.client(), product=name, batch_no=batch_no,
+                           quantity=self.random.randint(1, 20), drug_id=drug_id)
+
+    def issued_cannister(self, cannisters, staff):
+        name, batch_no = self.random.choice(cannisters)
+        issued = self.when()
+        returned = self.random.random() < 0.8
+        return IssuedCannister(
+            date_issued=issued, date_returned=issued + timedelta(days=self.random.randint(1, 30)) if returned else issued,
+            name=name, batch_no=batch_no, staff_on_duty=self.random.choice(staff),
+            returned_by=self.random.choice(staff) if returned else None, client=self.client(),
+            quantity=self.random.randint(1, 3), balance=self.random.randint(0, 30), action=returned)
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.17 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0024_remove_pickinglist_in_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateField()),
+                ('total_products', models.IntegerField(default=0)),
+                ('low_stock', models.IntegerField(default=0)),
+                ('out_of_stock', models.IntegerField(default=0)),
+                ('zero_stock', models.IntegerField(default=0)),
+                ('expired', models.IntegerField(default=0)),
+                ('expiring_soon', models.IntegerField(default=0)),
+                ('locked_products', models.IntegerField(default=0)),
+                ('marketing_items', models.IntegerField(default=0)),
+                ('picking_list', models.IntegerField(default=0)),
+                ('cannisters', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Inventory Summary',
+                'verbose_name_plural': 'Inventory Summary',
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.17 on 2026-10-18 10:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Inventory', '0025_inventorysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('drug_sold', models.CharField(max_length=200)),
+                ('batch_no', models.CharField(blank=True, default='', max_length=200)),
+                ('client', models.CharField(blank=True, default='', max_length=200)),
+                ('quantity', models.FloatField(default=0)),
+                ('sales', models.IntegerField(default=0)),
+                ('seller', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='sale_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Sales Rollup',
+                'verbose_name_plural': 'Sales Rollups',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSalesTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('drug_sold', models.CharField(max_length=200, unique=True)),
+                ('total_quantity', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Product Sales Total',
+                'verbose_name_plural': 'Product Sales Totals',
+                'indexes': [models.Index(fields=['-total_quantity'], name='product_total_qty_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='salerollup',
+            constraint=models.UniqueConstraint(fields=('day', 'drug_sold', 'batch_no', 'client', 'seller'), name='unique_sale_rollup_key'),
+        ),
+    ]
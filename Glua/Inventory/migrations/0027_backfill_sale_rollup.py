@@ -0,0 +1,48 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill(apps, schema_editor):
+    Sale = apps.get_model('Inventory', 'Sale')
+    SaleRollup = apps.get_model('Inventory', 'SaleRollup')
+    ProductSalesTotal = apps.get_model('Inventory', 'ProductSalesTotal')
+
+    rows = {}
+    daily = (
+        Sale.objects.annotate(day=TruncDate('date_sold', tzinfo=timezone.get_current_timezone()))
+        .values('day', 'drug_sold', 'batch_no', 'client', 'seller')
+        .annotate(total=Sum('quantity'), count=Count('id'))
+        .order_by()
+    )
+    for row in daily.iterator():
+        key = (row['day'], row['drug_sold'], row['batch_no'] or '', row['client'] or '', row['seller'])
+        total, count = rows.get(key, (0, 0))
+        rows[key] = (total + (row['total'] or 0), count + row['count'])
+    SaleRollup.objects.bulk_create([
+        SaleRollup(day=day, drug_sold=drug_sold, batch_no=batch_no, client=client, seller_id=seller_id,
+                   quantity=quantity, sales=count)
+        for (day, drug_sold, batch_no, client, seller_id), (quantity, count) in rows.items()
+    ], batch_size=1000)
+
+    ProductSalesTotal.objects.bulk_create([
+        ProductSalesTotal(drug_sold=row['drug_sold'], total_quantity=row['total'] or 0)
+        for row in Sale.objects.values('drug_sold').annotate(total=Sum('quantity')).order_by()
+    ], batch_size=1000)
+
+
+def clear(apps, schema_editor):
+    apps.get_model('Inventory', 'SaleRollup').objects.all().delete()
+    apps.get_model('Inventory', 'ProductSalesTotal').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0026_salerollup_productsalestotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, clear),
+    ]
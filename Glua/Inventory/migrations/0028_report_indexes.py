@@ -0,0 +1,53 @@
+# Generated by Django 4.2.17 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0027_backfill_sale_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['name', 'id'], name='drug_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['stock'], name='drug_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(condition=models.Q(('stock__gt', 0)), fields=['expiry_date'], name='drug_in_stock_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedcannister',
+            index=models.Index(fields=['date_issued', 'id'], name='issued_can_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issueditem',
+            index=models.Index(fields=['date_issued', 'id'], name='issued_item_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lockedproduct',
+            index=models.Index(fields=['date_locked'], name='locked_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pickinglist',
+            index=models.Index(fields=['date', 'id'], name='picking_list_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['date_sold', 'id'], name='sale_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['drug_sold', 'date_sold'], name='sale_drug_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocked',
+            index=models.Index(fields=['date_added', 'id'], name='stocked_date_idx'),
+        ),
+    ]
@@ -0,0 +1,96 @@
+from django.db import migrations
+
+# source table -> (fts table, {fts column: value taken from the source row})
+# A value is a column name, or a (foreign key column, 'username') pair that
+# is looked up in auth_user.
+INDEXES = {
+    'Inventory_drug': ('inventory_drug_fts', {
+        'name': 'name',
+        'batch_no': 'batch_no',
+    }),
+    'Inventory_sale': ('inventory_sale_fts', {
+        'drug_sold': 'drug_sold',
+        'client': 'client',
+        'batch_no': 'batch_no',
+    }),
+    'Inventory_issueditem': ('inventory_issueditem_fts', {
+        'item': 'item',
+        'issued_to': 'issued_to',
+        'issued_by': ('issued_by_id', 'username'),
+    }),
+    'Inventory_issuedcannister': ('inventory_issuedcannister_fts', {
+        'name': 'name',
+        'batch_no': 'batch_no',
+        'client': 'client',
+        'staff_on_duty': ('staff_on_duty_id', 'username'),
+    }),
+    'Inventory_cannister': ('inventory_cannister_fts', {
+        'name': 'name',
+        'batch_no': 'batch_no',
+        'litres': 'litres',
+    }),
+}
+
+
+def value(row, source):
+    if isinstance(source, tuple):
+        return f'(SELECT username FROM auth_user WHERE id = {row}.{source[0]})'
+    return f'{row}.{source}'
+
+
+def source_column(source):
+    return source[0] if isinstance(source, tuple) else source
+
+
+def forwards_sql():
+    statements = []
+    for table, (fts, columns) in INDEXES.items():
+        names = ', '.join(columns)
+        new_values = ', '.join(value('new', source) for source in columns.values())
+        watched = ', '.join(source_column(source) for source in columns.values())
+        insert = f'INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new_values});'
+        delete = f'DELETE FROM {fts} WHERE rowid = old.id;'
+        statements += [
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({names}, tokenize = 'unicode61 remove_diacritics 2')",
+            f'INSERT INTO {fts}(rowid, {names}) SELECT id, '
+            f'{", ".join(value(table, source) for source in columns.values())} FROM {table}',
+            f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END',
+            f'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END',
+            f'CREATE TRIGGER {fts}_au AFTER UPDATE OF {watched} ON {table} BEGIN {delete} {insert} END',
+        ]
+        for column, source in columns.items():
+            if isinstance(source, tuple):
+                # Follow renamed staff accounts.
+                statements.append(
+                    f'CREATE TRIGGER {fts}_{column}_user AFTER UPDATE OF username ON auth_user BEGIN '
+                    f'UPDATE {fts} SET {column} = new.username '
+                    f'WHERE rowid IN (SELECT id FROM {table} WHERE {source[0]} = new.id); END'
+                )
+    return statements
+
+
+def backwards_sql():
+    statements = []
+    for fts, columns in INDEXES.values():
+        triggers = ['ai', 'ad', 'au'] + [
+            f'{column}_user' for column, source in columns.items() if isinstance(source, tuple)
+        ]
+        statements += [f'DROP TRIGGER IF EXISTS {fts}_{name}' for name in triggers]
+        statements.append(f'DROP TABLE IF EXISTS {fts}')
+    return statements
+
+
+class Migration(migrations.Migration):
+    """
+    FTS5 search tables for the search views, filled from the existing rows
+    and kept in sync by triggers.
+    """
+
+    dependencies = [
+        ('Inventory', '0028_report_indexes'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(forwards_sql(), backwards_sql()),
+    ]
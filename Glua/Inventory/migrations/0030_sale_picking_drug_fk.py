@@ -0,0 +1,32 @@
+# Generated by Django 4.2.17 on 2026-10-18 11:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0029_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='sale',
+            name='sale_drug_date_idx',
+        ),
+        migrations.AddField(
+            model_name='pickinglist',
+            name='drug',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='picking_lines', to='Inventory.drug'),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='drug',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to='Inventory.drug'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['drug', 'date_sold'], name='sale_drug_date_idx'),
+        ),
+    ]
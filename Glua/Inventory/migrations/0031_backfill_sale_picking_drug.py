@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+def link(model, name_field, Drug):
+    """
+    Point rows at the drug batch with the same name and batch number, or at
+    the only batch with that name. Anything else is left unlinked.
+    """
+    by_batch = {}
+    by_name = {}
+    for pk, name, batch_no in Drug.objects.order_by('-id').values_list('id', 'name', 'batch_no'):
+        by_batch[(name, batch_no)] = pk
+        by_name.setdefault(name, set()).add(pk)
+
+    pairs = model.objects.filter(drug__isnull=True).values_list(name_field, 'batch_no').distinct().order_by()
+    for name, batch_no in pairs:
+        pk = by_batch.get((name, batch_no))
+        if pk is None and len(by_name.get(name, ())) == 1:
+            pk = next(iter(by_name[name]))
+        if pk is not None:
+            model.objects.filter(drug__isnull=True, **{name_field: name, 'batch_no': batch_no}).update(drug_id=pk)
+
+
+def backfill(apps, schema_editor):
+    Drug = apps.get_model('Inventory', 'Drug')
+    link(apps.get_model('Inventory', 'Sale'), 'drug_sold', Drug)
+    link(apps.get_model('Inventory', 'PickingList'), 'product', Drug)
+
+
+def clear(apps, schema_editor):
+    apps.get_model('Inventory', 'Sale').objects.update(drug=None)
+    apps.get_model('Inventory', 'PickingList').objects.update(drug=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0030_sale_picking_drug_fk'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, clear),
+    ]
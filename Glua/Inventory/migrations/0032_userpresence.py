@@ -0,0 +1,29 @@
+# Generated by Django 4.2.17 on 2026-10-18 11:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('Inventory', '0031_backfill_sale_picking_drug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPresence',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='presence', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_seen', models.DateTimeField(db_index=True)),
+                ('online_since', models.DateTimeField(blank=True, null=True)),
+                ('offline_since', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'User Presence',
+                'verbose_name_plural': 'User Presence',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.17 on 2026-10-18 11:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0032_userpresence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(condition=models.Q(('stock__gt', 0)), fields=['name', 'expiry_date', 'id'], name='drug_fefo_idx'),
+        ),
+    ]
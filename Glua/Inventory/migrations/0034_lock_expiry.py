@@ -0,0 +1,33 @@
+# Generated by Django 4.2.17 on 2026-10-18 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0033_drug_fefo_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LockPolicy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client', models.CharField(max_length=200, unique=True)),
+                ('ttl', models.DurationField(verbose_name='Lock lifetime')),
+            ],
+            options={
+                'verbose_name_plural': 'Lock policies',
+            },
+        ),
+        migrations.AddField(
+            model_name='lockedproduct',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='lockedproduct',
+            index=models.Index(fields=['expires_at'], name='locked_expiry_idx'),
+        ),
+    ]
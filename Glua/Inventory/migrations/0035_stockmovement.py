@@ -0,0 +1,36 @@
+# Generated by Django 4.2.17 on 2026-10-18 11:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Inventory', '0034_lock_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_type', models.CharField(choices=[('drug', 'Drug'), ('marketing_item', 'Marketing item'), ('cannister', 'Cannister')], max_length=20)),
+                ('item_id', models.PositiveIntegerField()),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('sale', 'Sale'), ('lock', 'Lock'), ('unlock', 'Unlock'), ('expire', 'Lock expired'), ('post', 'Lock posted as sale'), ('issue', 'Issue'), ('return', 'Return'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('quantity', models.FloatField()),
+                ('balance', models.FloatField()),
+                ('reference', models.CharField(blank=True, max_length=255, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Stock Movement',
+                'verbose_name_plural': 'Stock Movements',
+                'indexes': [models.Index(fields=['item_type', 'item_id', 'timestamp', 'id'], name='movement_item_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.utils import timezone
+
+# (model, item_type) pairs, as in ledger.ITEM_TYPES
+ITEMS = [('Drug', 'drug'), ('MarketingItem', 'marketing_item'), ('Cannister', 'cannister')]
+
+
+def open_balances(apps, schema_editor):
+    """
+    Start every item's ledger with its current stock, so balances are right
+    for the history recorded from now on.
+    """
+    StockMovement = apps.get_model('Inventory', 'StockMovement')
+    now = timezone.now()
+    for model_name, item_type in ITEMS:
+        items = apps.get_model('Inventory', model_name).objects.values_list('id', 'stock').order_by('id')
+        StockMovement.objects.bulk_create([
+            StockMovement(item_type=item_type, item_id=pk, timestamp=now, kind='adjustment',
+                          quantity=stock, balance=stock, reference='Opening balance')
+            for pk, stock in items.iterator()
+        ], batch_size=500)
+
+
+def clear(apps, schema_editor):
+    apps.get_model('Inventory', 'StockMovement').objects.filter(reference='Opening balance').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0035_stockmovement'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_balances, clear),
+    ]
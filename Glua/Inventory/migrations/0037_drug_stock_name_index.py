@@ -0,0 +1,21 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0036_opening_stock_movements'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='drug',
+            name='drug_stock_idx',
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['stock', 'name', 'id'], name='drug_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:23
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    """Fold together rollup rows without a seller that share a key."""
+    SaleRollup = apps.get_model('Inventory', 'SaleRollup')
+    key = ('day', 'drug_sold', 'batch_no', 'client')
+    duplicated = (
+        SaleRollup.objects.filter(seller__isnull=True).values(*key)
+        .annotate(rows=Count('id'), total=Sum('quantity'), count=Sum('sales')).filter(rows__gt=1)
+    )
+    for group in duplicated:
+        rows = SaleRollup.objects.filter(seller__isnull=True, **{field: group[field] for field in key})
+        keep = rows.order_by('id').first()
+        rows.exclude(pk=keep.pk).delete()
+        rows.filter(pk=keep.pk).update(quantity=group['total'], sales=group['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0037_drug_stock_name_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='salerollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('seller__isnull', True)), fields=('day', 'drug_sold', 'batch_no', 'client'), name='unique_sale_rollup_key_no_seller'),
+        ),
+    ]
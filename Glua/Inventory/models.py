@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -8,6 +9,58 @@ from django.core.exceptions import PermissionDenied
 from django.utils.timezone import now
 
 
+class DirtyFieldsMixin:
+    """
+    Remembers the field values an instance was loaded (or last saved) with.
+    Saving a loaded instance then only writes the columns that changed, and
+    signals can compare against the stored row without selecting it again.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = dict(zip(field_names, values))
+        return instance
+
+    def _remember(self, attnames=None):
+        loaded = self.__dict__.setdefault('_loaded', {})
+        for field in self._meta.concrete_fields:
+            if (attnames is None or field.attname in attnames) and field.attname in self.__dict__:
+                loaded[field.attname] = self.__dict__[field.attname]
+
+    def loaded_value(self, name):
+        """Field ``name`` as loaded or last saved; KeyError when it wasn't loaded."""
+        return self.__dict__.get('_loaded', {})[self._meta.get_field(name).attname]
+
+    @property
+    def changed_fields(self):
+        """Names of the fields set since the instance was loaded or last saved."""
+        loaded = self.__dict__.get('_loaded', {})
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+            and (field.attname not in loaded or self.__dict__[field.attname] != loaded[field.attname])
+        ]
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None and not args and '_loaded' in self.__dict__ \
+                and not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = self.changed_fields
+            if self._meta.pk.name in update_fields:
+                update_fields = None  # a new primary key is a different row
+            # auto_now columns are set by the save itself; nothing changed, nothing to write.
+            elif update_fields:
+                update_fields += [field.name for field in self._meta.concrete_fields
+                                  if getattr(field, 'auto_now', False) and field.name not in update_fields]
+        super().save(*args, update_fields=update_fields, **kwargs)
+        self._remember(None if update_fields is None else
+                       {self._meta.get_field(name).attname for name in update_fields})
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self._remember(None if fields is None else {self._meta.get_field(name).attname for name in fields})
+
+
 
 # class Batch(models.Model):
 #     """Model definition for Batch."""
@@ -24,7 +77,7 @@ from django.utils.timezone import now
 #         return f"{self.name} (Expires: {self.expiry_date})"
 
 
-class Measurement(models.Model):
+class Measurement(DirtyFieldsMixin, models.Model):
     """Model definition for Measurement."""
     name = models.CharField(max_length=200)
     expiry_date = models.DateField(blank = False)
@@ -42,7 +95,7 @@ class Measurement(models.Model):
 #     name = models.CharField(max_length=200)
 
 
-class Drug(models.Model):
+class Drug(DirtyFieldsMixin, models.Model):
     """Model definition for Drug."""
     # name = models.ForeignKey(Vaccine_name, on_delete=models.PROTECT, null=True, blank=True)
     name = models.CharField(max_length=200)
@@ -63,6 +116,15 @@ class Drug(models.Model):
         """Meta definition for Drug."""
         verbose_name = 'Drug'
         verbose_name_plural = 'Drugs'
+        indexes = [
+            models.Index(fields=['name', 'id'], name='drug_name_idx'),
+            # Out of stock is listed a page at a time by name.
+            models.Index(fields=['stock', 'name', 'id'], name='drug_stock_idx'),
+            # Expired / expiring soon only ever look at batches still in stock.
+            models.Index(fields=['expiry_date'], condition=Q(stock__gt=0), name='drug_in_stock_expiry_idx'),
+            # Batches of one product in FEFO order, see stock.fefo_batches().
+            models.Index(fields=['name', 'expiry_date', 'id'], condition=Q(stock__gt=0), name='drug_fefo_idx'),
+        ]
 
     def __str__(self):
         """Unicode representation of Drug."""
@@ -80,9 +142,13 @@ class Drug(models.Model):
     #     super(Drug, self).save(*args, **kwargs)
 
 
-class Sale(models.Model):
+class Sale(DirtyFieldsMixin, models.Model):
     seller = models.ForeignKey(
         User, on_delete=models.PROTECT, null=True, blank=True)
+    # Indexed together with date_sold below.
+    drug = models.ForeignKey(
+        Drug, on_delete=models.SET_NULL, null=True, blank=True, related_name='sales', db_index=False)
+    # Name and batch as they were at the time of the sale.
     drug_sold = models.CharField(max_length=200)
     date_sold = models.DateTimeField(auto_now_add=True)
     client = models.CharField(max_length=200, null=True, blank=True)
@@ -105,12 +171,16 @@ class Sale(models.Model):
         """Meta definition for Sale."""
         verbose_name = 'Sale'
         verbose_name_plural = 'Sales'
+        indexes = [
+            models.Index(fields=['date_sold', 'id'], name='sale_date_idx'),
+            models.Index(fields=['drug', 'date_sold'], name='sale_drug_date_idx'),
+        ]
 
     def __str__(self):
         return f'{self.drug_sold} sold on {self.date_sold}'
 
 
-class Stocked(models.Model):
+class Stocked(DirtyFieldsMixin, models.Model):
     """Model definition for Stock."""
     drug_name = models.ForeignKey(Drug, on_delete=models.PROTECT)
     date_added = models.DateTimeField(auto_now_add=True)
@@ -123,6 +193,9 @@ class Stocked(models.Model):
         """Meta definition for Stock."""
         verbose_name = 'Stock Addition'
         verbose_name_plural = 'Stock Additions'
+        indexes = [
+            models.Index(fields=['date_added', 'id'], name='stocked_date_idx'),
+        ]
 
     def __str__(self):
         """Unicode representation of Stock."""
@@ -135,28 +208,50 @@ class Stocked(models.Model):
                 setattr(self, field_name, val.capitalize())
         super(Stocked, self).save(*args, **kwargs)
 
-class LockedProduct(models.Model):
+class LockedProduct(DirtyFieldsMixin, models.Model):
     drug = models.ForeignKey(Drug, on_delete=models.PROTECT)
     locked_by = models.ForeignKey(User, on_delete=models.PROTECT)
     date_locked = models.DateTimeField(auto_now_add=True)
     quantity = models.FloatField(null=True, blank=True)
     client = models.CharField(max_length=200, null=True, blank=True)
+    # When the sweeper releases the lock back into stock; None holds it until unlocked
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_locked'], name='locked_date_idx'),
+            models.Index(fields=['expires_at'], name='locked_expiry_idx'),
+        ]
 
 @receiver(pre_save, sender=LockedProduct)
 def prevent_locked_drug_update(sender, instance, **kwargs):
-    if instance.pk:  # if it's an update (not a new record)
-        original = LockedProduct.objects.get(pk=instance.pk)
-        if original.date_locked and instance.drug != original.drug:
+    if instance.pk and not instance._state.adding:  # if it's an update (not a new record)
+        try:
+            original_drug = instance.loaded_value('drug')
+        except KeyError:  # built by hand rather than loaded
+            original_drug = LockedProduct.objects.values_list('drug', flat=True).get(pk=instance.pk)
+        if instance.date_locked and instance.drug_id != original_drug:
             raise PermissionDenied("Cannot update locked drugs.")
 
-class MarketingItem(models.Model):
+class LockPolicy(DirtyFieldsMixin, models.Model):
+    """How long locks for a client are held before they expire."""
+    client = models.CharField(max_length=200, unique=True)
+    ttl = models.DurationField(verbose_name="Lock lifetime")
+
+    class Meta:
+        verbose_name_plural = 'Lock policies'
+
+    def __str__(self):
+        return f"{self.client}: {self.ttl}"
+
+class MarketingItem(DirtyFieldsMixin, models.Model):
     name = models.CharField(max_length=100)
     stock = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
-class IssuedItem(models.Model):
+class IssuedItem(DirtyFieldsMixin, models.Model):
     item = models.CharField(max_length=255, verbose_name="Item")
     stock = models.PositiveIntegerField(verbose_name="Stock/Quantity")
     issued_to = models.CharField(max_length=255, verbose_name="Issued To")
@@ -176,20 +271,28 @@ class IssuedItem(models.Model):
         verbose_name = "Issued Item"
         verbose_name_plural = "Issued Items"
         ordering = ['-date_issued']  # Order by latest issued items first
+        indexes = [
+            models.Index(fields=['date_issued', 'id'], name='issued_item_date_idx'),
+        ]
 
-class PickingList(models.Model):
+class PickingList(DirtyFieldsMixin, models.Model):
     date = models.DateField()
     client = models.CharField(max_length=255)
     product = models.CharField(max_length=255)
     batch_no = models.CharField(max_length=100)
     quantity = models.PositiveIntegerField()
-    # in_stock = models.ForeignKey(
-    #     Drug, on_delete=models.CASCADE, null=True, blank=True)
+    drug = models.ForeignKey(
+        Drug, on_delete=models.SET_NULL, null=True, blank=True, related_name='picking_lines')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'id'], name='picking_list_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.client} - {self.product}"
     
-class Cannister(models.Model):
+class Cannister(DirtyFieldsMixin, models.Model):
     name = models.CharField(max_length=255)
     batch_no = models.CharField(max_length=100, unique=True)
     stock = models.PositiveIntegerField()
@@ -198,7 +301,7 @@ class Cannister(models.Model):
     def __str__(self):
         return f"{self.name} - {self.batch_no}"
     
-class IssuedCannister(models.Model):
+class IssuedCannister(DirtyFieldsMixin, models.Model):
     date_issued = models.DateTimeField(default=now)
     date_returned = models.DateTimeField(default=now)
     name = models.CharField(max_length=255)
@@ -210,5 +313,171 @@ class IssuedCannister(models.Model):
     balance = models.PositiveIntegerField(null=True, blank=True)
     action = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_issued', 'id'], name='issued_can_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} - {self.batch_no} issued to {self.client}, returned {self.action}"
+
+class InventorySummary(models.Model):
+    """
+    Single-row dashboard counters. Kept current by the stock mutation paths
+    and signals in summary.py, and rebuilt once a day so the expiry buckets
+    roll forward.
+    """
+    as_of = models.DateField()
+    total_products = models.IntegerField(default=0)
+    low_stock = models.IntegerField(default=0)
+    out_of_stock = models.IntegerField(default=0)
+    zero_stock = models.IntegerField(default=0)
+    expired = models.IntegerField(default=0)
+    expiring_soon = models.IntegerField(default=0)
+    locked_products = models.IntegerField(default=0)
+    marketing_items = models.IntegerField(default=0)
+    picking_list = models.IntegerField(default=0)
+    cannisters = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Inventory Summary'
+        verbose_name_plural = 'Inventory Summary'
+
     def __str__(self):
-        return f"{self.name} - {self.batch_no} issued to {self.client}, returned {self.action}"
\ No newline at end of file
+        return f'Inventory summary as of {self.as_of}'
+
+    @property
+    def total_expiring(self):
+        return self.expired + self.expiring_soon
+
+
+class SaleRollup(models.Model):
+    """
+    Daily sales totals per (day, drug, batch, client, seller). Written in the
+    same transaction as the Sale rows, see rollup.py.
+    """
+    day = models.DateField()
+    drug_sold = models.CharField(max_length=200)
+    batch_no = models.CharField(max_length=200, blank=True, default='')
+    client = models.CharField(max_length=200, blank=True, default='')
+    seller = models.ForeignKey(
+        User, on_delete=models.PROTECT, null=True, blank=True, related_name='sale_rollups')
+    quantity = models.FloatField(default=0)
+    sales = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Sales Rollup'
+        verbose_name_plural = 'Sales Rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'drug_sold', 'batch_no', 'client', 'seller'], name='unique_sale_rollup_key'),
+            # NULLs are distinct in a unique index, so sales without a seller need their own.
+            models.UniqueConstraint(
+                fields=['day', 'drug_sold', 'batch_no', 'client'], condition=Q(seller__isnull=True),
+                name='unique_sale_rollup_key_no_seller'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} {self.drug_sold} on {self.day}'
+
+
+class ProductSalesTotal(models.Model):
+    """All-time quantity sold per product, so top-sold lists never scan history."""
+    drug_sold = models.CharField(max_length=200, unique=True)
+    total_quantity = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = 'Product Sales Total'
+        verbose_name_plural = 'Product Sales Totals'
+        indexes = [
+            models.Index(fields=['-total_quantity'], name='product_total_qty_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.total_quantity} {self.drug_sold} sold'
+
+
+class UserPresence(models.Model):
+    """
+    Last-seen time per user, written on login/logout and by the websocket
+    heartbeat, see presence.py.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='presence')
+    last_seen = models.DateTimeField(db_index=True)
+    online_since = models.DateTimeField(null=True, blank=True)
+    offline_since = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'User Presence'
+        verbose_name_plural = 'User Presence'
+
+    def __str__(self):
+        return f'{self.user} last seen {self.last_seen}'
+
+
+class StockMovement(models.Model):
+    """
+    One change to the stock of a drug batch, marketing item or cannister,
+    written in the transaction that made it, see ledger.py. Rows are never
+    updated or deleted.
+    """
+    DRUG = 'drug'
+    MARKETING_ITEM = 'marketing_item'
+    CANNISTER = 'cannister'
+    ITEM_TYPES = [
+        (DRUG, 'Drug'),
+        (MARKETING_ITEM, 'Marketing item'),
+        (CANNISTER, 'Cannister'),
+    ]
+
+    RECEIPT = 'receipt'
+    SALE = 'sale'
+    LOCK = 'lock'
+    UNLOCK = 'unlock'
+    EXPIRE = 'expire'
+    POST = 'post'
+    ISSUE = 'issue'
+    RETURN = 'return'
+    ADJUSTMENT = 'adjustment'
+    KINDS = [
+        (RECEIPT, 'Receipt'),
+        (SALE, 'Sale'),
+        (LOCK, 'Lock'),
+        (UNLOCK, 'Unlock'),
+        (EXPIRE, 'Lock expired'),
+        (POST, 'Lock posted as sale'),
+        (ISSUE, 'Issue'),
+        (RETURN, 'Return'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
+
+    item_type = models.CharField(max_length=20, choices=ITEM_TYPES)
+    item_id = models.PositiveIntegerField()
+    timestamp = models.DateTimeField(default=now)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    # Into stock is positive, out of stock negative
+    quantity = models.FloatField()
+    # The item's stock after this movement
+    balance = models.FloatField()
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    # Client or supplier
+    reference = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Stock Movement'
+        verbose_name_plural = 'Stock Movements'
+        indexes = [
+            models.Index(fields=['item_type', 'item_id', 'timestamp', 'id'], name='movement_item_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} of {self.quantity:g} {self.get_item_type_display()} #{self.item_id}'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise PermissionDenied("Stock movements cannot be changed.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise PermissionDenied("Stock movements cannot be deleted.")
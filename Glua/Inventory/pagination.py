@@ -0,0 +1,205 @@
+import base64
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+# Rows per page when ?per_page= is missing or not a number, and the most any
+# request gets, whatever it asks for.
+DEFAULT_PER_PAGE = 10
+MAX_PER_PAGE = 100
+
+
+def page_size(value, default=DEFAULT_PER_PAGE):
+    """``value`` (e.g. ?per_page=) as a page size between 1 and MAX_PER_PAGE."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PER_PAGE))
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds, which would make
+    # the next page start before the last row shown and repeat it.
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a fixed ordering, e.g. ``('-date_sold', '-id')``.
+
+    Each page is fetched with a range condition on the ordering columns
+    instead of COUNT(*) and OFFSET, so every page costs the same. The last
+    ordering field must be unique (normally ``id``). Pages link to their
+    neighbours with opaque ``cursor`` tokens; there is no total count.
+    """
+
+    def __init__(self, queryset, ordering, per_page=DEFAULT_PER_PAGE):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = page_size(per_page)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def __getstate__(self):
+        # Cached pages only need the ordering to build their links; pickling
+        # the queryset would fetch every row.
+        state = self.__dict__.copy()
+        state['queryset'] = None
+        return state
+
+    def get_page(self, cursor=None, params=None):
+        """
+        Return the page after (or before) ``cursor``; a missing or invalid
+        cursor gives the first page. ``params`` is the request's QueryDict,
+        used to build links that keep the other filters.
+        """
+        direction, values = self._decode(cursor)
+        if direction == 'prev':
+            rows = self._fetch(_reverse(self.ordering), values)
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_previous, has_next = has_more, True
+        else:
+            rows = self._fetch(self.ordering, values)
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous, has_next = values is not None, has_more
+        return KeysetPage(self, rows, has_previous and bool(rows), has_next and bool(rows), params)
+
+    def _fetch(self, ordering, values):
+        rows = self.queryset.order_by(*ordering)
+        if values is not None:
+            rows = rows.filter(_after(ordering, values))
+        return list(rows[:self.per_page + 1])
+
+    def encode(self, direction, obj):
+        values = [getattr(obj, field) for field in self.fields]
+        data = json.dumps({'d': direction, 'k': values}, cls=_CursorEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def _decode(self, cursor):
+        if not cursor:
+            return 'next', None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            model = self.queryset.model
+            values = [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, data['k'])
+            ]
+            if len(values) != len(self.fields) or data['d'] not in ('next', 'prev'):
+                raise ValueError(cursor)
+            return data['d'], values
+        except Exception:
+            return 'next', None
+
+
+class KeysetPage:
+    """
+    One page of a KeysetPaginator. Iterates like a Django Page and exposes
+    ``has_next``/``has_previous`` plus the query strings for both links.
+    """
+
+    def __init__(self, paginator, object_list, has_previous, has_next, params=None):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @property
+    def next_cursor(self):
+        return self.paginator.encode('next', self.object_list[-1]) if self._has_next else None
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.encode('prev', self.object_list[0]) if self._has_previous else None
+
+    def _query(self, cursor):
+        params = self.params.copy() if self.params is not None else {}
+        if hasattr(params, 'urlencode'):
+            params['cursor'] = cursor
+            params.pop('page', None)
+            return params.urlencode()
+        return f'cursor={cursor}'
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor) if self._has_next else ''
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor) if self._has_previous else ''
+
+
+def keyset_page(request, queryset, ordering, per_page=None, params=None):
+    """
+    Paginate ``queryset`` by ``ordering`` using the request's ``cursor``.
+    ``per_page`` defaults to the request's ?per_page=, capped at
+    MAX_PER_PAGE. ``params`` are the filters the page links keep, by
+    default the query string; see filter_params().
+    """
+    if per_page is None:
+        per_page = request.GET.get('per_page')
+    paginator = KeysetPaginator(queryset, ordering, per_page)
+    return paginator.get_page(request.GET.get('cursor'), request.GET if params is None else params)
+
+
+def filter_params(request, *names):
+    """
+    The request's query string plus the ``names`` filters, taken from the
+    form post or else the query string, so page links of a filtered list
+    stay filtered. Read the filters back from the result.
+    """
+    params = request.GET.copy()
+    source = request.POST if request.method == 'POST' else request.GET
+    for name in names:
+        value = source.get(name)
+        if value:
+            params[name] = value
+        else:
+            params.pop(name, None)
+    return params
+
+
+def _reverse(ordering):
+    return [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+
+
+def _after(ordering, values):
+    """
+    Rows strictly after ``values`` in ``ordering``:
+    ``(a > x) OR (a = x AND b > y) OR ...`` with the comparison flipped for
+    descending fields.
+    """
+    condition = Q()
+    equal = {}
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{field}__{lookup}': value})
+        equal[field] = value
+    return condition
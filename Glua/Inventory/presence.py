@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, Q, Value, When
+from django.utils import timezone
+
+from .models import UserPresence
+
+# A user with no heartbeat for this long counts as offline. The pages send
+# one a minute while open.
+ONLINE_WINDOW = timedelta(minutes=3)
+
+
+def _write(user, **fields):
+    if UserPresence.objects.filter(user=user).update(**fields):
+        return
+    try:
+        with transaction.atomic():
+            UserPresence.objects.create(user=user, **fields)
+    except IntegrityError:
+        # Another request created the row first.
+        UserPresence.objects.filter(user=user).update(**fields)
+
+
+def logged_in(user):
+    at = timezone.now()
+    _write(user, last_seen=at, online_since=at, offline_since=None)
+
+
+def went_offline(user):
+    """Logout, or the page reporting the user idle."""
+    _write(user, last_seen=timezone.now(), offline_since=timezone.now())
+
+
+def seen(user):
+    """
+    Heartbeat. Returns True when it brings a user who had gone offline, or
+    whose heartbeat had lapsed, back online.
+    """
+    at = timezone.now()
+    if UserPresence.objects.filter(online_q(), user=user).update(last_seen=at):
+        return False
+    logged_in(user)
+    return True
+
+
+def online_q(prefix=''):
+    """
+    Condition for "online" on UserPresence, or on User with ``prefix='presence__'``.
+    """
+    cutoff = timezone.now() - ONLINE_WINDOW
+    return Q(**{f'{prefix}last_seen__gte': cutoff, f'{prefix}offline_since__isnull': True})
+
+
+def with_status(users):
+    """
+    Annotate a User queryset with ``is_online`` and its presence row, in one query.
+    """
+    return users.select_related('presence').annotate(
+        is_online=Case(When(online_q('presence__'), then=Value(True)), default=Value(False),
+                       output_field=BooleanField()))
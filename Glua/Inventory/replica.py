@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Alias of the read-only snapshot in settings.DATABASES. It is only
+# configured when REPORTS_DB is set; without it everything uses the primary.
+REPLICA = 'reports'
+
+# Models report views still read from the primary: the summary row is
+# rebuilt when it looks out of date, and presence must be live.
+PRIMARY_ONLY = {'Inventory.inventorysummary', 'Inventory.userpresence'}
+
+_reporting = ContextVar('reporting', default=False)
+
+
+def configured():
+    return REPLICA in connections.settings
+
+
+def path():
+    return connections.settings[REPLICA]['NAME']
+
+
+def age():
+    """Seconds since the replica was last refreshed, or None if it never was."""
+    try:
+        return time.time() - os.stat(path()).st_mtime
+    except OSError:
+        return None
+
+
+def available():
+    """Whether report views should read from the replica right now."""
+    if not configured():
+        return False
+    seconds = age()
+    return seconds is not None and seconds <= settings.REPLICA_MAX_AGE
+
+
+def active():
+    """Whether this request's Inventory reads are going to the replica."""
+    return _reporting.get()
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside a report view, e.g. to recount what is stored."""
+    token = _reporting.set(False)
+    try:
+        yield
+    finally:
+        _reporting.reset(token)
+
+
+def snapshot():
+    """Changes with every refresh; part of the cache keys of replica reads."""
+    return os.stat(path()).st_mtime_ns
+
+
+def refresh():
+    """
+    Copy the primary database into the replica file with SQLite's online
+    backup API. Writers on the primary carry on meanwhile (WAL), and
+    readers of the replica keep their old snapshot until they finish.
+    Returns the time taken in seconds.
+    """
+    started = time.perf_counter()
+    primary = connections[DEFAULT_DB_ALIAS]
+    primary.ensure_connection()
+    # A plain connection: the replica's own settings make it query-only.
+    target = sqlite3.connect(path())
+    try:
+        # One step, so the copy is a single consistent snapshot.
+        primary.connection.backup(target)
+    finally:
+        target.close()
+    # WAL writes may not touch the main file; its mtime is the refresh time.
+    os.utime(path())
+    return time.perf_counter() - started
+
+
+class ReportRouter:
+    """
+    Sends Inventory reads made inside reads_from_replica views to the
+    replica. Everything else, and every write, stays on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _reporting.get() and model._meta.app_label == 'Inventory' \
+                and model._meta.label_lower not in PRIMARY_ONLY:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so rows from both relate.
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica gets its schema from the copy.
+        return db != REPLICA
+
+
+def _stream(content):
+    # Streamed responses are read after the view returns, possibly on
+    # another thread, so route each chunk's queries separately.
+    iterator = iter(content)
+    while True:
+        token = _reporting.set(True)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _reporting.reset(token)
+        yield chunk
+
+
+def reads_from_replica(view):
+    """
+    Run a report view's Inventory reads against the replica while it is
+    fresh (see REPLICA_MAX_AGE), and against the primary otherwise.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not available():
+            return view(request, *args, **kwargs)
+        token = _reporting.set(True)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _reporting.reset(token)
+        if response.streaming:
+            response.streaming_content = _stream(response.streaming_content)
+        return response
+    return wrapper
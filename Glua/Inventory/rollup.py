@@ -0,0 +1,126 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import caching
+from .models import Sale, SaleRollup, ProductSalesTotal
+
+
+def _increment(model, key, **amounts):
+    """
+    Add ``amounts`` to the row matching ``key``, creating it on first use.
+    """
+    increments = {field: F(field) + amount for field, amount in amounts.items()}
+    if model.objects.filter(**key).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **amounts)
+    except IntegrityError:
+        # Another writer created the row first.
+        model.objects.filter(**key).update(**increments)
+
+
+def record(sales):
+    """
+    Fold freshly written Sale rows into the rollups. Call inside the
+    transaction that created them.
+    """
+    # The rows may come from bulk_create, which sends no signals.
+    caching.changed(Sale, SaleRollup, ProductSalesTotal)
+    daily = {}
+    products = {}
+    for sale in sales:
+        quantity = sale.quantity or 0
+        key = (
+            timezone.localdate(sale.date_sold),
+            sale.drug_sold,
+            sale.batch_no or '',
+            sale.client or '',
+            sale.seller_id,
+        )
+        total, count = daily.get(key, (0, 0))
+        daily[key] = (total + quantity, count + 1)
+        products[sale.drug_sold] = products.get(sale.drug_sold, 0) + quantity
+
+    for (day, drug_sold, batch_no, client, seller_id), (quantity, count) in daily.items():
+        key = dict(day=day, drug_sold=drug_sold, batch_no=batch_no, client=client, seller_id=seller_id)
+        _increment(SaleRollup, key, quantity=quantity, sales=count)
+    for drug_sold, quantity in products.items():
+        _increment(ProductSalesTotal, dict(drug_sold=drug_sold), total_quantity=quantity)
+
+
+def top_sold(limit=None, start=None, end=None):
+    """
+    Products by quantity sold, as ``{'drug_sold', 'total_quantity'}`` dicts.
+    Without dates this reads the all-time totals; with dates it sums the
+    daily rollup for the inclusive ``start``..``end`` range.
+    """
+    if start is None and end is None:
+        products = ProductSalesTotal.objects.values('drug_sold', 'total_quantity').order_by('-total_quantity')
+    else:
+        products = (
+            period(start, end).values('drug_sold')
+            .annotate(total_quantity=Sum('quantity'))
+            .order_by('-total_quantity')
+        )
+    return products[:limit] if limit else products
+
+
+def period(start=None, end=None):
+    """
+    Daily rollup rows for the inclusive ``start``..``end`` date range.
+    """
+    rows = SaleRollup.objects.all()
+    if start:
+        rows = rows.filter(day__gte=start)
+    if end:
+        rows = rows.filter(day__lte=end)
+    return rows
+
+
+def totals(start=None, end=None, group_by=()):
+    """
+    Quantity and number of sales for a period, optionally grouped, e.g.
+    ``totals(start, end, group_by=['seller__username'])`` for per-staff figures.
+    """
+    rows = period(start, end)
+    if group_by:
+        return rows.values(*group_by).annotate(
+            total_quantity=Sum('quantity'), total_sales=Sum('sales')).order_by('-total_quantity')
+    return rows.aggregate(total_quantity=Sum('quantity'), total_sales=Sum('sales'))
+
+
+def rebuild():
+    """
+    Recompute both rollups from the Sale table.
+    """
+    tz = timezone.get_current_timezone()
+    with transaction.atomic():
+        SaleRollup.objects.all().delete()
+        ProductSalesTotal.objects.all().delete()
+
+        daily = (
+            Sale.objects.annotate(day=TruncDate('date_sold', tzinfo=tz))
+            .values('day', 'drug_sold', 'batch_no', 'client', 'seller')
+            .annotate(total=Sum('quantity'), count=Count('id'))
+            .order_by()
+        )
+        rows = {}
+        for row in daily.iterator():
+            # NULL and '' batch/client collapse onto the same rollup key.
+            key = (row['day'], row['drug_sold'], row['batch_no'] or '', row['client'] or '', row['seller'])
+            total, count = rows.get(key, (0, 0))
+            rows[key] = (total + (row['total'] or 0), count + row['count'])
+        SaleRollup.objects.bulk_create([
+            SaleRollup(day=day, drug_sold=drug_sold, batch_no=batch_no, client=client, seller_id=seller_id,
+                       quantity=quantity, sales=count)
+            for (day, drug_sold, batch_no, client, seller_id), (quantity, count) in rows.items()
+        ], batch_size=1000)
+
+        ProductSalesTotal.objects.bulk_create([
+            ProductSalesTotal(drug_sold=row['drug_sold'], total_quantity=row['total'] or 0)
+            for row in Sale.objects.values('drug_sold').annotate(total=Sum('quantity')).order_by()
+        ], batch_size=1000)
+        caching.changed(SaleRollup, ProductSalesTotal)
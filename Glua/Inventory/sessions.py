@@ -0,0 +1,51 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.utils import timezone
+
+# Session key holding when the expiry was last pushed forward.
+REFRESHED_KEY = '_refreshed'
+
+
+class SessionRefreshMiddleware:
+    """
+    Sliding session expiry without a write on every request. Sessions are
+    only saved when they change, so this marks a logged-in session changed
+    once every SESSION_REFRESH_INTERVAL seconds, which saves it with a new
+    expiry and re-sends the cookie. Goes below SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.interval = getattr(settings, 'SESSION_REFRESH_INTERVAL', 300)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        session = getattr(request, 'session', None)
+        # is_empty() doesn't load the session, so visitors without one cost nothing.
+        if session is not None and not session.is_empty() and self.logged_in(request):
+            now = int(time.time())
+            if now - session.get(REFRESHED_KEY, 0) >= self.interval:
+                session[REFRESHED_KEY] = now
+        return response
+
+    @staticmethod
+    def logged_in(request):
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_authenticated
+
+
+def purge_expired():
+    """
+    Delete the expired rows of a database-backed session store, which
+    nothing else removes. Returns ``(removed, seconds)``; cookie sessions
+    have no rows, so that is always 0 for them.
+    """
+    started = time.perf_counter()
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if not hasattr(store, 'get_model_class'):
+        return 0, time.perf_counter() - started
+    # Cached copies of these sessions expire from the cache by themselves.
+    removed, _ = store.get_model_class().objects.filter(expire_date__lt=timezone.now()).delete()
+    return removed, time.perf_counter() - started
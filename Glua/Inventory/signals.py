@@ -0,0 +1,104 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import caching, events, ledger, presence, summary
+from .models import Drug, LockedProduct, MarketingItem, PickingList, Cannister, StockMovement
+
+
+def _drug_state(drug):
+    return (drug.stock, drug.reorder_level, drug.expiry_date)
+
+
+@receiver(pre_save, sender=Drug)
+def remember_drug_state(sender, instance, **kwargs):
+    # Form and admin edits can move the batch between buckets, so keep what it was.
+    instance._summary_before = None
+    if instance.pk:
+        try:
+            instance._summary_before = tuple(
+                instance.loaded_value(name) for name in ('stock', 'reorder_level', 'expiry_date'))
+        except KeyError:  # not loaded from the database, or loaded with only()
+            instance._summary_before = (
+                Drug.objects.filter(pk=instance.pk).values_list('stock', 'reorder_level', 'expiry_date').first())
+
+
+@receiver(post_save, sender=Drug)
+def drug_saved(sender, instance, created, **kwargs):
+    before = None if created else getattr(instance, '_summary_before', None)
+    summary.drug_changed(before, _drug_state(instance))
+    record_adjustment(instance, 0 if created else before and before[0])
+
+
+def record_adjustment(item, old_stock):
+    """Ledger entry for stock set by a form or the admin rather than by stock.py."""
+    # Views may assign the posted string as is
+    stock = item._meta.get_field('stock').to_python(item.stock)
+    if old_stock is not None and stock != old_stock:
+        ledger.record(ledger.movement(StockMovement.ADJUSTMENT, item, stock - old_stock, stock))
+
+
+def remember_stock(sender, instance, **kwargs):
+    instance._stock_before = None
+    if instance.pk and not instance._state.adding:
+        try:
+            instance._stock_before = instance.loaded_value('stock')
+        except KeyError:
+            instance._stock_before = sender.objects.filter(pk=instance.pk).values_list('stock', flat=True).first()
+
+
+def stock_saved(sender, instance, created, **kwargs):
+    record_adjustment(instance, 0 if created else getattr(instance, '_stock_before', None))
+
+
+for model in (MarketingItem, Cannister):
+    pre_save.connect(remember_stock, sender=model, dispatch_uid=f'ledger_before_{model.__name__}')
+    post_save.connect(stock_saved, sender=model, dispatch_uid=f'ledger_saved_{model.__name__}')
+
+
+@receiver(post_delete, sender=Drug)
+def drug_deleted(sender, instance, **kwargs):
+    summary.drug_changed(_drug_state(instance), None)
+
+
+def count_created(sender, instance, created, **kwargs):
+    if created:
+        summary.adjust(**{summary.ROW_COUNTERS[sender]: 1})
+
+
+def count_deleted(sender, instance, **kwargs):
+    summary.adjust(**{summary.ROW_COUNTERS[sender]: -1})
+
+
+for model in summary.ROW_COUNTERS:
+    post_save.connect(count_created, sender=model, dispatch_uid=f'summary_created_{model.__name__}')
+    post_delete.connect(count_deleted, sender=model, dispatch_uid=f'summary_deleted_{model.__name__}')
+
+
+def publish_change(sender, instance, **kwargs):
+    events.changed(sender, instance.pk)
+
+
+for model in (Drug, LockedProduct, PickingList, Cannister):
+    post_save.connect(publish_change, sender=model, dispatch_uid=f'events_saved_{model.__name__}')
+    post_delete.connect(publish_change, sender=model, dispatch_uid=f'events_deleted_{model.__name__}')
+
+
+def invalidate_cache(sender, **kwargs):
+    caching.changed(sender)
+
+
+for model in caching.MODELS:
+    post_save.connect(invalidate_cache, sender=model, dispatch_uid=f'cache_saved_{model.__name__}')
+    post_delete.connect(invalidate_cache, sender=model, dispatch_uid=f'cache_deleted_{model.__name__}')
+
+
+@receiver(user_logged_in)
+def mark_online(sender, request, user, **kwargs):
+    presence.logged_in(user)
+
+
+@receiver(user_logged_out)
+def mark_offline(sender, request, user, **kwargs):
+    if user is not None:
+        presence.went_offline(user)
@@ -0,0 +1,67 @@
+// Search-as-you-type for a table: each pause in typing fetches the matching
+// rows from a *_rows endpoint and swaps them into the table body. "More"
+// appends the next page. Clearing the box brings back the original rows.
+function typeahead(options) {
+    var input = document.getElementById(options.input);
+    var body = document.getElementById(options.body);
+    var more = document.getElementById(options.more);
+    var pages = options.pages ? document.getElementById(options.pages) : null;
+    var original = body.innerHTML;
+    var delay = options.delay || 250;
+    var timer = null, controller = null, query = '', next = null;
+
+    function show(element, visible) {
+        if (element) {
+            element.style.display = visible ? '' : 'none';
+        }
+    }
+
+    function load(append) {
+        if (controller) {
+            controller.abort();  // only the latest keystroke matters
+        }
+        controller = new AbortController();
+        var params = new URLSearchParams({q: query});
+        if (append && next) {
+            params.set('cursor', next);
+        }
+        fetch(options.url + '?' + params.toString(), {signal: controller.signal})
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                if (append) {
+                    body.insertAdjacentHTML('beforeend', data.rows);
+                } else {
+                    body.innerHTML = data.rows;
+                }
+                next = data.next;
+                show(more, next !== null);
+            })
+            .catch(function (error) {
+                if (error.name !== 'AbortError') {
+                    console.error(error);
+                }
+            });
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            query = input.value.trim();
+            if (query === '') {
+                if (controller) {
+                    controller.abort();
+                }
+                body.innerHTML = original;
+                show(more, false);
+                show(pages, true);
+                return;
+            }
+            show(pages, false);
+            load(false);
+        }, delay);
+    });
+
+    more.addEventListener('click', function () {
+        load(true);
+    });
+}
@@ -0,0 +1,446 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Case, When, FloatField, Sum
+from django.utils import timezone
+
+from . import caching, events, ledger, rollup, summary
+from .models import (
+    Drug, Sale, Stocked, LockedProduct, LockPolicy, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister,
+    StockMovement,
+)
+
+# Allocations retried when other tellers keep emptying the chosen batches.
+FEFO_ATTEMPTS = 3
+
+
+class InsufficientStock(Exception):
+    """Raised when a guarded stock decrement finds too little stock."""
+
+
+def _check_quantity(quantity):
+    # A negative quantity passes the stock__gte guard and adds stock instead.
+    if not quantity > 0:
+        raise ValueError('Quantity must be greater than zero')
+
+
+def _take(queryset, field, quantity):
+    """
+    Decrement ``field`` by ``quantity`` in a single UPDATE that only matches
+    while enough stock is left. Returns False when nothing was taken.
+    """
+    _check_quantity(quantity)
+    filters = {f'{field}__gte': quantity}
+    return queryset.filter(**filters).update(**{field: F(field) - quantity}) == 1
+
+
+def _stock_changed(drug, old_stock):
+    """Queryset updates skip signals, so tell the summary, cache and open pages here."""
+    summary.stock_changed(drug, old_stock)
+    caching.changed(Drug)
+    events.changed(Drug, drug.pk)
+
+
+def _take_drugs(wanted):
+    """
+    Decrement several drugs, ``{drug_id: quantity}``, in one UPDATE that only
+    touches rows with enough stock. Returns False unless every drug had
+    enough, in which case the caller must roll back.
+    """
+    available = Q()
+    for drug_id, quantity in wanted.items():
+        available |= Q(pk=drug_id, stock__gte=quantity)
+    new_stock = Case(*[When(pk=drug_id, then=F('stock') - quantity) for drug_id, quantity in wanted.items()],
+                     default=F('stock'), output_field=FloatField())
+    return Drug.objects.filter(available).update(stock=new_stock) == len(wanted)
+
+
+def sell(drug, quantity, client, seller):
+    """
+    Sell ``quantity`` of ``drug`` and record the Sale in the same transaction.
+    """
+    with transaction.atomic():
+        if not _take(Drug.objects.filter(pk=drug.pk), 'stock', quantity):
+            raise InsufficientStock('Not enough stock available')
+        drug.refresh_from_db(fields=['stock'])
+        _stock_changed(drug, drug.stock + quantity)
+        ledger.record(ledger.movement(StockMovement.SALE, drug, -quantity, drug.stock, seller, client))
+
+        sale = Sale.objects.create(
+            seller=seller,
+            drug=drug,
+            drug_sold=drug.name,
+            client=client,
+            batch_no=drug.batch_no,
+            quantity=quantity,
+            remaining_quantity=drug.stock
+        )
+        rollup.record([sale])
+        return sale
+
+
+def sell_order(lines, client, seller):
+    """
+    Sell several drugs to one client in a single transaction.
+
+    ``lines`` is an iterable of ``(drug_id, quantity)``; repeated drugs are
+    merged. Every line is checked and decremented by one guarded UPDATE and
+    the Sale rows are written with one ``bulk_create``. If any line is short
+    nothing is written and InsufficientStock lists the short drugs. Raises
+    ValueError for a line whose quantity isn't positive.
+    """
+    wanted = {}
+    for drug_id, quantity in lines:
+        _check_quantity(quantity)
+        wanted[drug_id] = wanted.get(drug_id, 0) + quantity
+    if not wanted:
+        return []
+
+    try:
+        with transaction.atomic():
+            if not _take_drugs(wanted):
+                raise InsufficientStock
+            drugs = Drug.objects.in_bulk(list(wanted))
+            for drug_id, quantity in wanted.items():
+                _stock_changed(drugs[drug_id], drugs[drug_id].stock + quantity)
+            ledger.record(*[
+                ledger.movement(StockMovement.SALE, drugs[drug_id], -quantity, drugs[drug_id].stock, seller, client)
+                for drug_id, quantity in wanted.items()
+            ])
+
+            sales = Sale.objects.bulk_create([
+                Sale(
+                    seller=seller,
+                    drug=drugs[drug_id],
+                    drug_sold=drugs[drug_id].name,
+                    client=client,
+                    batch_no=drugs[drug_id].batch_no,
+                    quantity=quantity,
+                    remaining_quantity=drugs[drug_id].stock
+                )
+                for drug_id, quantity in wanted.items()
+            ])
+            rollup.record(sales)
+            return sales
+    except InsufficientStock:
+        # Rolled back; report which lines could not be filled.
+        drugs = Drug.objects.in_bulk(list(wanted))
+        short = [
+            drugs[drug_id].name if drug_id in drugs else f'#{drug_id}'
+            for drug_id, quantity in wanted.items()
+            if drug_id not in drugs or drugs[drug_id].stock < quantity
+        ]
+        raise InsufficientStock(f'Not enough stock available for {", ".join(short)}') from None
+
+
+def fefo_batches(name, day=None):
+    """
+    The in-stock, unexpired batches of product ``name``, first expiry first
+    and batches without an expiry date last. Served by drug_fefo_idx.
+    """
+    day = day or summary.today()
+    return (
+        Drug.objects.filter(name=name, stock__gt=0)
+        .filter(Q(expiry_date__gte=day) | Q(expiry_date__isnull=True))
+        .order_by(F('expiry_date').asc(nulls_last=True), 'id')
+    )
+
+
+def allocate(name, quantity, day=None):
+    """
+    Split ``quantity`` of product ``name`` across its batches, first expiry
+    first (FEFO), reading them in one query. Returns ``[(drug, quantity)]``
+    and raises InsufficientStock when the batches hold too little together.
+    """
+    _check_quantity(quantity)
+    plan, left = [], quantity
+    for drug in fefo_batches(name, day):
+        if left <= 0:
+            break
+        take = min(drug.stock, left)
+        plan.append((drug, take))
+        left -= take
+    if left > 0:
+        raise InsufficientStock(f'Only {quantity - left:g} {name} in stock before expiry, {quantity:g} wanted')
+    return plan
+
+
+def _take_fefo(name, quantity):
+    """
+    Allocate ``quantity`` of ``name`` and take it from the batches. When
+    another sale emptied a chosen batch in between, allocate again.
+    """
+    for attempt in range(FEFO_ATTEMPTS):
+        plan = allocate(name, quantity)
+        with transaction.atomic():
+            if _take_drugs({drug.pk: take for drug, take in plan}):
+                break
+            transaction.set_rollback(True)
+    else:
+        raise InsufficientStock(f'{name} stock kept changing, please try again')
+
+    drugs = Drug.objects.in_bulk([drug.pk for drug, _ in plan])
+    for drug, take in plan:
+        _stock_changed(drugs[drug.pk], drugs[drug.pk].stock + take)
+    return [(drugs[drug.pk], take) for drug, take in plan]
+
+
+def sell_product(name, quantity, client, seller):
+    """
+    Sell ``quantity`` of product ``name`` from its batches in FEFO order, one
+    Sale per batch used, in one transaction.
+    """
+    with transaction.atomic():
+        plan = _take_fefo(name, quantity)
+        ledger.record(*[ledger.movement(StockMovement.SALE, drug, -take, drug.stock, seller, client)
+                        for drug, take in plan])
+        sales = Sale.objects.bulk_create([
+            Sale(
+                seller=seller,
+                drug=drug,
+                drug_sold=drug.name,
+                client=client,
+                batch_no=drug.batch_no,
+                quantity=take,
+                remaining_quantity=drug.stock
+            )
+            for drug, take in plan
+        ])
+        rollup.record(sales)
+        return sales
+
+
+def lock_expiry(client):
+    """
+    When a lock made now for ``client`` expires: after the client's
+    LockPolicy if there is one, else after settings.LOCK_TTL_HOURS.
+    """
+    ttl = None
+    if client:
+        ttl = LockPolicy.objects.filter(client__iexact=client.strip()).values_list('ttl', flat=True).first()
+    if ttl is None:
+        ttl = timedelta(hours=settings.LOCK_TTL_HOURS)
+    return timezone.now() + ttl
+
+
+def lock_product(name, quantity, client, locked_by):
+    """
+    Lock ``quantity`` of product ``name`` for ``client`` in FEFO order, one
+    LockedProduct per batch used.
+    """
+    with transaction.atomic():
+        expires_at = lock_expiry(client)
+        plan = _take_fefo(name, quantity)
+        ledger.record(*[ledger.movement(StockMovement.LOCK, drug, -take, drug.stock, locked_by, client)
+                        for drug, take in plan])
+        return [
+            LockedProduct.objects.create(drug=drug, locked_by=locked_by, quantity=take, client=client,
+                                         expires_at=expires_at)
+            for drug, take in plan
+        ]
+
+
+def pick_product(name, quantity, client):
+    """
+    Add ``quantity`` of product ``name`` to the picking list in FEFO order,
+    one line per batch. Like a single-batch pick it leaves stock alone.
+    """
+    with transaction.atomic():
+        return [
+            PickingList.objects.create(
+                date=timezone.now(), client=client, drug=drug, product=drug.name,
+                batch_no=drug.batch_no, quantity=take)
+            for drug, take in allocate(name, quantity)
+        ]
+
+
+def lock(drug, quantity, client, locked_by):
+    """
+    Reserve ``quantity`` of ``drug`` for ``client`` by moving it out of stock.
+    """
+    with transaction.atomic():
+        if not _take(Drug.objects.filter(pk=drug.pk), 'stock', quantity):
+            raise InsufficientStock('Not enough stock to lock')
+        drug.refresh_from_db(fields=['stock'])
+        _stock_changed(drug, drug.stock + quantity)
+        ledger.record(ledger.movement(StockMovement.LOCK, drug, -quantity, drug.stock, locked_by, client))
+
+        return LockedProduct.objects.create(
+            drug=drug,
+            locked_by=locked_by,
+            quantity=quantity,
+            client=client,
+            expires_at=lock_expiry(client)
+        )
+
+
+def unlock(locked, unlocked_by=None):
+    """
+    Release a lock and put its quantity back into stock. Returns False when
+    the lock had already been released or posted by someone else.
+    """
+    with transaction.atomic():
+        deleted, _ = LockedProduct.objects.filter(pk=locked.pk).delete()
+        if not deleted:
+            return False
+        if locked.quantity:
+            Drug.objects.filter(pk=locked.drug_id).update(stock=F('stock') + locked.quantity)
+            drug = Drug.objects.get(pk=locked.drug_id)
+            _stock_changed(drug, drug.stock - locked.quantity)
+            ledger.record(ledger.movement(
+                StockMovement.UNLOCK, drug, locked.quantity, drug.stock, unlocked_by, locked.client))
+    return True
+
+
+def expire_locks(now=None):
+    """
+    Release every lock whose expiry has passed, putting the quantities back
+    into stock with one UPDATE across the drugs and removing the locks with
+    one DELETE. Returns ``(released, seconds)``.
+    """
+    started = time.perf_counter()
+    now = now or timezone.now()
+    with transaction.atomic():
+        # The transaction holds SQLite's write lock from the start, so no
+        # lock can be posted or unlocked between the sum and the delete.
+        expired = LockedProduct.objects.filter(expires_at__lte=now)
+        restore = dict(expired.filter(quantity__gt=0).order_by().values('drug')
+                       .annotate(total=Sum('quantity')).values_list('drug', 'total'))
+        released_ids = list(expired.values_list('pk', flat=True))
+        if not released_ids:
+            return 0, time.perf_counter() - started
+        # A queryset delete would fetch the rows again to send post_delete one
+        # by one; what the receivers do (counter, cache, events) is done below.
+        table, column = LockedProduct._meta.db_table, LockedProduct._meta.get_field('expires_at').column
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {connection.ops.quote_name(table)} WHERE {connection.ops.quote_name(column)} <= %s',
+                [connection.ops.adapt_datetimefield_value(now)])
+        released = len(released_ids)
+
+        if restore:
+            Drug.objects.filter(pk__in=restore).update(stock=Case(
+                *[When(pk=pk, then=F('stock') + total) for pk, total in restore.items()],
+                output_field=FloatField()))
+            changes, movements = [], []
+            for drug in Drug.objects.filter(pk__in=restore).only('stock', 'reorder_level', 'expiry_date'):
+                after = (drug.stock, drug.reorder_level, drug.expiry_date)
+                changes.append(((drug.stock - restore[drug.pk],) + after[1:], after))
+                movements.append(ledger.movement(StockMovement.EXPIRE, drug, restore[drug.pk], drug.stock))
+            summary.drugs_changed(changes)
+            ledger.record(*movements)
+        summary.adjust(locked_products=-released)
+        caching.changed(Drug, LockedProduct)
+        for pk in restore:
+            events.changed(Drug, pk)
+        for pk in released_ids:
+            events.changed(LockedProduct, pk)
+    return released, time.perf_counter() - started
+
+
+def post_locked(locked, seller):
+    """
+    Turn a lock into a Sale. The stock already left with the lock, so only the
+    lock row is removed. Returns None when the lock is already gone.
+    """
+    with transaction.atomic():
+        deleted, _ = LockedProduct.objects.filter(pk=locked.pk).delete()
+        if not deleted:
+            return None
+        drug = Drug.objects.get(pk=locked.drug_id)
+        # The stock left with the lock; this only records what became of it.
+        ledger.record(ledger.movement(StockMovement.POST, drug, 0, drug.stock, seller, locked.client))
+
+        sale = Sale.objects.create(
+            seller=seller,
+            drug=drug,
+            drug_sold=drug.name,
+            client=locked.client,
+            batch_no=drug.batch_no,
+            quantity=locked.quantity,
+            remaining_quantity=drug.stock
+        )
+        rollup.record([sale])
+        return sale
+
+
+def add_stock(drug, amount, supplier, staff):
+    """
+    Receive ``amount`` of ``drug`` and record the Stocked row with the new total.
+    """
+    _check_quantity(amount)
+    with transaction.atomic():
+        Drug.objects.filter(pk=drug.pk).update(stock=F('stock') + amount)
+        drug.refresh_from_db(fields=['stock'])
+        _stock_changed(drug, drug.stock - amount)
+        ledger.record(ledger.movement(StockMovement.RECEIPT, drug, amount, drug.stock, staff, supplier))
+
+        return Stocked.objects.create(
+            drug_name=drug, supplier=supplier, staff=staff, number_added=amount, total=drug.stock)
+
+
+def issue_item(item, quantity, issued_to, issued_by):
+    """
+    Issue ``quantity`` of a marketing item and record the IssuedItem.
+    """
+    with transaction.atomic():
+        if not _take(MarketingItem.objects.filter(pk=item.pk), 'stock', quantity):
+            raise InsufficientStock(f'Cannot issue more than the available stock for {item.name}.')
+        item.refresh_from_db(fields=['stock'])
+        caching.changed(MarketingItem)
+        ledger.record(ledger.movement(StockMovement.ISSUE, item, -quantity, item.stock, issued_by, issued_to))
+
+        return IssuedItem.objects.create(
+            item=item.name,
+            stock=item.stock,
+            issued_to=issued_to,
+            quantity_issued=quantity,
+            issued_by=issued_by,
+        )
+
+
+def issue_cannister(cannister, quantity, client, staff):
+    """
+    Issue ``quantity`` cannisters to ``client`` and record the IssuedCannister.
+    """
+    with transaction.atomic():
+        if not _take(Cannister.objects.filter(pk=cannister.pk), 'stock', quantity):
+            raise InsufficientStock(f'Not enough {cannister.name} in stock')
+        cannister.refresh_from_db(fields=['stock'])
+        caching.changed(Cannister)
+        ledger.record(ledger.movement(StockMovement.ISSUE, cannister, -quantity, cannister.stock, staff, client))
+        events.changed(Cannister, cannister.pk)
+
+        return IssuedCannister.objects.create(
+            name=cannister.name,
+            batch_no=cannister.batch_no,
+            staff_on_duty=staff,
+            client=client,
+            quantity=quantity,
+            balance=cannister.stock
+        )
+
+
+def return_cannister(issued, returned_by):
+    """
+    Mark an issued cannister as returned and restore its stock. Returns False
+    when it had already been returned.
+    """
+    with transaction.atomic():
+        returned = IssuedCannister.objects.filter(pk=issued.pk, action=False).update(
+            action=True, returned_by=returned_by, date_returned=timezone.now())
+        if not returned:
+            return False
+        cannisters = Cannister.objects.filter(batch_no=issued.batch_no)
+        cannisters.update(stock=F('stock') + issued.quantity)
+        caching.changed(IssuedCannister, Cannister)
+        returned = list(cannisters.only('stock'))
+        ledger.record(*[
+            ledger.movement(StockMovement.RETURN, cannister, issued.quantity, cannister.stock, returned_by, issued.client)
+            for cannister in returned
+        ])
+        for cannister in returned:
+            events.changed(Cannister, cannister.pk)
+    return True
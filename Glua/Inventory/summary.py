@@ -0,0 +1,125 @@
+from datetime import timedelta
+
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import replica
+from .models import Drug, LockedProduct, MarketingItem, PickingList, Cannister, InventorySummary
+
+SUMMARY_ID = 1
+
+# Matches the "expiring soon" window on the dashboard.
+EXPIRING_WINDOW = timedelta(days=180)
+
+# Row counters that follow inserts and deletes of these models.
+ROW_COUNTERS = {
+    LockedProduct: 'locked_products',
+    MarketingItem: 'marketing_items',
+    PickingList: 'picking_list',
+    Cannister: 'cannisters',
+}
+
+
+def today():
+    return timezone.now().date()
+
+
+def drug_buckets(stock, reorder_level, expiry_date, day):
+    """
+    The dashboard counters a single drug batch contributes to on ``day``.
+    """
+    in_stock = stock > 0
+    return {
+        'total_products': 1,
+        'low_stock': int(in_stock and stock <= reorder_level),
+        'out_of_stock': int(stock == 0),
+        'zero_stock': int(stock <= 5),
+        'expired': int(in_stock and expiry_date is not None and expiry_date < day),
+        'expiring_soon': int(in_stock and expiry_date is not None and day < expiry_date <= day + EXPIRING_WINDOW),
+    }
+
+
+def rebuild(day=None):
+    """
+    Recount every counter from the source tables and store it as of ``day``.
+    This is the daily expiry rollover and the fallback for a missing row.
+    """
+    day = day or today()
+    in_stock = Q(stock__gt=0)
+    # Counted on the primary even in report views: the row is stored there.
+    with replica.primary():
+        drugs = Drug.objects.aggregate(
+            total_products=Count('id'),
+            low_stock=Count('id', filter=in_stock & Q(stock__lte=F('reorder_level'))),
+            out_of_stock=Count('id', filter=Q(stock=0)),
+            zero_stock=Count('id', filter=Q(stock__lte=5)),
+            expired=Count('id', filter=in_stock & Q(expiry_date__lt=day)),
+            expiring_soon=Count('id', filter=in_stock & Q(expiry_date__gt=day, expiry_date__lte=day + EXPIRING_WINDOW)),
+        )
+        for model, field in ROW_COUNTERS.items():
+            drugs[field] = model.objects.count()
+
+    summary, _ = InventorySummary.objects.update_or_create(pk=SUMMARY_ID, defaults=dict(as_of=day, **drugs))
+    return summary
+
+
+def get_summary():
+    """
+    Return the summary row, rolling it over first if it is from an earlier day.
+    """
+    summary = InventorySummary.objects.filter(pk=SUMMARY_ID).first()
+    if summary is None or summary.as_of != today():
+        summary = rebuild()
+    return summary
+
+
+def adjust(**deltas):
+    """
+    Apply counter deltas with one UPDATE. A missing or stale row is rebuilt
+    instead, which already reflects the change being recorded.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    day = today()
+    updated = InventorySummary.objects.filter(pk=SUMMARY_ID, as_of=day).update(
+        **{field: F(field) + delta for field, delta in deltas.items()})
+    if not updated:
+        rebuild(day)
+
+
+def drug_changed(before, after):
+    """
+    Record a drug moving between buckets. ``before``/``after`` are
+    ``(stock, reorder_level, expiry_date)`` tuples, or None for a batch that
+    was created or deleted.
+    """
+    day = today()
+    old = drug_buckets(*before, day) if before else {}
+    new = drug_buckets(*after, day) if after else {}
+    adjust(**{field: new.get(field, 0) - old.get(field, 0) for field in set(old) | set(new)})
+
+
+def drugs_changed(changes):
+    """
+    drug_changed() for many batches at once, ``[(before, after)]``, applied
+    with a single UPDATE.
+    """
+    day = today()
+    totals = {}
+    for before, after in changes:
+        for field, count in (drug_buckets(*before, day) if before else {}).items():
+            totals[field] = totals.get(field, 0) - count
+        for field, count in (drug_buckets(*after, day) if after else {}).items():
+            totals[field] = totals.get(field, 0) + count
+    adjust(**totals)
+
+
+def stock_changed(drug, old_stock):
+    """
+    Record a stock-only change for ``drug``, whose ``stock`` is already the new value.
+    """
+    drug_changed(
+        (old_stock, drug.reorder_level, drug.expiry_date),
+        (drug.stock, drug.reorder_level, drug.expiry_date),
+    )
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.test import tag
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .timing import budget_of
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests against a scratch FileBasedCache, so a test run neither
+    wipes nor reads the developer's cache directory or a shared Redis.
+    Subprocesses find it through CACHE_DIR.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp(prefix='inventory-test-cache-')
+        self.cache_settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.cache_dir,
+            },
+        })
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin: assertWithinQueryBudget(response) fails when the view
+    behind ``response`` ran more queries than its @query_budget allows.
+    Needs RequestTimingMiddleware installed.
+    """
+
+    def assertWithinQueryBudget(self, response):
+        budget = budget_of(response.wsgi_request)
+        if budget is None:
+            self.fail(f'{response.resolver_match.view_name} declares no query budget')
+        timing = response.timing
+        if timing.queries > budget:
+            self.fail(
+                f'{response.resolver_match.view_name} ran {timing.queries} queries, '
+                f'over its budget of {budget}'
+            )
+
+
+def benchmark(test_class):
+    """
+    Tag a slow benchmark and skip it unless RUN_BENCHMARKS is set:
+    ``RUN_BENCHMARKS=1 manage.py test --tag benchmark``. Results go to the
+    ``Inventory.benchmarks`` logger.
+    """
+    skip = skipUnless(os.environ.get('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run benchmarks')
+    return tag('benchmark')(skip(test_class))
@@ -0,0 +1,11 @@
+from ..models import Drug
+
+# InventorySummary counters compared against a full recount.
+SUMMARY_FIELDS = ['total_products', 'low_stock', 'out_of_stock', 'zero_stock', 'expired',
+                  'expiring_soon', 'locked_products', 'marketing_items', 'picking_list', 'cannisters']
+
+
+def make_drug(**kwargs):
+    fields = {'name': 'Newcastle', 'batch_no': 'NC-01', 'stock': 10, 'dose_pack': 1000, 'reorder_level': 2}
+    fields.update(kwargs)
+    return Drug.objects.create(**fields)
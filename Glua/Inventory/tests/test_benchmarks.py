@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import OperationalError, connection, connections
+from django.test import TransactionTestCase
+
+from .. import stock, summary
+from ..models import Drug, Sale, UserPresence
+from ..stock import InsufficientStock
+from ..testing import benchmark
+from Glua import consumers
+from . import make_drug
+
+benchmark_log = logging.getLogger('Inventory.benchmarks')
+
+
+@benchmark
+class ConcurrentSellStressTest(TransactionTestCase):
+    """Hammer one Drug row from many threads and check nothing is lost."""
+    threads = 8
+    sells_per_thread = 50
+    initial_stock = 300
+
+    def test_concurrent_sells_never_oversell(self):
+        user = User.objects.create_user('teller', password='pass')
+        drug = make_drug(stock=self.initial_stock)
+        results = {'sold': 0, 'short': 0}
+        counter_lock = threading.Lock()
+
+        def worker():
+            try:
+                for _ in range(self.sells_per_thread):
+                    try:
+                        stock.sell(Drug.objects.get(pk=drug.pk), 1, 'Farm', user)
+                        outcome = 'sold'
+                    except InsufficientStock:
+                        outcome = 'short'
+                    with counter_lock:
+                        results[outcome] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        started = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        attempts = self.threads * self.sells_per_thread
+        drug.refresh_from_db()
+        self.assertEqual(results['sold'] + results['short'], attempts)
+        self.assertEqual(results['sold'], self.initial_stock)
+        self.assertEqual(drug.stock, 0)
+        self.assertEqual(Sale.objects.count(), self.initial_stock)
+        self.assertEqual(Sale.objects.filter(remaining_quantity__lt=0).count(), 0)
+        benchmark_log.info('%d concurrent sells in %.2fs (%.0f/s)', attempts, elapsed, attempts / elapsed)
+
+
+@benchmark
+class SQLiteWriterBenchmark(TransactionTestCase):
+    """
+    Sell from several threads at once, first with SQLite's defaults (the
+    old settings) and then with the tuned settings, and compare throughput
+    and "database is locked" failures. FEFO sells read before they write,
+    which deferred transactions cannot wait on; a reader thread lists the
+    inventory meanwhile.
+    """
+    threads = 6
+    sells_per_thread = 30
+    # The journal mode is stored in the file, so it is switched once before
+    # the threads start rather than by each connection.
+    untuned = {'transaction_mode': 'DEFERRED', 'pragmas': {'synchronous': 'full'}}
+
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        make_drug(batch_no='NC-1', stock=10000, expiry_date=summary.today() + timedelta(days=30))
+        make_drug(batch_no='NC-2', stock=10000)
+
+    def run_writers(self, options, journal_mode):
+        settings_dict = connection.settings_dict
+        tuned = settings_dict['OPTIONS']
+        # Every thread's connection is opened from this dict.
+        connections.close_all()
+        settings_dict['OPTIONS'] = options
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+        connection.close()
+        results = {'sold': 0, 'locked': 0, 'reads': 0}
+        counter_lock = threading.Lock()
+        done = threading.Event()
+
+        def writer():
+            try:
+                for _ in range(self.sells_per_thread):
+                    try:
+                        stock.sell_product('Newcastle', 1, 'Farm', self.user)
+                        outcome = 'sold'
+                    except OperationalError:
+                        outcome = 'locked'
+                    with counter_lock:
+                        results[outcome] += 1
+            finally:
+                connection.close()
+
+        def reader():
+            try:
+                while not done.is_set():
+                    try:
+                        list(Drug.objects.values_list('stock', flat=True))
+                        with counter_lock:
+                            results['reads'] += 1
+                    except OperationalError:
+                        pass
+            finally:
+                connection.close()
+
+        try:
+            writers = [threading.Thread(target=writer) for _ in range(self.threads)]
+            watcher = threading.Thread(target=reader)
+            started = time.perf_counter()
+            watcher.start()
+            for t in writers:
+                t.start()
+            for t in writers:
+                t.join()
+            elapsed = time.perf_counter() - started
+            done.set()
+            watcher.join()
+        finally:
+            connections.close_all()
+            settings_dict['OPTIONS'] = tuned
+        return results, elapsed
+
+    def test_tuned_settings_do_not_lock(self):
+        attempts = self.threads * self.sells_per_thread
+        report = []
+        tuned = connection.settings_dict['OPTIONS']
+        for label, options, journal_mode in (('defaults', self.untuned, 'delete'),
+                                             ('tuned', tuned, tuned['pragmas']['journal_mode'])):
+            results, elapsed = self.run_writers(options, journal_mode)
+            self.assertEqual(results['sold'] + results['locked'], attempts)
+            report.append(f'{label}: {results["sold"] / elapsed:.0f} sells/s, {results["locked"]} locked, '
+                          f'{results["reads"]} reads in {elapsed:.2f}s')
+        benchmark_log.info('; '.join(report))
+
+        self.assertEqual(results['locked'], 0, '; '.join(report))
+        # Nothing sold twice or lost, in either run
+        self.assertEqual(Sale.objects.count(), 20000 - sum(Drug.objects.values_list('stock', flat=True)))
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+
+@benchmark
+class PresenceBroadcastBenchmark(TransactionTestCase):
+    """
+    500 websocket clients each announce themselves at once; every client
+    should get the whole roster in a few batched messages, not 500.
+    """
+    clients = 500
+    interval = 0.2
+
+    def setUp(self):
+        User.objects.bulk_create([User(username=f'user{n:03}') for n in range(self.clients)])
+        self.users = list(User.objects.order_by('username'))
+        consumers.broadcaster.interval = self.interval
+
+    def tearDown(self):
+        consumers.broadcaster.interval = 1.0
+
+    def connect(self, user):
+        scope = {'type': 'websocket', 'path': '/ws/user_status/', 'headers': [], 'subprotocols': [], 'user': user}
+        return ApplicationCommunicator(consumers.UserStatusConsumer.as_asgi(), scope)
+
+    async def open(self, socket):
+        await socket.send_input({'type': 'websocket.connect'})
+        return (await socket.receive_output(timeout=10))['type'] == 'websocket.accept'
+
+    async def send(self, socket, data):
+        await socket.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def roster(self, socket, usernames):
+        statuses, messages = {}, 0
+        while set(statuses) != usernames:
+            statuses.update(json.loads((await socket.receive_output(timeout=10))['text'])['changes'])
+            messages += 1
+        return messages
+
+    async def run_clients(self):
+        self.assertFalse(await self.open(self.connect(AnonymousUser())))
+
+        sockets = [self.connect(user) for user in self.users]
+        self.assertTrue(all(await asyncio.gather(*(self.open(socket) for socket in sockets))))
+        started = time.monotonic()
+        await asyncio.gather(*(self.send(socket, {'status': 'online', 'user': 'spoofed'}) for socket in sockets))
+        usernames = {user.username for user in self.users}
+        messages = await asyncio.gather(*(self.roster(socket, usernames) for socket in sockets))
+        elapsed = time.monotonic() - started
+        for socket in sockets:
+            await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await socket.wait()
+        return messages, elapsed
+
+    def test_status_changes_are_batched(self):
+        messages, elapsed = async_to_sync(self.run_clients)()
+        report = f'{self.clients} clients: roster delivered in {max(messages)} message(s) per client, {elapsed:.2f}s'
+        benchmark_log.info(report)
+        self.assertLessEqual(max(messages), elapsed / self.interval + 1, report)
+        self.assertEqual(UserPresence.objects.filter(offline_since__isnull=True).count(), self.clients)
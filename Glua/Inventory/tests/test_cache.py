@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import caching, stock
+from ..models import Drug, MarketingItem
+
+
+class ViewCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('teller', password='pass')
+        self.client.login(username='teller', password='pass')
+        self.client.get(reverse('home'))  # the first visit stores modal_shown
+        self.drug = Drug.objects.create(name='Newcastle', batch_no='NC-01', stock=0, dose_pack=1, reorder_level=5)
+
+    def queries(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name))
+        return response, len(queries)
+
+    def test_repeat_views_skip_the_cached_queries(self):
+        for name in ('home', 'stocking', 'out_of_stock', 'low_stock', 'expiring_soon', 'marketing_items', 'dashboard'):
+            _, first = self.queries(name)
+            _, second = self.queries(name)
+            self.assertLess(second, first, name)
+
+    def test_writes_invalidate_cached_pages(self):
+        response, _ = self.queries('out_of_stock')
+        self.assertContains(response, 'NC-01')
+
+        stock.add_stock(self.drug, 10, 'Kevevapi', User.objects.get())
+        response, _ = self.queries('out_of_stock')
+        self.assertNotContains(response, 'NC-01')
+        response, _ = self.queries('home')
+        self.assertEqual(response.context['drugs'][0].stock, 10)
+
+        Drug.objects.create(name='Gumboro', batch_no='GB-01', stock=0, dose_pack=1, reorder_level=5)
+        self.assertContains(self.client.get(reverse('out_of_stock')), 'GB-01')
+
+        MarketingItem.objects.create(name='Calendar', stock=3)
+        self.assertContains(self.client.get(reverse('marketing_items')), 'Calendar')
+
+    def test_sales_invalidate_the_top_sold_table(self):
+        self.assertNotContains(self.client.get(reverse('dashboard')), '?search=Newcastle')
+        stock.add_stock(self.drug, 10, 'Kevevapi', User.objects.get())
+        stock.sell_order([(self.drug.pk, 4)], 'Farm A', User.objects.get())
+        self.assertContains(self.client.get(reverse('dashboard')), '?search=Newcastle')
+
+    def test_bumps_reach_other_workers(self):
+        before = caching.versions(Drug)
+        # Another worker process, with its own connection to the test cache
+        env = dict(os.environ, CACHE_DIR=settings.CACHES['default']['LOCATION'])
+        env.pop('REDIS_URL', None)
+        subprocess.run(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'shell', '-c',
+             'from Inventory import caching; from Inventory.models import Drug; caching.bump(Drug)'],
+            check=True, capture_output=True, env=env)
+        self.assertNotEqual(caching.versions(Drug), before)
+
+    def test_lost_version_keys_do_not_revive_old_entries(self):
+        before = caching.versions(Drug)
+        cache.delete(f'inventory:version:{Drug._meta.label_lower}')
+        self.assertNotEqual(caching.versions(Drug), before)
@@ -0,0 +1,71 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from .. import exports, fulltext, ledger, rollup, summary
+from ..models import Drug, Sale, Stocked, LockedProduct, MarketingItem, Cannister, IssuedCannister, StockMovement
+from ..management.commands import seed_data
+
+
+class SeedAndBenchmarkCommandTests(TestCase):
+    def seed(self, **counts):
+        options = dict(drugs=20, sales=300, stocked=30, locks=5, issued_items=10, picking=10, cannisters=4,
+                       issued_cannisters=10, staff=3, batch_size=100, seed=7)
+        options.update(counts)
+        call_command('seed_data', stdout=StringIO(), **options)
+
+    def test_seed_data(self):
+        self.seed()
+        self.assertEqual(Drug.objects.count(), 20)
+        self.assertEqual(Sale.objects.count(), 300)
+        self.assertEqual(LockedProduct.objects.count(), 5)
+        self.assertEqual(IssuedCannister.objects.count(), 10)
+        # Generated dates are kept, not replaced by auto_now_add
+        self.assertGreater(Sale.objects.dates('date_sold', 'day').count(), 100)
+        self.assertFalse(Sale.objects.filter(drug__isnull=True).exists())
+        self.assertEqual(rollup.totals()['total_sales'], 300)
+        self.assertEqual(summary.get_summary().total_products, 20)
+        self.assertEqual(fulltext.matching(Sale.objects.all(), 'SD-00000').count(),
+                         Sale.objects.filter(batch_no__startswith='SD-00000').count())
+
+        # Every seeded item opens its ledger at its stock
+        for model in (Drug, Cannister, MarketingItem):
+            self.assertEqual(StockMovement.objects.filter(item_type=ledger.ITEM_TYPES[model]).count(),
+                             model.objects.count())
+        for drug in Drug.objects.all():
+            self.assertEqual(ledger.balance(drug), drug.stock)
+
+        self.seed(drugs=5, sales=10)
+        self.assertEqual(User.objects.filter(username__startswith='seed_staff_').count(), 3)
+        self.assertEqual(Drug.objects.values('batch_no').distinct().count(), 25)
+
+    def test_benchmark_views(self):
+        self.seed()
+        User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        out = StringIO()
+        call_command('benchmark_views', 'dashboard', 'home', 'unlock_product', 'export_report',
+                     repeat=2, stdout=out, stderr=StringIO())
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('URL'))
+        rows = {line.split()[0]: line.split() for line in lines[1:]}
+        exported = {f'export_report:{kind}' for kind in exports.EXPORTS}
+        self.assertEqual(set(rows), {'dashboard', 'home', 'unlock_product'} | exported)
+        self.assertEqual(rows['dashboard'][1], '200')
+        self.assertEqual(rows['dashboard'][5], '10')
+        # Requests are rolled back, even the ones that change stock
+        self.assertEqual(LockedProduct.objects.count(), 5)
+
+    def test_benchmark_views_needs_a_timed_request(self):
+        with self.assertRaisesMessage(CommandError, '--repeat must be at least 1'):
+            call_command('benchmark_views', repeat=0, stdout=StringIO())
+
+    def test_keep_dates_restores_auto_now_add(self):
+        added = Stocked._meta.get_field('date_added')
+        with self.assertRaises(RuntimeError):
+            with seed_data.keep_dates(added):
+                self.assertFalse(added.auto_now_add)
+                raise RuntimeError
+        self.assertTrue(added.auto_now_add)
@@ -0,0 +1,115 @@
+import json
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from .. import caching, events, stock, summary
+from ..models import Drug, LockedProduct
+from ..stock import InsufficientStock
+from Glua import consumers
+
+
+class InventoryEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        # bulk_create skips signals, so no change batch is pending before the test
+        self.drug, self.other = Drug.objects.bulk_create([
+            Drug(name='Newcastle', batch_no='NC-01', stock=10, dose_pack=1000, reorder_level=2),
+            Drug(name='Gumboro', batch_no='GB-01', stock=10, dose_pack=1000, reorder_level=2),
+        ])
+        # Earlier TestCase tests never commit, so their batch is still on the connection
+        connection.inventory_batch = None
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(events.INVENTORY_GROUP, self.channel)
+
+    def tearDown(self):
+        async_to_sync(self.layer.flush)()
+
+    def received(self):
+        messages = []
+        queue = self.layer.channels.get(self.channel)
+        while queue is not None and not queue.empty():
+            messages.append(queue.get_nowait()[1])
+        return messages
+
+    def test_one_message_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.sell_order([(self.drug.pk, 2), (self.other.pk, 1)], 'Farm A', self.user)
+        [message] = self.received()
+        self.assertEqual(message['drugs'][str(self.drug.pk)]['stock'], 8)
+        self.assertEqual(message['drugs'][str(self.other.pk)]['stock'], 9)
+        self.assertEqual(message['counters']['total_products'], 2)
+
+    def test_expired_locks_are_published(self):
+        cache.clear()
+        locked, kept = LockedProduct.objects.bulk_create([
+            LockedProduct(drug=self.drug, locked_by=self.user, quantity=3, client='Farm A',
+                          expires_at=timezone.now() - timedelta(minutes=1)),
+            LockedProduct(drug=self.drug, locked_by=self.user, quantity=1, client='Farm B',
+                          expires_at=timezone.now() + timedelta(hours=1)),
+        ])
+        summary.rebuild()
+        before = caching.versions(LockedProduct, Drug)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(stock.expire_locks()[0], 1)
+        [message] = self.received()
+        self.assertEqual(message['locks'], {str(locked.pk): None})
+        self.assertEqual(message['drugs'][str(self.drug.pk)]['stock'], 13)
+        self.assertEqual(message['counters']['locked_products'], 1)
+        self.assertNotEqual(caching.versions(LockedProduct, Drug), before)
+        self.assertEqual(LockedProduct.objects.get().pk, kept.pk)
+
+    def test_rolled_back_savepoint_keeps_the_batch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                with self.assertRaises(InsufficientStock):
+                    with transaction.atomic():
+                        events.changed(Drug, self.other.pk)
+                        raise InsufficientStock
+                events.changed(Drug, self.drug.pk)
+        [message] = self.received()
+        self.assertIn(str(self.drug.pk), message['drugs'])
+
+    def test_rollback_sends_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(InsufficientStock):
+                stock.sell_order([(self.drug.pk, 2), (self.other.pk, 50)], 'Farm A', self.user)
+        self.assertEqual(self.received(), [])
+
+
+class InventoryConsumerTests(TransactionTestCase):
+    # Channels closes the connection of an open TestCase transaction on dispatch.
+
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        self.layer = get_channel_layer()
+
+    def test_consumer_coalesces_per_drug(self):
+        async def run():
+            scope = {'type': 'websocket', 'path': '/ws/inventory/', 'headers': [], 'subprotocols': [],
+                     'user': self.user}
+            socket = ApplicationCommunicator(consumers.InventoryConsumer.as_asgi(), scope)
+            await socket.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await socket.receive_output(timeout=5))['type'], 'websocket.accept')
+            for remaining in (7, 6, 5):
+                await self.layer.group_send(events.INVENTORY_GROUP, {
+                    'type': 'inventory.changes', 'drugs': {'1': {'stock': remaining}}, 'cannisters': {},
+                    'locks': {}, 'counters': {'low_stock': remaining}})
+            payload = json.loads((await socket.receive_output(timeout=5))['text'])
+            self.assertTrue(await socket.receive_nothing(timeout=consumers.InventoryConsumer.flush_interval * 2))
+            await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await socket.wait()
+            return payload
+
+        payload = async_to_sync(run)()
+        self.assertEqual(payload['drugs'], {'1': {'stock': 5}})
+        self.assertEqual(payload['counters'], {'low_stock': 5})
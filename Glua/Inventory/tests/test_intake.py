@@ -0,0 +1,115 @@
+import os
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import fulltext, intake, summary
+from ..models import Drug, Stocked, InventorySummary
+from . import make_drug, SUMMARY_FIELDS
+
+
+class StockIntakeTests(TestCase):
+    delivery = (
+        'Name,Batch,Expiry,Quantity,Supplier,Dose_Pack,Reorder_Level\n'
+        'Newcastle,NC-01,2027-06-30,5,kevevapi,,\n'
+        'Newcastle,NC-02,2027-01-01,20,kevevapi,,\n'
+        'Newcastle,NC-02,,5,kevevapi,,\n'
+        'Gumboro,GB-09,2027-02-01,7,ceva,,\n'
+        'Gumboro,GB-10,2027-02-01,7,ceva,500,3\n'
+        'Newcastle,NC-01,2028-01-01,1,kevevapi,,\n'
+        'Newcastle,,2027-01-01,x,kevevapi,,\n'
+        'Newcastle,NC-03,31/12/2027,1,kevevapi,,\n'
+        'Newcastle,NC-05,2027-01-01,lots,kevevapi,,\n'
+        'Newcastle,NC-04,2027-01-01,2.5,kevevapi,,\n'
+        ',,,,,,\n'
+    )
+
+    def setUp(self):
+        self.user = User.objects.create_user('storekeeper', password='pass')
+        self.drug = make_drug(expiry_date=timezone.datetime(2027, 6, 30).date())
+        summary.rebuild()
+
+    def receive(self, dry_run=False):
+        return intake.import_csv(StringIO(self.delivery), self.user, dry_run=dry_run)
+
+    def test_receives_valid_lines_and_reports_the_rest(self):
+        with CaptureQueriesContext(connection) as queries:
+            report = self.receive()
+        self.assertLess(len(queries), 20)
+
+        self.assertEqual(report.rejected, [
+            (5, 'Gumboro is a new product: give dose_pack and reorder_level'),
+            (7, 'expiry differs from batch NC-01 on record (2027-06-30)'),
+            (8, 'name and batch are required'),
+            (9, 'expiry "31/12/2027" is not a YYYY-MM-DD date'),
+            (10, 'quantity must be a number'),
+            (11, 'quantity must be a whole number'),
+        ])
+        self.assertEqual((report.lines, report.stocked, report.created, report.quantity), (10, 4, 2, 37))
+
+        stocks = dict(Drug.objects.values_list('batch_no', 'stock'))
+        self.assertEqual(stocks, {'NC-01': 15, 'NC-02': 25, 'GB-10': 7})
+        new = Drug.objects.get(batch_no='NC-02')
+        self.assertEqual((new.dose_pack, new.reorder_level), (self.drug.dose_pack, self.drug.reorder_level))
+        self.assertEqual(list(Stocked.objects.order_by('id').values_list('drug_name__batch_no', 'total', 'supplier')), [
+            ('NC-01', 15, 'Kevevapi'), ('NC-02', 20, 'Kevevapi'), ('NC-02', 25, 'Kevevapi'), ('GB-10', 7, 'Ceva'),
+        ])
+        self.assertEqual(fulltext.matching(Drug.objects.all(), 'GB-10').get().name, 'Gumboro')
+
+        fields = SUMMARY_FIELDS
+        maintained = InventorySummary.objects.values(*fields).get()
+        self.assertEqual(maintained, InventorySummary.objects.values(*fields).get(pk=summary.rebuild().pk))
+
+    def test_dry_run_writes_nothing(self):
+        report = self.receive(dry_run=True)
+        self.assertEqual((report.stocked, len(report.rejected)), (4, 6))
+        self.assertEqual(Drug.objects.count(), 1)
+        self.assertFalse(Stocked.objects.exists())
+
+    def test_non_finite_and_huge_numbers_are_rejected(self):
+        lines, report = intake.read(StringIO(
+            'name,batch,expiry,quantity,supplier,dose_pack\n'
+            'Newcastle,NC-01,,NaN,kevevapi,\n'
+            'Newcastle,NC-01,,Infinity,kevevapi,\n'
+            'Newcastle,NC-01,,-inf,kevevapi,\n'
+            'Newcastle,NC-01,,1e400,kevevapi,\n'
+            'Newcastle,NC-01,,5,kevevapi,nan\n'
+            'Newcastle,NC-01,,5,kevevapi,\n'
+        ))
+        self.assertEqual([line.quantity for line in lines], [5])
+        self.assertEqual(report.rejected, [
+            (2, 'quantity must be a number'),
+            (3, 'quantity must be a number'),
+            (4, 'quantity must be a number'),
+            (5, f'quantity must be at most {intake.MAX_NUMBER}'),
+            (6, 'dose_pack must be a number'),
+        ])
+
+    def test_missing_columns(self):
+        with self.assertRaisesMessage(intake.IntakeError, 'Missing column(s): expiry, supplier.'):
+            intake.import_csv(StringIO('name,batch,quantity\nNewcastle,NC-01,1\n'), self.user)
+
+    def test_command_and_upload(self):
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(self.delivery)
+        self.addCleanup(os.remove, file.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_stock', file.name, user='storekeeper', stdout=out, stderr=err)
+        self.assertIn('Received 37 units on 4 lines (2 new batches); 6 of 10 lines rejected.', out.getvalue())
+        self.assertIn('line 10: quantity must be a number', err.getvalue())
+
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('delivery.csv', self.delivery.encode('utf-8-sig'), content_type='text/csv')
+        response = self.client.post(reverse('stock_intake'), {'file': upload, 'dry_run': 'on'})
+        self.assertContains(response, 'Would receive')
+        # Gumboro is known now, so its first batch no longer needs dose_pack and reorder_level
+        self.assertEqual(response.context['report'].quantity, 44)
+        self.assertEqual(Drug.objects.get(batch_no='NC-01').stock, 15)
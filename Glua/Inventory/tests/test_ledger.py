@@ -0,0 +1,79 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import intake, ledger, stock
+from ..models import Drug, LockedProduct, MarketingItem, Cannister
+from ..stock import InsufficientStock
+from . import make_drug
+
+
+class StockMovementTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        self.drug = make_drug()
+
+    def assertLedger(self, item, kinds):
+        movements = list(ledger.history(item))
+        self.assertEqual([movement.kind for movement in movements], kinds)
+        running = 0
+        for movement in movements:
+            running += movement.quantity
+            self.assertEqual(movement.balance, running)
+        item.refresh_from_db(fields=['stock'])
+        self.assertEqual(ledger.balance(item), item.stock)
+
+    def test_every_drug_change_is_recorded(self):
+        stock.add_stock(self.drug, 5, 'Ceva', self.user)
+        stock.sell(self.drug, 3, 'Farm A', self.user)
+        stock.sell_order([(self.drug.pk, 1)], 'Farm B', self.user)
+        stock.sell_product('Newcastle', 1, 'Farm C', self.user)
+        stock.unlock(stock.lock(self.drug, 2, 'Farm D', self.user), self.user)
+        stock.post_locked(stock.lock_product('Newcastle', 1, 'Farm E', self.user)[0], self.user)
+        expiring = stock.lock(self.drug, 2, 'Farm F', self.user)
+        LockedProduct.objects.filter(pk=expiring.pk).update(expires_at=timezone.now())
+        stock.expire_locks()
+        with self.assertRaises(InsufficientStock):
+            stock.sell(self.drug, 100, 'Farm G', self.user)
+
+        self.assertLedger(self.drug, [
+            'adjustment', 'receipt', 'sale', 'sale', 'sale', 'lock', 'unlock', 'lock', 'post', 'lock', 'expire',
+        ])
+        sale = ledger.history(self.drug).get(kind='sale', reference='Farm A')
+        self.assertEqual((sale.quantity, sale.balance, sale.user), (-3, 12, self.user))
+
+    def test_form_edits_and_intake(self):
+        drug = Drug.objects.get(pk=self.drug.pk)
+        drug.stock = 4
+        drug.save()
+        intake.import_csv(StringIO('name,batch,expiry,quantity,supplier\n'
+                                   'Newcastle,NC-01,,6,ceva\nNewcastle,NC-01,,2,hipra\n'), self.user)
+        self.assertLedger(self.drug, ['adjustment', 'adjustment', 'receipt', 'receipt'])
+        self.assertEqual(ledger.history(self.drug).last().reference, 'Hipra')
+
+    def test_marketing_items_and_cannisters(self):
+        item = MarketingItem.objects.create(name='Calendar', stock='5')
+        stock.issue_item(item, 2, 'Field team', self.user)
+        self.assertLedger(item, ['adjustment', 'issue'])
+
+        cannister = Cannister.objects.create(name='LN2', batch_no='C-1', stock=5, litres='35')
+        stock.return_cannister(stock.issue_cannister(cannister, 2, 'Farm A', self.user), self.user)
+        self.assertLedger(cannister, ['adjustment', 'issue', 'return'])
+
+    def test_balance_at_a_time(self):
+        before = timezone.now()
+        stock.sell(self.drug, 4, 'Farm A', self.user)
+        self.assertEqual(ledger.balance(self.drug, before), 10)
+        self.assertIsNone(ledger.balance(self.drug, before - timedelta(days=1)))
+
+    def test_movements_are_append_only(self):
+        movement = ledger.history(self.drug).get()
+        movement.quantity = 100
+        with self.assertRaises(PermissionDenied):
+            movement.save()
+        with self.assertRaises(PermissionDenied):
+            movement.delete()
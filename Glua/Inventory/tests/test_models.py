@@ -0,0 +1,103 @@
+from importlib import import_module
+
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import stock, summary
+from ..models import Drug, Sale, LockedProduct
+from . import make_drug
+
+
+class DirtyFieldTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass', is_staff=True)
+        self.drug = make_drug()
+
+    def test_save_writes_only_changed_columns(self):
+        drug = Drug.objects.get(pk=self.drug.pk)
+        self.assertEqual(drug.changed_fields, [])
+        with self.assertNumQueries(0):
+            drug.save()
+
+        drug.reorder_level = 20
+        self.assertEqual(drug.changed_fields, ['reorder_level'])
+        # Another teller sells from the batch meanwhile
+        stock.sell(self.drug, 3, 'Farm A', self.user)
+        with CaptureQueriesContext(connection) as queries:
+            drug.save()
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT')])
+        update = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "Inventory_drug"')]
+        self.assertEqual(len(update), 1)
+        self.assertNotIn('"stock"', update[0])
+        self.assertEqual(drug.changed_fields, [])
+
+        self.drug.refresh_from_db()
+        self.assertEqual((self.drug.stock, self.drug.reorder_level), (7, 20))
+        self.assertEqual(summary.get_summary().low_stock, summary.rebuild().low_stock)
+
+    def test_deferred_and_refreshed_fields(self):
+        drug = Drug.objects.only('name').get(pk=self.drug.pk)
+        drug.stock = 4
+        self.assertEqual(drug.changed_fields, ['stock'])
+        drug.save()
+        self.drug.refresh_from_db(fields=['stock'])
+        self.assertEqual(self.drug.stock, 4)
+        self.assertEqual(self.drug.changed_fields, [])
+        self.assertEqual(summary.get_summary().zero_stock, 1)
+
+    def test_form_edit_updates_only_the_edited_field(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('modify', args=[self.drug.pk]),
+                             {'name': 'Gumboro', 'stock': 10, 'batch_no': 'NC-01'})
+        update = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "Inventory_drug"')]
+        self.assertEqual(len(update), 1)
+        self.assertIn('"name"', update[0])
+        self.assertNotIn('"stock"', update[0])
+        self.assertEqual(Drug.objects.get(pk=self.drug.pk).name, 'Gumboro')
+
+    def test_locked_drug_check_uses_the_snapshot(self):
+        stock.lock(self.drug, 2, 'Farm A', self.user)
+        locked = LockedProduct.objects.get()
+        locked.quantity = 1
+        with self.assertNumQueries(1):
+            locked.save()
+
+        locked.drug = make_drug(batch_no='NC-02')
+        with self.assertNumQueries(0), self.assertRaises(PermissionDenied):
+            locked.save()
+
+
+class SaleDrugLinkTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        self.drug = make_drug()
+
+    def test_sales_reference_the_batch(self):
+        other = make_drug(name='Gumboro', batch_no='GB-01')
+        stock.sell(self.drug, 1, 'Farm A', self.user)
+        stock.sell_order([(self.drug.pk, 1), (other.pk, 2)], 'Farm B', self.user)
+        self.assertEqual(self.drug.sales.count(), 2)
+        self.assertEqual(other.sales.get().quantity, 2)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bin_report'), {'drug': other.pk})
+        self.assertEqual([sale.drug_id for sale in response.context['sales']], [other.pk])
+
+    def test_backfill_matches_name_and_batch(self):
+        backfill = import_module('Inventory.migrations.0031_backfill_sale_picking_drug')
+        make_drug(name='Gumboro', batch_no='GB-01')
+        make_drug(name='Gumboro', batch_no='GB-02')
+        exact = Sale.objects.create(drug_sold='Gumboro', batch_no='GB-02', quantity=1)
+        by_name = Sale.objects.create(drug_sold='Newcastle', batch_no='OLD', quantity=1)
+        ambiguous = Sale.objects.create(drug_sold='Gumboro', batch_no='OLD', quantity=1)
+
+        backfill.link(Sale, 'drug_sold', Drug)
+
+        self.assertEqual(Sale.objects.get(pk=exact.pk).drug.batch_no, 'GB-02')
+        self.assertEqual(Sale.objects.get(pk=by_name.pk).drug, self.drug)
+        self.assertIsNone(Sale.objects.get(pk=ambiguous.pk).drug)
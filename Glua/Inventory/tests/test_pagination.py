@@ -0,0 +1,255 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import exports, fulltext, ledger, stock, summary
+from ..models import Drug, Sale, IssuedItem, MarketingItem, Cannister, IssuedCannister, PickingList
+from ..pagination import KeysetPaginator, MAX_PER_PAGE, DEFAULT_PER_PAGE
+from . import make_drug
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        day = summary.today()
+        # Several rows share a date so the id tie-breaker matters.
+        PickingList.objects.bulk_create([
+            PickingList(date=day - timedelta(days=n // 3), client=f'Farm {n}', product='Newcastle',
+                        batch_no='NC-01', quantity=n + 1)
+            for n in range(25)
+        ])
+        self.expected = list(PickingList.objects.order_by('-date', '-id'))
+
+    def test_walks_forward_and_back(self):
+        paginator = KeysetPaginator(PickingList.objects.all(), ('-date', '-id'), per_page=10)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        self.assertEqual([list(page) for page in pages],
+                         [self.expected[:10], self.expected[10:20], self.expected[20:]])
+        self.assertFalse(pages[0].has_previous())
+
+        back = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual(list(back), self.expected[10:20])
+        self.assertTrue(back.has_previous() and back.has_next())
+
+    def test_view_uses_cursor_without_count(self):
+        user = User.objects.create_user('teller', password='pass')
+        self.client.force_login(user)
+        first = self.client.get(reverse('picking_list'), {'per_page': 10}).context['picking_list']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('picking_list') + '?' + first.next_query)
+        self.assertEqual(list(response.context['picking_list']), self.expected[10:20])
+        page_sql = [q['sql'] for q in queries if 'Inventory_pickinglist' in q['sql']]
+        self.assertEqual(len(page_sql), 1)
+        self.assertNotIn('COUNT(', page_sql[0])
+        self.assertNotIn('OFFSET', page_sql[0])
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(PickingList.objects.all(), ('-date', '-id'), per_page=10)
+        self.assertEqual(list(paginator.get_page('not-a-cursor')), self.expected[:10])
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(KeysetPaginator(PickingList.objects.all(), ('-date', '-id'), 1000000).per_page, MAX_PER_PAGE)
+        self.assertEqual(KeysetPaginator(PickingList.objects.all(), ('-date', '-id'), 'all').per_page, DEFAULT_PER_PAGE)
+        self.assertEqual(KeysetPaginator(PickingList.objects.all(), ('-date', '-id'), -5).per_page, 1)
+
+
+    def test_home_page_size_control(self):
+        Drug.objects.bulk_create([Drug(name=f'Drug {n:02}', batch_no=f'B-{n}', stock=5, dose_pack=1000, reorder_level=2) for n in range(25)])
+        self.client.force_login(User.objects.create_user('teller', password='pass'))
+        response = self.client.get(reverse('home'), {'per_page': 20})
+        self.assertEqual(len(response.context['drugs']), 20)
+        self.assertContains(response, '<option value="20" selected>', html=False)
+        self.assertIn('per_page=20', response.context['drugs'].next_query)
+
+
+class BoundedListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('teller', password='pass')
+        self.client.force_login(self.user)
+        drug = Drug.objects.create(name='Newcastle', batch_no='NC-01', stock=5, dose_pack=1, reorder_level=1)
+        start = timezone.now() - timedelta(days=30)
+        sales = Sale.objects.bulk_create([
+            Sale(seller=self.user, drug=drug, drug_sold='Newcastle', batch_no='NC-01', quantity=1)
+            for n in range(MAX_PER_PAGE + 20)
+        ])
+        for n, sale in enumerate(sales):
+            # date_sold is auto_now, so bulk_update would overwrite it
+            Sale.objects.filter(pk=sale.pk).update(date_sold=start + timedelta(hours=n))
+
+    def test_per_page_cannot_load_everything(self):
+        response = self.client.get(reverse('bin_report'), {'per_page': 1000000})
+        self.assertEqual(len(response.context['sales']), MAX_PER_PAGE)
+        response = self.client.get(reverse('bin_report'), {'per_page': 'lots'})
+        self.assertEqual(len(response.context['sales']), DEFAULT_PER_PAGE)
+
+    def test_bin_filter_pages_keep_the_dates(self):
+        start = (timezone.now() - timedelta(days=29)).date()
+        first = self.client.post(reverse('bin_filter'), {'start_date': start.isoformat()}).context['sales']
+        self.assertEqual(len(first), DEFAULT_PER_PAGE)
+        self.assertIn(f'start_date={start.isoformat()}', first.next_query)
+
+        second = self.client.get(reverse('bin_filter') + '?' + first.next_query).context['sales']
+        self.assertTrue(all(sale.date_sold.date() >= start for sale in second))
+        self.assertGreater(second[0].date_sold, first[-1].date_sold)
+
+    def test_stock_listings_are_paged(self):
+        soon = summary.today() + timedelta(days=30)
+        Drug.objects.bulk_create([
+            Drug(name=f'Drug {n:03}', batch_no=f'B-{n}', stock=n % 2, dose_pack=1, reorder_level=2, expiry_date=soon)
+            for n in range(2 * MAX_PER_PAGE + 20)
+        ])
+        MarketingItem.objects.bulk_create([MarketingItem(name=f'Item {n:03}', stock=1) for n in range(MAX_PER_PAGE + 20)])
+        Cannister.objects.bulk_create([
+            Cannister(name=f'Gas {n:03}', batch_no=f'C-{n}', stock=3, litres='35')
+            for n in range(fulltext.SEARCH_LIMIT + 20)
+        ])
+        listings = [
+            ('low_stock', 'low_stock', {}), ('out_of_stock', 'out_of_stock', {}),
+            ('expiring_soon', 'expiring_soon', {}), ('marketing_items', 'marketing_items', {}),
+            ('cannister_list', 'cannisters', {}),
+        ]
+        for name, key, data in listings:
+            with self.subTest(view=name):
+                page = self.client.get(reverse(name), {'per_page': 1000000}).context[key]
+                self.assertEqual(len(page), MAX_PER_PAGE)
+                self.assertTrue(page.has_next())
+                following = self.client.get(reverse(name) + '?' + page.next_query).context[key]
+                self.assertGreater((following[0].name, following[0].pk), (page[-1].name, page[-1].pk))
+
+        page = self.client.post(reverse('marketing_search'), {'search': 'Item'}).context['marketing_items']
+        self.assertEqual(len(page), DEFAULT_PER_PAGE)
+        self.assertIn('search=Item', page.next_query)
+        self.assertRedirects(self.client.post(reverse('marketing_search'), {'search': ''}), reverse('marketing_items'))
+
+        results = self.client.post(reverse('search_cannister'), {'q': '3'}).context['cannisters']
+        self.assertEqual(len(results), fulltext.SEARCH_LIMIT)
+
+    def test_filtered_issue_pages_keep_the_filter(self):
+        IssuedItem.objects.bulk_create([
+            IssuedItem(item='Caps' if n % 2 else 'Pens', stock=5, issued_to=f'Farm {n}', quantity_issued=1,
+                       issued_by=self.user)
+            for n in range(30)
+        ])
+        IssuedCannister.objects.bulk_create([
+            IssuedCannister(name='LN2', batch_no='C-1', staff_on_duty=self.user, client=f'Farm {n}', quantity=1,
+                            balance=5)
+            for n in range(15)
+        ])
+        day = summary.today()
+        dates = {'start_date': (day - timedelta(days=1)).isoformat(), 'end_date': (day + timedelta(days=1)).isoformat()}
+        for name, data, key, total in [
+            ('issued_items_search', {'query': 'caps'}, 'issued_items', 15),
+            ('issued_items_filter', dates, 'issued_items', 30),
+            ('can_filter', dates, 'issued_cannisters', 15),
+        ]:
+            with self.subTest(view=name):
+                first = self.client.post(reverse(name), data).context[key]
+                self.assertEqual(len(first), DEFAULT_PER_PAGE)
+                for field, value in data.items():
+                    self.assertIn(f'{field}={value}', first.next_query)
+                second = self.client.get(reverse(name) + '?' + first.next_query).context[key]
+                self.assertEqual(len(first) + len(second), min(total, 2 * DEFAULT_PER_PAGE))
+                self.assertFalse({row.pk for row in first} & {row.pk for row in second})
+                if name == 'issued_items_search':
+                    self.assertTrue(all(row.item == 'Caps' for row in second))
+
+    def test_unfiltered_searches_redirect_to_the_paged_lists(self):
+        self.assertRedirects(self.client.post(reverse('search'), {'q': ' '}), reverse('home'))
+        self.assertRedirects(self.client.post(reverse('searchstock'), {'s': ''}), reverse('stocking'))
+        self.assertRedirects(self.client.get(reverse('bin_search')), reverse('bin_report'))
+
+
+class QueryPlanTests(TestCase):
+    """
+    Run EXPLAIN QUERY PLAN over every query the report pages issue and fail
+    on a full table scan or an ORDER BY that needs a temporary sort.
+    """
+    reports = [
+        ('get', 'home', {}),
+        ('get', 'dashboard', {}),
+        ('get', 'bin_report', {}),
+        ('get', 'bin_report', {'drug': '1'}),
+        ('post', 'bin_report', {'start_date': '2024-01-01', 'end_date': '2024-12-31'}),
+        ('post', 'bin_filter', {'start_date': '2024-01-01', 'end_date': '2024-12-31'}),
+        ('get', 'stocked', {'date_start': '2024-01-01', 'date_end': '2024-12-31'}),
+        ('get', 'expiring_soon', {}),
+        ('get', 'out_of_stock', {}),
+        ('get', 'locked_products', {}),
+        ('get', 'issued_items_report', {}),
+        ('post', 'issued_items_filter', {'start_date': '2024-01-01', 'end_date': '2024-12-31'}),
+        ('get', 'picking_list', {'start_date': '2024-01-01', 'end_date': '2024-12-31'}),
+        ('get', 'bin_card', {}),
+        ('post', 'can_filter', {'start_date': '2024-01-01', 'end_date': '2024-12-31'}),
+        ('get', 'bin_search', {'search': 'farm'}),
+        ('post', 'search', {'q': 'newc'}),
+        ('post', 'searchstock', {'s': 'newc'}),
+        ('post', 'locked_search', {'quiz': 'newc'}),
+        ('post', 'issued_items_search', {'query': 'farm'}),
+        ('get', 'can_search', {'search': 'farm'}),
+        ('post', 'search_cannister', {'q': 'jerry'}),
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        self.client.force_login(self.user)
+        drug = make_drug()
+        stock.sell(drug, 1, 'Farm A', self.user)
+        stock.lock(drug, 1, 'Farm B', self.user)
+        summary.rebuild()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        # Sorting is fine when the rows come from a full-text match, not the whole table.
+        fts_driven = any('VIRTUAL TABLE INDEX' in step for step in plan)
+        return [
+            step for step in plan
+            if (step.startswith('SCAN Inventory_') and 'USING' not in step)
+            or ('TEMP B-TREE FOR ORDER BY' in step and not fts_driven)
+        ]
+
+    def test_report_queries_use_indexes(self):
+        for method, name, data in self.reports:
+            with self.subTest(view=name, method=method):
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(self.client, method)(reverse(name), data)
+                self.assertEqual(response.status_code, 200)
+                for query in queries:
+                    sql = query['sql']
+                    if not sql.startswith('SELECT') or 'Inventory_' not in sql:
+                        continue
+                    plan = self.explain(sql)
+                    self.assertFalse(self.full_scans(plan), f'{sql}\n' + '\n'.join(plan))
+
+    def test_ledger_queries_use_the_item_index(self):
+        drug = Drug.objects.get()
+        now = timezone.now()
+        for movements in [ledger.history(drug), ledger.history(drug, now - timedelta(days=7), now),
+                          ledger.history(drug, end=now).reverse().values_list('balance', flat=True)[:1]]:
+            sql, params = movements.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            # One range scan of the index, already in order
+            self.assertEqual(len(plan), 1, '\n'.join(plan))
+            self.assertTrue(plan[0].startswith('SEARCH Inventory_stockmovement USING INDEX movement_item_idx'), plan[0])
+
+    def test_exports_use_indexes(self):
+        for spec in exports.EXPORTS.values():
+            with self.subTest(export=spec.filename):
+                sql, params = spec.queryset(summary.today(), summary.today()).query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                    plan = [row[-1] for row in cursor.fetchall()]
+                self.assertFalse(self.full_scans(plan), '\n'.join(plan))
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import presence
+from ..models import UserPresence
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', password='pass')
+        self.other = User.objects.create_user('teller', password='pass')
+
+    def status(self):
+        return self.client.get(reverse('get_online_offline_users')).json()
+
+    def test_login_logout_and_heartbeat(self):
+        self.client.login(username='admin', password='pass')
+        self.assertEqual(self.status(), {'online_users': ['admin'], 'offline_users': ['teller']})
+
+        presence.logged_in(self.other)
+        UserPresence.objects.filter(user=self.other).update(last_seen=timezone.now() - timedelta(minutes=10))
+        self.assertIn('teller', self.status()['offline_users'])
+        presence.seen(self.other)
+        self.assertIn('teller', self.status()['online_users'])
+
+        self.client.logout()
+        self.assertIn('admin', self.status()['offline_users'])
+
+    def test_user_management_skips_sessions(self):
+        self.client.login(username='admin', password='pass')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user_management'))
+        online = {user.username: user.is_online for user in response.context['users']}
+        self.assertEqual(online, {'admin': True, 'teller': False})
+        user_queries = [q['sql'] for q in queries if 'FROM "auth_user"' in q['sql'] and 'presence' in q['sql']]
+        self.assertEqual(len(user_queries), 1)
+        self.assertFalse([q for q in queries if 'django_session' in q['sql'] and 'expire_date" >=' in q['sql']])
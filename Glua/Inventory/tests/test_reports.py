@@ -0,0 +1,212 @@
+import gzip
+import os
+import time
+from datetime import timedelta
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connections, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from .. import replica, rollup, stock, summary
+from ..models import Drug, InventorySummary, SaleRollup
+from . import make_drug, SUMMARY_FIELDS
+
+
+class InventorySummaryTests(TestCase):
+    fields = SUMMARY_FIELDS
+
+    def assertSummaryMatchesRecount(self):
+        maintained = InventorySummary.objects.values(*self.fields).get()
+        self.assertEqual(maintained, InventorySummary.objects.values(*self.fields).get(pk=summary.rebuild().pk))
+        return maintained
+
+    def test_counters_follow_mutations(self):
+        user = User.objects.create_user('teller', password='pass')
+        soon = summary.today() + timedelta(days=30)
+        drug = make_drug(stock=6, reorder_level=3, expiry_date=soon)
+        other = make_drug(name='Gumboro', batch_no='GB-01', stock=1)
+        summary.rebuild()
+
+        stock.sell(drug, 2, 'Farm A', user)
+        locked = stock.lock(other, 1, 'Farm B', user)
+        counts = self.assertSummaryMatchesRecount()
+        self.assertEqual((counts['low_stock'], counts['out_of_stock'], counts['locked_products']), (0, 1, 1))
+
+        stock.unlock(locked)
+        stock.sell_order([(drug.pk, 2)], 'Farm A', user)
+        drug.refresh_from_db()
+        drug.expiry_date = summary.today() - timedelta(days=1)
+        drug.save()
+        stock.add_stock(other, 10, 'Supplier', user)
+        counts = self.assertSummaryMatchesRecount()
+        self.assertEqual((counts['expired'], counts['low_stock'], counts['locked_products']), (1, 1, 0))
+
+        make_drug(name='Marek', batch_no='MK-01', stock=0).delete()
+        self.assertSummaryMatchesRecount()
+
+    def test_stale_row_rolls_over(self):
+        make_drug(expiry_date=summary.today())
+        summary.rebuild(summary.today() - timedelta(days=1))
+        self.assertEqual(summary.get_summary().expired, 0)
+        self.assertEqual(summary.get_summary().as_of, summary.today())
+
+    def test_dashboard_reads_summary(self):
+        user = User.objects.create_user('teller', password='pass')
+        make_drug(stock=0)
+        self.client.force_login(user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['out_of_stock_products'], 1)
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass')
+        self.bob = User.objects.create_user('bob', password='pass')
+        self.drug = make_drug(stock=100)
+        self.other = make_drug(name='Gumboro', batch_no='GB-01', stock=100)
+
+    def test_rollup_matches_rebuild(self):
+        stock.sell(self.drug, 3, 'Farm A', self.alice)
+        stock.sell(self.drug, 2, 'Farm A', self.alice)
+        stock.sell_order([(self.drug.pk, 1), (self.other.pk, 10)], 'Farm B', self.bob)
+        stock.post_locked(stock.lock(self.other, 4, None, self.bob), self.bob)
+
+        self.assertEqual(SaleRollup.objects.get(drug_sold='Newcastle', client='Farm A').sales, 2)
+        maintained = sorted(SaleRollup.objects.values_list('day', 'drug_sold', 'client', 'seller', 'quantity', 'sales'))
+        top = list(rollup.top_sold())
+        rollup.rebuild()
+        self.assertEqual(
+            maintained, sorted(SaleRollup.objects.values_list('day', 'drug_sold', 'client', 'seller', 'quantity', 'sales')))
+        self.assertEqual(top, list(rollup.top_sold()))
+        self.assertEqual(top[0], {'drug_sold': 'Gumboro', 'total_quantity': 14})
+
+    def test_sales_without_a_seller_share_one_row(self):
+        stock.sell(self.drug, 3, 'Farm A', None)
+        stock.sell(self.drug, 2, 'Farm A', None)
+        row = SaleRollup.objects.get(seller__isnull=True)
+        self.assertEqual((row.quantity, row.sales), (5, 2))
+
+        # A second writer creating the same key falls back to the UPDATE
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SaleRollup.objects.create(day=row.day, drug_sold=row.drug_sold, batch_no=row.batch_no,
+                                      client=row.client, seller=None)
+
+    def test_period_totals_per_seller(self):
+        stock.sell(self.drug, 3, 'Farm A', self.alice)
+        stock.sell(self.other, 5, 'Farm B', self.bob)
+        today = summary.today()
+
+        per_staff = {row['seller__username']: row['total_quantity']
+                     for row in rollup.totals(today, today, group_by=['seller__username'])}
+        self.assertEqual(per_staff, {'alice': 3, 'bob': 5})
+        self.assertEqual(rollup.totals(today, today)['total_sales'], 2)
+        self.assertFalse(rollup.top_sold(start=today + timedelta(days=1)).exists())
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        self.client.force_login(self.user)
+        drug = make_drug(stock=100)
+        stock.sell(drug, 3, 'Farm A', self.user)
+        stock.sell(drug, 4, 'Farm B', self.user)
+
+    def test_sales_csv_is_streamed_and_filtered(self):
+        response = self.client.get(reverse('export_report', args=['sales']), {'search': 'farm b'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'Date Sold,Client,Staff on Duty,Product,Batch No,Quantity Out,Balance')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Farm B,teller,Newcastle,NC-01,4.0,93', lines[1])
+
+    def test_gzip_export(self):
+        today = summary.today().isoformat()
+        response = self.client.get(reverse('export_report', args=['sales']),
+                                   {'compress': 'gzip', 'start_date': today, 'end_date': today})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+
+    def test_unknown_export(self):
+        self.assertEqual(self.client.get(reverse('export_report', args=['nope'])).status_code, 404)
+
+
+class ReportReplicaTests(TransactionTestCase):
+    """Report views against a second database file, as with REPORTS_DB set."""
+
+    def setUp(self):
+        cache.clear()
+        replica_file = NamedTemporaryFile(suffix='.sqlite3', delete=False)
+        replica_file.close()
+        os.remove(replica_file.name)
+        self.path = replica_file.name
+        connections.settings[replica.REPLICA] = connections.configure_settings({
+            'default': connections.settings['default'],
+            replica.REPLICA: {'ENGINE': 'Glua.sqlite', 'NAME': self.path, 'OPTIONS': {'pragmas': {'query_only': 1}}},
+        })[replica.REPLICA]
+
+        self.user = User.objects.create_user('teller', password='pass', is_staff=True)
+        self.client.force_login(self.user)
+        self.drug = make_drug(stock=100)
+        stock.sell(self.drug, 1, 'Farm Before', self.user)
+
+    def tearDown(self):
+        connections[replica.REPLICA].close()
+        del connections[replica.REPLICA]
+        del connections.settings[replica.REPLICA]
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_reports_read_the_snapshot(self):
+        self.assertFalse(replica.available())
+        self.assertContains(self.client.get(reverse('bin_report')), 'Farm Before')
+
+        replica.refresh()
+        stock.sell(self.drug, 1, 'Farm After', self.user)
+        response = self.client.get(reverse('bin_report'))
+        self.assertContains(response, 'Farm Before')
+        self.assertNotContains(response, 'Farm After')
+        export = b''.join(self.client.get(reverse('export_report', args=['sales'])).streaming_content)
+        self.assertIn(b'Farm Before', export)
+        self.assertNotIn(b'Farm After', export)
+
+        # Transactional views and writes stay on the primary
+        self.assertEqual(self.client.get(reverse('home')).context['drugs'][0].stock, 98)
+
+        replica.refresh()
+        self.assertContains(self.client.get(reverse('bin_report')), 'Farm After')
+
+    def test_stale_snapshot_falls_back_to_the_primary(self):
+        replica.refresh()
+        stock.sell(self.drug, 1, 'Farm After', self.user)
+        old = time.time() - settings.REPLICA_MAX_AGE - 1
+        os.utime(self.path, (old, old))
+        self.assertFalse(replica.available())
+        self.assertContains(self.client.get(reverse('bin_report')), 'Farm After')
+
+    def test_dashboard_counters_stay_live(self):
+        replica.refresh()
+        make_drug(batch_no='NC-02', stock=0)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['out_of_stock_products'], 1)
+
+    def test_replica_is_never_migrated_or_written(self):
+        router = replica.ReportRouter()
+        self.assertFalse(router.allow_migrate(replica.REPLICA, 'Inventory'))
+        self.assertEqual(router.db_for_write(Drug), 'default')
+        replica.refresh()
+        with self.assertRaises(OperationalError):
+            connections[replica.REPLICA].cursor().execute('DELETE FROM Inventory_sale')
+
+    def test_command_refreshes_the_file(self):
+        out = StringIO()
+        call_command('refresh_replica', stdout=out)
+        self.assertIn('Refreshed', out.getvalue())
+        self.assertTrue(replica.available())
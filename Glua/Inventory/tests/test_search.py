@@ -0,0 +1,80 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import fulltext, stock, views
+from ..models import Drug, IssuedItem
+from ..testing import QueryBudgetMixin
+from . import make_drug
+
+
+class TypeaheadSearchTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        User.objects.create_user('teller', password='pass')
+        self.client.login(username='teller', password='pass')
+        Drug.objects.bulk_create(
+            [Drug(name='Newcastle', batch_no=f'NC-{n:02}', stock=5, dose_pack=1, reorder_level=1) for n in range(25)]
+            + [Drug(name='Gumboro', batch_no='NC-99', stock=5, dose_pack=1, reorder_level=1)])
+        self.client.get(reverse('search_rows'))  # the first request after login writes the session
+
+    def rows(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertWithinQueryBudget(response)
+        return response.json()
+
+    def test_rows_come_in_bounded_pages(self):
+        first = self.rows('search_rows', q='newc')
+        self.assertEqual(first['rows'].count('<tr '), views.TYPEAHEAD_PAGE_SIZE)
+        self.assertNotIn('Gumboro', first['rows'])
+        self.assertIn('csrfmiddlewaretoken', first['rows'])
+
+        rest = self.rows('search_rows', q='newc', cursor=first['next'])
+        self.assertEqual(rest['rows'].count('<tr '), 25 - views.TYPEAHEAD_PAGE_SIZE)
+        self.assertIsNone(rest['next'])
+
+    def test_stock_rows_match_names_only(self):
+        data = self.rows('searchstock_rows', q='nc-99')
+        self.assertEqual(data['rows'].count('<tr>'), 0)
+        data = self.rows('searchstock_rows', q='gum')
+        self.assertEqual(data['rows'].count('<tr>'), 1)
+        self.assertIsNone(data['next'])
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('search_rows'), {'q': 'newc'}).status_code, 302)
+
+
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        self.drug = make_drug()
+
+    def test_index_follows_writes(self):
+        self.assertEqual(fulltext.ranked(Drug.objects.all(), 'newc'), [self.drug])
+        self.assertEqual(fulltext.ranked(Drug.objects.all(), 'nc-0'), [self.drug])
+
+        Drug.objects.filter(pk=self.drug.pk).update(name='Gumboro')
+        self.assertEqual(fulltext.ranked(Drug.objects.all(), 'newc'), [])
+        self.assertEqual(fulltext.ranked(Drug.objects.all(), 'gumb'), [self.drug])
+
+        Drug.objects.filter(pk=self.drug.pk).delete()
+        self.assertEqual(fulltext.ranked(Drug.objects.all(), 'gumb'), [])
+
+    def test_bulk_created_sales_are_searchable(self):
+        stock.sell_order([(self.drug.pk, 2)], 'Kamau Farm', self.user)
+        stock.sell(self.drug, 1, 'Other client', self.user)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bin_search'), {'search': 'kamau'})
+        self.assertEqual([sale.client for sale in response.context['sales']], ['Kamau Farm'])
+
+    def test_renamed_staff_still_found(self):
+        IssuedItem.objects.create(item='Calendar', stock=5, issued_to='Field team', quantity_issued=1,
+                                  issued_by=self.user)
+        self.user.username = 'wanjiku'
+        self.user.save()
+        self.assertEqual(fulltext.matching(IssuedItem.objects.all(), 'wanj').count(), 1)
+        self.assertEqual(fulltext.matching(IssuedItem.objects.all(), 'teller').count(), 0)
+
+    def test_query_syntax_is_escaped(self):
+        self.assertIsNone(fulltext.match_expression(' - '))
+        self.assertEqual(fulltext.ranked(Drug.objects.all(), 'new" OR *'), [])
@@ -0,0 +1,69 @@
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import sessions
+
+
+class SessionWriteTests(TestCase):
+    def setUp(self):
+        User.objects.create_user('teller', password='pass')
+        self.client.login(username='teller', password='pass')
+        self.client.get(reverse('home'))  # the first visit stores modal_shown
+
+    def session_writes(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name))
+        writes = [q['sql'] for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+        return response, writes
+
+    def test_page_views_do_not_write_the_session(self):
+        for name in ('dashboard', 'home', 'bin_report'):
+            response, writes = self.session_writes(name)
+            self.assertEqual(writes, [], name)
+            self.assertNotIn('sessionid', response.cookies)
+
+    def test_expiry_slides_once_per_interval(self):
+        later = time.time() + settings.SESSION_REFRESH_INTERVAL + 1
+        with mock.patch.object(sessions.time, 'time', return_value=later):
+            response, writes = self.session_writes('bin_report')
+            self.assertEqual(len(writes), 1)
+            self.assertEqual(response.cookies['sessionid']['max-age'], settings.SESSION_COOKIE_AGE)
+
+            response, writes = self.session_writes('bin_report')
+            self.assertEqual(writes, [])
+
+    def test_anonymous_requests_get_no_session(self):
+        self.client.logout()
+        response = self.client.get(reverse('login'))
+        self.assertNotIn('sessionid', response.cookies)
+
+    def test_anonymous_sessions_are_not_refreshed(self):
+        self.client.logout()
+        session = self.client.session
+        session['modal_shown'] = True
+        session.save()
+        later = time.time() + settings.SESSION_REFRESH_INTERVAL + 1
+        with mock.patch.object(sessions.time, 'time', return_value=later):
+            response, writes = self.session_writes('login')
+        self.assertEqual(writes, [])
+        self.assertNotIn('sessionid', response.cookies)
+
+    def test_purge_removes_expired_sessions(self):
+        Session.objects.create(session_key='stale', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        out = StringIO()
+        call_command('purge_sessions', stdout=out)
+        self.assertIn('Removed 1 expired session(s)', out.getvalue())
+        self.assertFalse(Session.objects.filter(session_key='stale').exists())
+        self.assertTrue(Session.objects.exists())
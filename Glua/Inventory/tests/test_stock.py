@@ -0,0 +1,243 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import rollup, stock, summary
+from ..models import Drug, Sale, Stocked, LockedProduct, LockPolicy, Cannister, IssuedCannister, PickingList, StockMovement
+from ..stock import InsufficientStock
+from . import make_drug
+
+
+class StockMutationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        self.drug = make_drug()
+
+    def test_sell_records_remaining_stock(self):
+        sale = stock.sell(self.drug, 3, 'Farm A', self.user)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 7)
+        self.assertEqual(sale.remaining_quantity, 7)
+
+    def test_sell_more_than_stock_writes_nothing(self):
+        with self.assertRaises(InsufficientStock):
+            stock.sell(self.drug, 11, 'Farm A', self.user)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 10)
+        self.assertFalse(Sale.objects.exists())
+
+    def test_sell_order_all_or_nothing(self):
+        other = make_drug(name='Gumboro', batch_no='GB-01', stock=2)
+        with self.assertRaisesMessage(InsufficientStock, 'Gumboro'):
+            stock.sell_order([(self.drug.pk, 4), (other.pk, 3)], 'Farm A', self.user)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 10)
+        self.assertFalse(Sale.objects.exists())
+
+        sales = stock.sell_order([(self.drug.pk, 4), (other.pk, 2), (self.drug.pk, 1)], 'Farm A', self.user)
+        self.assertEqual(len(sales), 2)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 5)
+        self.assertEqual(Sale.objects.get(batch_no='NC-01').quantity, 5)
+
+    def test_sell_order_view(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('sell_order'), {
+            'client': 'Farm A', 'drug': [self.drug.pk], 'quantity': ['2'],
+        })
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 8)
+
+    def test_non_positive_quantities_are_rejected(self):
+        movements = StockMovement.objects.count()
+        for quantity in (0, -5):
+            with self.assertRaises(ValueError):
+                stock.sell(self.drug, quantity, 'Farm A', self.user)
+            with self.assertRaises(ValueError):
+                stock.lock(self.drug, quantity, 'Farm A', self.user)
+            with self.assertRaises(ValueError):
+                stock.sell_order([(self.drug.pk, 2), (self.drug.pk, quantity)], 'Farm A', self.user)
+            with self.assertRaises(ValueError):
+                stock.sell_product(self.drug.name, quantity, 'Farm A', self.user)
+            with self.assertRaises(ValueError):
+                stock.add_stock(self.drug, quantity, 'Ceva', self.user)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 10)
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(Stocked.objects.exists())
+        self.assertEqual(StockMovement.objects.count(), movements)
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('addstock', args=[self.drug.pk]), {'added': '-5', 'supplier': 'Ceva'})
+        self.assertRedirects(response, reverse('stocking'), fetch_redirect_response=False)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 10)
+        self.assertFalse(LockedProduct.objects.exists())
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('sell', args=[self.drug.pk]), {'quantity': '-5', 'client': 'Farm A'})
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 10)
+
+    def test_sell_order_view_rejects_nan(self):
+        self.client.force_login(self.user)
+        for quantity in ('nan', 'inf'):
+            response = self.client.post(reverse('sell_order'), {
+                'client': 'Farm A', 'drug': [self.drug.pk], 'quantity': [quantity],
+            })
+            self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 10)
+        self.assertFalse(Sale.objects.exists())
+
+    def test_unlock_twice_restores_once(self):
+        locked = stock.lock(self.drug, 4, 'Farm A', self.user)
+        self.assertTrue(stock.unlock(locked))
+        self.assertFalse(stock.unlock(locked))
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 10)
+        self.assertFalse(LockedProduct.objects.exists())
+
+    def test_return_cannister_twice_restores_once(self):
+        cannister = Cannister.objects.create(name='LN2', batch_no='C-1', stock=5, litres='35')
+        issued = stock.issue_cannister(cannister, 2, 'Farm A', self.user)
+        self.assertTrue(stock.return_cannister(issued, self.user))
+        self.assertFalse(stock.return_cannister(issued, self.user))
+        cannister.refresh_from_db()
+        self.assertEqual(cannister.stock, 5)
+        self.assertTrue(IssuedCannister.objects.get(pk=issued.pk).action)
+
+
+class LockExpiryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        self.drug = make_drug()
+        self.other = make_drug(batch_no='NC-02', stock=5)
+
+    def test_locks_expire_after_the_client_ttl(self):
+        LockPolicy.objects.create(client='Farm A', ttl=timedelta(hours=2))
+        before = timezone.now()
+        short = stock.lock(self.drug, 1, 'farm a', self.user)
+        default = stock.lock(self.drug, 1, 'Farm B', self.user)
+        self.assertAlmostEqual((short.expires_at - before).total_seconds(), 2 * 3600, delta=60)
+        self.assertAlmostEqual((default.expires_at - before).total_seconds(),
+                               settings.LOCK_TTL_HOURS * 3600, delta=60)
+
+    def test_sweep_restores_stock_in_bulk(self):
+        now = timezone.now()
+        for drug, quantity in [(self.drug, 2), (self.drug, 3), (self.other, 4)]:
+            stock.lock(drug, quantity, 'Farm A', self.user)
+        kept = stock.lock(self.drug, 1, 'Farm B', self.user)
+        LockedProduct.objects.exclude(pk=kept.pk).update(expires_at=now - timedelta(minutes=1))
+        held = stock.lock(self.drug, 1, 'Farm C', self.user)
+        LockedProduct.objects.filter(pk=held.pk).update(expires_at=None)
+        summary.get_summary()
+
+        with CaptureQueriesContext(connection) as queries:
+            released, seconds = stock.expire_locks(now)
+        self.assertEqual(released, 3)
+        self.assertGreaterEqual(seconds, 0)
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('UPDATE "Inventory_drug"', 'DELETE'))]
+        self.assertEqual(len(writes), 2)
+
+        self.drug.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.drug.stock, self.other.stock), (8, 5))
+        self.assertEqual(set(LockedProduct.objects.values_list('pk', flat=True)), {kept.pk, held.pk})
+        self.assertEqual(summary.get_summary().locked_products, summary.rebuild().locked_products)
+
+        self.assertEqual(stock.expire_locks(now)[0], 0)
+
+    def test_command_reports_the_sweep(self):
+        locked = stock.lock(self.drug, 2, 'Farm A', self.user)
+        LockedProduct.objects.filter(pk=locked.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('expire_locks', stdout=out)
+        self.assertIn('Released 1 expired lock(s)', out.getvalue())
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock, 10)
+
+
+class FefoAllocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('teller', password='pass')
+        today = summary.today()
+        self.expired = make_drug(batch_no='NC-OLD', stock=50, expiry_date=today - timedelta(days=1))
+        self.empty = make_drug(batch_no='NC-EMPTY', stock=0, expiry_date=today + timedelta(days=5))
+        self.first = make_drug(batch_no='NC-1', stock=3, expiry_date=today + timedelta(days=10))
+        self.second = make_drug(batch_no='NC-2', stock=10, expiry_date=today + timedelta(days=100))
+        self.undated = make_drug(batch_no='NC-X', stock=5)
+        make_drug(name='Gumboro', batch_no='GB-01', stock=100, expiry_date=today + timedelta(days=1))
+
+    def stocks(self):
+        return dict(Drug.objects.filter(name='Newcastle').values_list('batch_no', 'stock'))
+
+    def test_allocates_first_expiry_first(self):
+        with self.assertNumQueries(1):
+            plan = stock.allocate('Newcastle', 15)
+        self.assertEqual([(drug.batch_no, take) for drug, take in plan], [('NC-1', 3), ('NC-2', 10), ('NC-X', 2)])
+
+    def test_sell_product_writes_a_sale_per_batch(self):
+        sales = stock.sell_product('Newcastle', 5, 'Farm A', self.user)
+        self.assertEqual([(sale.batch_no, sale.quantity, sale.remaining_quantity) for sale in sales],
+                         [('NC-1', 3, 0), ('NC-2', 2, 8)])
+        self.assertEqual(self.stocks(), {'NC-OLD': 50, 'NC-EMPTY': 0, 'NC-1': 0, 'NC-2': 8, 'NC-X': 5})
+        self.assertEqual(rollup.totals()['total_quantity'], 5)
+
+    def test_short_writes_nothing(self):
+        with self.assertRaisesMessage(InsufficientStock, 'Only 18 Newcastle'):
+            stock.sell_product('Newcastle', 19, 'Farm A', self.user)
+        self.assertFalse(Sale.objects.exists())
+        self.assertEqual(self.stocks()['NC-1'], 3)
+
+    def test_reallocates_when_a_batch_is_taken_meanwhile(self):
+        allocate = stock.allocate
+
+        def racing(name, quantity, day=None):
+            plan = allocate(name, quantity, day)
+            if not racing.raced:
+                racing.raced = True
+                Drug.objects.filter(pk=self.first.pk).update(stock=0)  # another teller sells it
+            return plan
+        racing.raced = False
+
+        with mock.patch.object(stock, 'allocate', racing):
+            sales = stock.sell_product('Newcastle', 12, 'Farm A', self.user)
+        self.assertEqual([(sale.batch_no, sale.quantity) for sale in sales], [('NC-2', 10), ('NC-X', 2)])
+
+    def test_view_locks_and_picks(self):
+        self.client.force_login(self.user)
+        url = reverse('allocate_product')
+        self.client.post(url, {'product': 'Newcastle', 'quantity': '4', 'client': 'Farm A', 'action': 'lock'})
+        self.assertEqual(list(LockedProduct.objects.order_by('id').values_list('drug__batch_no', 'quantity')),
+                         [('NC-1', 3), ('NC-2', 1)])
+
+        self.client.post(url, {'product': 'Newcastle', 'quantity': '10', 'client': 'Farm B', 'action': 'pick'})
+        self.assertEqual(list(PickingList.objects.order_by('id').values_list('batch_no', 'quantity')),
+                         [('NC-2', 9), ('NC-X', 1)])
+        self.assertEqual(self.stocks()['NC-2'], 9)
+
+    def test_view_rejects_nan(self):
+        self.client.force_login(self.user)
+        for action in ('sell', 'lock', 'pick'):
+            response = self.client.post(reverse('allocate_product'), {
+                'product': 'Newcastle', 'quantity': 'nan', 'client': 'Farm A', 'action': action})
+            self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertFalse(Sale.objects.exists() or LockedProduct.objects.exists() or PickingList.objects.exists())
+
+    def test_uses_fefo_index(self):
+        sql, params = stock.fefo_batches('Newcastle').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('drug_fefo_idx', plan)
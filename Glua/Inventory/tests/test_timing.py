@@ -0,0 +1,65 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import stock, summary, timing, views
+from ..models import MarketingItem, Cannister
+from ..testing import QueryBudgetMixin
+from . import make_drug
+
+
+class RequestTimingTests(QueryBudgetMixin, TestCase):
+    budgeted = ['dashboard', 'home', 'locked_products', 'bin_report', 'stocked', 'low_stock',
+                'out_of_stock', 'expiring_soon', 'user_management', 'issued_items_report', 'picking_list',
+                'cannister_list', 'bin_card', 'marketing_items']
+
+    def setUp(self):
+        timing.reset()
+        summary.get_summary()  # the first read builds the row, outside any budget
+        self.user = User.objects.create_user('teller', password='pass', is_staff=True)
+        self.client.force_login(self.user)
+
+    def add_rows(self, count):
+        for n in range(count):
+            drug = make_drug(name=f'Drug {n}', batch_no=f'B-{n}', stock=5)
+            stock.sell(drug, 1, 'Farm A', self.user)
+            stock.lock(drug, 1, 'Farm A', self.user)
+            Cannister.objects.create(name=f'Gas {n}', batch_no=f'C-{n}', stock=4, litres=5)
+
+    def test_server_timing_header_and_summary(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[0-9.]+;desc="\d+ queries", tpl;dur=[0-9.]+, total;dur=[0-9.]+$')
+        self.assertGreater(response.timing.template, 0)
+
+        [row] = [row for row in timing.view_summary() if row['view'] == 'dashboard']
+        self.assertEqual((row['requests'], row['budget'], row['over_budget']), (1, 10, 0))
+        self.assertEqual(row['queries'], response.timing.queries)
+
+        page = self.client.get(reverse('view_timings'))
+        self.assertContains(page, '<td>dashboard</td>')
+
+    def test_summary_is_staff_only(self):
+        self.client.force_login(User.objects.create_user('clerk', password='pass'))
+        self.assertEqual(self.client.get(reverse('view_timings')).status_code, 302)
+
+    def test_pages_stay_within_budget(self):
+        self.add_rows(5)
+        for name in self.budgeted:
+            with self.subTest(view=name):
+                self.assertWithinQueryBudget(self.client.get(reverse(name)))
+
+    def test_searches_stay_within_budget(self):
+        self.add_rows(5)
+        MarketingItem.objects.create(name='Calendar', stock=3)
+        for name, data in (('marketing_search', {'search': 'Cal'}), ('search_cannister', {'q': '4'})):
+            with self.subTest(view=name):
+                self.assertWithinQueryBudget(self.client.post(reverse(name), data))
+
+    def test_over_budget_fails(self):
+        with mock.patch.object(views.dashboard, 'query_budget', 1):
+            response = self.client.get(reverse('dashboard'))
+            with self.assertRaisesMessage(AssertionError, 'over its budget of 1'):
+                self.assertWithinQueryBudget(response)
+        self.assertEqual(timing.view_summary()[0]['over_budget'], 1)
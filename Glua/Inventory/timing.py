@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+# Requests kept per view for the rolling summary.
+WINDOW = 500
+
+_local = threading.local()
+_lock = threading.Lock()
+_history = {}
+
+
+class Timing:
+    """What one request spent, in milliseconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.total = 0.0
+
+    def header(self):
+        return ', '.join([
+            f'db;dur={self.db:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template:.1f}',
+            f'total;dur={self.total:.1f}',
+        ])
+
+
+def current():
+    """The Timing of the request being handled on this thread, if any."""
+    return getattr(_local, 'timing', None)
+
+
+def _count_query(execute, sql, params, many, context):
+    timing = current()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timing is not None:
+            timing.queries += 1
+            timing.db += (time.perf_counter() - started) * 1000
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timing = current()
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            if timing is not None:
+                timing.template += (time.perf_counter() - started) * 1000
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, adding render time to the request's Timing.
+    Queries run by the template (lazy querysets) count towards both.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+def query_budget(queries):
+    """
+    Declare the most queries a view may run per request. Requests over it
+    are counted in the summary, and QueryBudgetMixin fails tests on them.
+    """
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def budget_of(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view = getattr(match.func, 'view_class', match.func)
+    return getattr(view, 'query_budget', None)
+
+
+def record(view_name, timing, budget=None):
+    with _lock:
+        history = _history.get(view_name)
+        if history is None:
+            history = _history[view_name] = deque(maxlen=WINDOW)
+        history.append((timing.total, timing.db, timing.template, timing.queries, budget))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def view_summary():
+    """
+    Per view, over its last WINDOW requests: request count, median and p95
+    total time, mean DB and template time, queries, and requests over budget.
+    Slowest p95 first.
+    """
+    with _lock:
+        history = {name: list(rows) for name, rows in _history.items()}
+    views = []
+    for name, rows in history.items():
+        totals = [row[0] for row in rows]
+        queries = [row[3] for row in rows]
+        budget = rows[-1][4]
+        views.append({
+            'view': name,
+            'requests': len(rows),
+            'p50': percentile(totals, 0.5),
+            'p95': percentile(totals, 0.95),
+            'db': sum(row[1] for row in rows) / len(rows),
+            'template': sum(row[2] for row in rows) / len(rows),
+            'queries': sum(queries) / len(rows),
+            'max_queries': max(queries),
+            'budget': budget,
+            'over_budget': sum(1 for row in rows if row[4] is not None and row[3] > row[4]),
+        })
+    return sorted(views, key=lambda row: row['p95'], reverse=True)
+
+
+def reset():
+    with _lock:
+        _history.clear()
+
+
+class RequestTimingMiddleware:
+    """
+    Times every request: query count and DB time on all connections,
+    template render time and total time. Sends them as a Server-Timing
+    header and keeps them per view name for view_summary().
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = _local.timing = Timing()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_count_query))
+                response = self.get_response(request)
+        finally:
+            _local.timing = None
+        timing.total = (time.perf_counter() - timing.started) * 1000
+
+        response['Server-Timing'] = timing.header()
+        response.timing = timing
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            record(match.view_name, timing, budget_of(request))
+        return response
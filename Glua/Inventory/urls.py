@@ -11,11 +11,16 @@ urlpatterns = [
     path('stocking/', stockingListView.as_view(), name='stocking'),
     path('modify/<int:pk>/', modifyDrugUpdateView.as_view(), name='modify'),
     path('stocked/', views.StockAdded, name='stocked'),
+    path('stock/intake/', views.stock_intake, name='stock_intake'),
     path('sell/<int:pk>/', views.sellDrug, name='sell'),
+    path('sell/order/', views.sellOrder, name='sell_order'),
+    path('sell/product/', views.allocate_product, name='allocate_product'),
     path('lock/<int:pk>/', views.lockDrug, name='lock_item'),
     path('search/', views.search, name='search'),
     path('bin-report/search/', views.binsearch, name='bin_search'),
     path('search/stock/', views.searchstock, name='searchstock'),
+    path('search/rows/', views.search_rows, name='search_rows'),
+    path('search/stock/rows/', views.searchstock_rows, name='searchstock_rows'),
     path('history/', views.salehistory, name='history'),
     path('today/', views.todaysales, name='today'),
     path('bin-report/', views.bin_report, name='bin_report'),
@@ -50,6 +55,8 @@ urlpatterns = [
     path('bin-card/return/<int:issued_cannister_id>/', views.return_cannister, name='return_cannister'),
     path('search-cannister/', views.search_cannister, name='search_cannister'),
     path('download/top-sold/', views.download_top_sold, name='download_top_sold'),
+    path('export/<str:kind>/', views.export_report, name='export_report'),
+    path('timings/', views.view_timings, name='view_timings'),
 
 ]
 
@@ -1,27 +1,35 @@
 import csv
+import io
+import math
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.http import HttpResponse, StreamingHttpResponse, Http404
 from django.db.models import Sum, F, Q
-from .models import Drug, Sale, Stocked, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister
+from .models import Drug, Sale, Stocked, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister, ProductSalesTotal
 from .forms import DrugCreation
+from .pagination import filter_params, keyset_page
+from . import caching, exports, fulltext, intake, presence, rollup, stock, summary, timing
+from .replica import reads_from_replica
+from .timing import query_budget
+from .stock import InsufficientStock
 from django.contrib import messages
 from django.views.generic import ListView, UpdateView
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
-from django.utils.timezone import now, localtime, make_aware
+from django.utils.timezone import localtime, make_aware
 from datetime import datetime, timedelta, time
 from django.db.models import Count
 from django.http import JsonResponse
 from django.contrib.auth.models import User
-from django.contrib.sessions.models import Session
 from django.contrib.auth import logout
-from django.core.paginator import Paginator
 from django.utils.dateparse import parse_date
 from django.views.decorators.csrf import csrf_exempt
 
 
 # Create your views here.
 
+@query_budget(8)
 @login_required
 def home(request):
     today = timezone.now().date()
@@ -33,13 +41,12 @@ def home(request):
     low_stock = Drug.objects.filter(stock__lte=F('reorder_level'))
 
     # Pagination handling
-    per_page = request.GET.get('per_page', 10)  # Default to 10 per page
-    page_number = request.GET.get('page', 1)    # Get the current page number
-    drugs = Drug.objects.all().order_by('name')# Get all drugs ordered by name
+    drugs = Drug.objects.all()
 
-    # Create a paginator and get the page object for the current page
-    paginator = Paginator(drugs, per_page)
-    page_obj = paginator.get_page(page_number)
+    # Cursor pagination ordered by name, so deep pages cost the same as the first.
+    # The page is cached until a Drug changes.
+    page_obj = caching.cached('home', [Drug], lambda: keyset_page(request, drugs, ('name', 'id')),
+                              request.GET.urlencode())
 
     # Check if the modal has already been shown in this session
     show_modal = not request.session.get('modal_shown', False)  # Only show modal if 'modal_shown' is not set or False
@@ -51,9 +58,14 @@ def home(request):
     else:
         print("Modal already shown in this session")
 
+    # Product names for the sell-by-product form
+    product_names = caching.cached('product_names', [Drug], lambda: list(
+        Drug.objects.filter(stock__gt=0).values_list('name', flat=True).distinct().order_by('name')))
+
     # Pass these to the template
     context = {
         'drugs': page_obj,  # Pass the paginated drugs
+        'product_names': product_names,
         'expiring_soon': expiring_soon,
         'low_stock': low_stock,
         'show_modal': show_modal,  # Pass this flag to the template
@@ -88,17 +100,36 @@ def createDrug(request):
 
 @login_required
 def addStock(request, pk):
-    drug = Drug.objects.get(id=pk)
+    drug = get_object_or_404(Drug, id=pk)
     supp = request.POST.get('supplier')
-    amount_added = int(request.POST.get('added'))
-    drug.stock += amount_added
-    Stocked.objects.create(
-        drug_name=drug, supplier=supp, staff=request.user, number_added=amount_added, total=drug.stock)
-    drug.save()
-    messages.success(request, f'{amount_added} {drug.name} added')
+    try:
+        amount_added = int(request.POST.get('added'))
+        stock.add_stock(drug, amount_added, supp, request.user)
+    except (TypeError, ValueError) as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, f'{amount_added} {drug.name} added')
     return redirect('stocking')
 
 
+@login_required
+def stock_intake(request):
+    """
+    Receive a whole delivery from an uploaded CSV, see intake.py. Shows
+    the rejected lines; the rest are received in one transaction.
+    """
+    context = {}
+    if request.method == 'POST' and request.FILES.get('file'):
+        dry_run = bool(request.POST.get('dry_run'))
+        file = io.TextIOWrapper(request.FILES['file'], encoding='utf-8-sig', newline='')
+        try:
+            context['report'] = intake.import_csv(file, request.user, dry_run=dry_run)
+            context['dry_run'] = dry_run
+        except (intake.IntakeError, UnicodeDecodeError, csv.Error) as e:
+            messages.error(request, f'Could not read the file: {e}')
+    return render(request, 'Inventory/intake.html', context)
+
+
 class stockingListView(ListView):
     model = Drug
     context_object_name = 'drugs'
@@ -106,6 +137,10 @@ class stockingListView(ListView):
     template_name = 'Inventory/stock.html'
     ordering = ['name']
 
+    def get_paginator(self, queryset, per_page, **kwargs):
+        # The rows carry csrf forms, so the data is cached rather than the HTML
+        return caching.VersionedPaginator(queryset, per_page, 'stocking', [Drug], **kwargs)
+
 
 @login_required
 def sellDrug(request, pk):
@@ -114,105 +149,180 @@ def sellDrug(request, pk):
         client = request.POST.get('client')
         drug = get_object_or_404(Drug, pk=pk)
 
-        if drug.stock >= quantity:
-            # Update drug stock
-            drug.stock -= quantity
-            drug.save()
-
-            # Create sale record
-            Sale.objects.create(
-                seller=request.user,
-                drug_sold=drug.name,
-                client=client,
-                batch_no=drug.batch_no,
-                quantity=quantity,
-                remaining_quantity=drug.stock
-            )
-
+        try:
+            # Decrement stock and create the sale record in one transaction
+            stock.sell(drug, quantity, client, request.user)
             messages.success(request, f'{quantity} {drug.name} sold to {client}')
-        else:
-            messages.error(request, 'Not enough stock available')
+        except InsufficientStock as e:
+            messages.error(request, str(e))
+        except ValueError as e:
+            messages.error(request, str(e))
 
         return redirect('home')
 
 @login_required
-def lockDrug(request, pk):
+def sellOrder(request):
+    """
+    Sell every line of a client's order in one POST. The order is posted as
+    parallel ``drug``/``quantity`` lists and either all lines sell or none do.
+    """
     if request.method == 'POST':
-        quantity = float(request.POST.get('quantity'))
-        client = request.POST.get('client')
-        drug = get_object_or_404(Drug, pk=pk)
+        client = request.POST.get('client', '').strip()
+        drug_ids = request.POST.getlist('drug')
+        quantities = request.POST.getlist('quantity')
+
+        if not client:
+            messages.error(request, 'Client name cannot be empty.')
+            return redirect('home')
+
+        try:
+            lines = [(int(drug_id), float(quantity)) for drug_id, quantity in zip(drug_ids, quantities)]
+        except ValueError:
+            messages.error(request, 'Invalid quantity. Please enter a valid number.')
+            return redirect('home')
+
+        if not lines or len(drug_ids) != len(quantities) or any(
+                not math.isfinite(quantity) or quantity <= 0 for _, quantity in lines):
+            messages.error(request, 'Every order line needs a drug and a quantity greater than zero.')
+            return redirect('home')
+
+        try:
+            sales = stock.sell_order(lines, client, request.user)
+            messages.success(request, f'{len(sales)} products sold to {client}')
+        except InsufficientStock as e:
+            messages.error(request, str(e))
+        except ValueError as e:
+            messages.error(request, str(e))
+
+    return redirect('home')
+
+# What the product form can do with a FEFO allocation
+PRODUCT_ACTIONS = {
+    'sell': (stock.sell_product, 'sold to'),
+    'lock': (stock.lock_product, 'locked for'),
+    'pick': (stock.pick_product, 'added to the picking list for'),
+}
 
-        if drug.stock >= quantity:
-            # Lock product by creating a LockedProduct record
-            LockedProduct.objects.create(
-                drug=drug,
-                locked_by=request.user,
-                quantity=quantity,
-                client=client
-            )
 
-            drug.stock -= quantity
-            drug.save()
+@login_required
+def allocate_product(request):
+    """
+    Sell, lock or pick a quantity of a product by name. The quantity is
+    spread over the product's batches, earliest expiry first.
+    """
+    if request.method == 'POST':
+        name = request.POST.get('product', '').strip()
+        client = request.POST.get('client', '').strip()
+        action = request.POST.get('action', 'sell')
+
+        if not name or not client or action not in PRODUCT_ACTIONS:
+            messages.error(request, 'Enter a product, a quantity and a client.')
+            return redirect('home')
 
-    #         last_sale = Sale.objects.filter(drug_sold=drug).order_by('-date_sold').first()
+        try:
+            quantity = float(request.POST.get('quantity', ''))
+        except ValueError:
+            quantity = 0
+        if not math.isfinite(quantity) or quantity <= 0 or (action == 'pick' and not quantity.is_integer()):
+            messages.error(request, 'Invalid quantity. Please enter a valid number.')
+            return redirect('home')
 
-    # # If a sale exists, add the locked quantity to the remaining_quantity
-    #         if last_sale:
-    #             if last_sale.remaining_quantity is None:
-    #                 last_sale.remaining_quantity = 0  # Ensure it's initialized
-    #             last_sale.remaining_quantity = drug.stock
-    #             last_sale.save()
+        allocate, done = PRODUCT_ACTIONS[action]
+        try:
+            if action == 'pick':
+                rows = allocate(name, int(quantity), client)
+            else:
+                rows = allocate(name, quantity, client, request.user)
+            batches = ', '.join(row.drug.batch_no for row in rows)
+            messages.success(request, f'{quantity:g} {name} {done} {client} from batch {batches}')
+        except InsufficientStock as e:
+            messages.error(request, str(e))
+        except ValueError as e:
+            messages.error(request, str(e))
 
-            # Reduce stock
+    return redirect('home')
 
+@login_required
+def lockDrug(request, pk):
+    if request.method == 'POST':
+        quantity = float(request.POST.get('quantity'))
+        client = request.POST.get('client')
+        drug = get_object_or_404(Drug, pk=pk)
+
+        try:
+            # Reduce stock and create the LockedProduct record in one transaction
+            stock.lock(drug, quantity, client, request.user)
             messages.success(request, f'{quantity} {drug.name} locked.')
-        else:
-            messages.error(request, 'Not enough stock to lock')
+        except InsufficientStock as e:
+            messages.error(request, str(e))
+        except ValueError as e:
+            messages.error(request, str(e))
 
         return redirect('home')
 
 
 def search(request):
-    drugs = Drug.objects.all().order_by('name')
     query = request.POST.get('q')
+    if not fulltext.match_expression(query):
+        return redirect('home')
 
-    if query:
-        drugs = Drug.objects.filter(
-            Q(name__icontains=query) | Q(batch_no__icontains=query))
+    # At most fulltext.SEARCH_LIMIT drugs, best match first
+    drugs = fulltext.ranked(Drug.objects.all(), query)
 
     context = {'drugs': drugs}
     return render(request, 'Inventory/home.html', context)
 
 
 def binsearch(request):
-    bins = Sale.objects.all().order_by('drug_sold')
-    
     # Get search query from GET request or fallback to POST request
     query = request.GET.get('search') or request.POST.get('quiz')
+    if not fulltext.match_expression(query):
+        return redirect('bin_report')
 
-    print("Search Query:", query)  # Debugging the query received
-
-    if query:
-        bins = bins.filter(
-            Q(client__icontains=query) |
-            Q(drug_sold__icontains=query) |
-            Q(batch_no__icontains=query)
-        ).order_by('date_sold')
+    bins = fulltext.ranked(Sale.objects.select_related('seller'), query)
     return render(request, 'Inventory/bin.html', {'sales': bins})
 
 
 
 def searchstock(request):
-    drugs = Drug.objects.all().order_by('name')
     query = request.POST.get('s')
+    if not fulltext.match_expression(query, ['name']):
+        return redirect('stocking')
 
-    if query:
-        drugs = Drug.objects.filter(Q(name__icontains=query)).order_by('name')
+    drugs = fulltext.ranked(Drug.objects.all(), query, columns=['name'])
 
     context = {'drugs': drugs}
     return render(request, 'Inventory/stock.html', context)
 
 
+# Rows per type-ahead response; "More" fetches the next page by cursor
+TYPEAHEAD_PAGE_SIZE = 20
+
+
+def _search_rows(request, template, columns=None):
+    """
+    The drugs matching ``q`` as table rows, one bounded page ordered by
+    name, for search-as-you-type. Each word of ``q`` is a prefix matched
+    through the FTS index, so a keystroke costs one small query.
+    """
+    drugs = fulltext.matching(Drug.objects.all(), request.GET.get('q', ''), columns)
+    page = keyset_page(request, drugs, ('name', 'id'), TYPEAHEAD_PAGE_SIZE)
+    rows = render_to_string(template, {'drugs': page}, request=request)
+    return JsonResponse({'rows': rows, 'next': page.next_cursor})
+
+
+@query_budget(4)
+@login_required
+def search_rows(request):
+    return _search_rows(request, 'Inventory/drug_rows.html')
+
+
+@query_budget(4)
+@login_required
+def searchstock_rows(request):
+    return _search_rows(request, 'Inventory/stock_rows.html', columns=['name'])
+
+
 def salehistory(request):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
@@ -261,13 +371,15 @@ def todaysales(request):
     return render(request, 'Inventory/today.html', context)
 
 
+@query_budget(8)
+@reads_from_replica
 def StockAdded(request):
     start_date = request.GET.get('date_start')
     end_date = request.GET.get('date_end')
     if start_date and end_date:
         glua_stocked_days = Stocked.objects.filter(
-            date_added__range=[start_date, end_date]).order_by('-date_added')
-        context = {'stocked': glua_stocked_days}
+            date_added__range=[start_date, end_date]).select_related('drug_name', 'staff')
+        context = {'stocked': keyset_page(request, glua_stocked_days, ('-date_added', '-id'))}
     else:
         context = {}
 
@@ -281,115 +393,117 @@ class modifyDrugUpdateView(UpdateView):
     success_url = "/"
 
 
+@query_budget(8)
+@reads_from_replica
 def bin_report(request):
-    # Get all sales ordered by date sold
-    sales = Sale.objects.all().order_by('-date_sold')
+    # Get all sales, newest first
+    sales = Sale.objects.select_related('seller')
+    ordering = ('-date_sold', '-id')
+
+    # One batch's history, e.g. ?drug=12
+    drug_id = request.GET.get('drug')
+    if drug_id and drug_id.isdigit():
+        sales = sales.filter(drug_id=int(drug_id))
     
-    # Get date range filters from the request
-    start_date = request.POST.get('start_date')
-    end_date = request.POST.get('end_date')
+    # Get date range filters from the form, or from the page links after it
+    params = filter_params(request, 'start_date', 'end_date')
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
     
     # Filter sales based on the date range, if provided
     if start_date and end_date:
         try:
             start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
             end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-            sales = sales.filter(date_sold__range=(start_date, end_date)).order_by('date_sold')
+            sales = sales.filter(date_sold__range=(start_date, end_date))
+            ordering = ('date_sold', 'id')
         except ValueError:
             pass  # Ignore invalid dates
 
-    # Pagination setup
-    per_page = int(request.GET.get('per_page', 10))  # Default to 10 items per page
-    paginator = Paginator(sales, per_page)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    # Cursor pagination on (date_sold, id)
+    page_obj = keyset_page(request, sales, ordering, params=params)
 
     return render(request, 'Inventory/bin.html', {'sales': page_obj})
 
+# Rows in the dashboard's Top Sold Products table; the download has the full list
+TOP_SOLD_LIMIT = 50
+
+
+@query_budget(10)
+@reads_from_replica
 @login_required
 def dashboard(request):
     today = timezone.now().date()
 
+    # All counters come from the maintained summary row
+    inventory = summary.get_summary()
+
     # Get the expired products (expiry date is in the past)
     expired_drugs = Drug.objects.filter(expiry_date__lt=today, stock__gt=0)
 
-    # Get the products expiring within the next 10 days
+    # Get the products expiring within the next 180 days
     expiring_soon = Drug.objects.filter(expiry_date__lte=today + timedelta(days=180), expiry_date__gt=today, stock__gt=0).order_by('expiry_date')
 
     # Get the products with stock below the reorder level
     low_stock = Drug.objects.filter(stock__lte=F('reorder_level'), stock__gt=0)
     out_of_stock = Drug.objects.filter(stock=0)
 
-    # Check if the modal should be shown (only when there are low stock or expiring soon products)
+    # Check if the modal should be shown (only when there are low stock or expiring soon products).
+    # The lists above are only queried when the modal is rendered.
     show_modal = False
-    if low_stock.exists() or expiring_soon.exists() or out_of_stock.exists():
+    if inventory.low_stock or inventory.expiring_soon or inventory.out_of_stock:
         show_modal = not request.session.get('modal_shown', False)  # Only show modal if 'modal_shown' is not set or False
 
     if show_modal:
         request.session['modal_shown'] = True  # Set the session variable to True after showing the modal
         request.session.modified = True  # Ensure the session is saved
 
-    # Summary Data
-    total_products = Drug.objects.count()
-    low_stock_products = Drug.objects.filter(stock__lte=F('reorder_level'), stock__gt=0).count()
-    out_of_stock_products = Drug.objects.filter(stock=0).count()
-    zero_stock_products = Drug.objects.filter(stock__lte=5).count()
-    locked_products = LockedProduct.objects.all().count()
-    marketing_items = MarketingItem.objects.all().count()
-    total_picking_list = PickingList.objects.all().count()
-    cannisters = Cannister.objects.all().count()
-
-    # Top Sold Products
-    top_sold_products = (
-        Sale.objects.values("drug_sold")
-        .annotate(total_quantity=Sum("quantity"))
-        .order_by("-total_quantity")[:210000]
-    )
-
-    # Calculate the total count of expired and expiring soon drugs
-    total_expiring_count = expired_drugs.count() + expiring_soon.count()
+    # Top Sold Products, from the all-time rollup; the table is a cached fragment
+    top_sold_products = rollup.top_sold(limit=TOP_SOLD_LIMIT)
 
     context = {
-        'total_products': total_products,
-        'low_stock_products': low_stock_products,
-        'out_of_stock_products': out_of_stock_products,
-        'zero_stock_products': zero_stock_products,
+        'total_products': inventory.total_products,
+        'low_stock_products': inventory.low_stock,
+        'out_of_stock_products': inventory.out_of_stock,
+        'zero_stock_products': inventory.zero_stock,
         'top_sold_products': top_sold_products,
-        'expired_drugs_count': expired_drugs.count(),  # Add the count of expired drugs
-        'expiring_soon_count': expiring_soon.count(),  # Add the count of expiring soon drugs
-        'total_expiring_count': total_expiring_count,  # Add the total count of expired and expiring soon drugs
+        'top_sold_version': caching.versions(ProductSalesTotal),
+        'expired_drugs_count': inventory.expired,  # Add the count of expired drugs
+        'expiring_soon_count': inventory.expiring_soon,  # Add the count of expiring soon drugs
+        'total_expiring_count': inventory.total_expiring,  # Add the total count of expired and expiring soon drugs
         'expired_drugs': expired_drugs,  # Pass expired drugs to the template
         'expiring_soon': expiring_soon,  # Pass expiring soon drugs to the template
         'low_stock': low_stock,
         'show_modal': show_modal,
-        'locked_products': locked_products,
-        'marketing_items': marketing_items,
-        'total_picking_list': total_picking_list,
-        'cannisters':cannisters,
+        'locked_products': inventory.locked_products,
+        'marketing_items': inventory.marketing_items,
+        'total_picking_list': inventory.picking_list,
+        'cannisters': inventory.cannisters,
         'out_of_stock':out_of_stock
     }
-    print("Context out_of_stock:", list(out_of_stock))
     return render(request, 'Inventory/dashboard.html', context)
 
 
+@query_budget(8)
 @login_required
 def low_stock_view(request):
-    # Get the products with stock below or equal to the reorder level
+    # Get the products with stock below or equal to the reorder level, a page at a time
     low_stock = Drug.objects.filter(stock__lte=F('reorder_level'), stock__gt=0)
+    page_obj = caching.cached('low_stock', [Drug], lambda: keyset_page(request, low_stock, ('name', 'id')),
+                              request.GET.urlencode())
 
     context = {
-        'low_stock': low_stock
+        'low_stock': page_obj,
+        'cache_version': caching.versions(Drug),
     }
 
     return render(request, 'Inventory/lowstock.html', context)
 
 def get_online_offline_users(request):
-    # Get all users
-    all_users = User.objects.all()
-
-    # Split them into online and offline users
-    online_users = [user.username for user in all_users if user.is_active]  # Assuming 'is_active' indicates online status
-    offline_users = [user.username for user in all_users if not user.is_active]  # Assuming 'is_active' indicates offline status
+    # Split users into online and offline from their last heartbeat
+    online_users, offline_users = [], []
+    for username, is_online in presence.with_status(User.objects.order_by('username')).values_list('username', 'is_online'):
+        (online_users if is_online else offline_users).append(username)
 
     # Return as JSON response
     return JsonResponse({
@@ -397,14 +511,16 @@ def get_online_offline_users(request):
         'offline_users': offline_users,
     })
 
+@query_budget(8)
 @login_required
 def locked_products(request):
     """
     Display the list of locked products in ascending order by the drug name.
     """
-    # Fetch all locked products and order by the drug's name
-    locked_products = LockedProduct.objects.all().order_by('-date_locked')
-    return render(request, 'Inventory/locked.html', {'locked_products': locked_products})
+    # Newest locks first, a page at a time
+    locked_products = LockedProduct.objects.select_related('drug', 'locked_by')
+    page_obj = keyset_page(request, locked_products, ('-date_locked', '-id'))
+    return render(request, 'Inventory/locked.html', {'locked_products': page_obj})
 
 @login_required
 def post_locked_product(request, lock_id):
@@ -417,21 +533,11 @@ def post_locked_product(request, lock_id):
         client = lock.client  # Assuming 'locked_by' is a User and you need their username as the client.
         drug = lock.drug
 
-        # Create sale record
-        Sale.objects.create(
-            seller=request.user,
-            drug_sold=drug.name,
-            client=client,
-            batch_no=drug.batch_no,
-            quantity=quantity,
-            remaining_quantity=drug.stock
-        )
-
-        # Delete the locked product
-        lock.delete()
-
-        # Display a success message
-        messages.success(request, f'{quantity} {drug.name} sold to {client} and lock removed.')
+        # Create sale record and delete the locked product
+        if stock.post_locked(lock, request.user):
+            messages.success(request, f'{quantity} {drug.name} sold to {client} and lock removed.')
+        else:
+            messages.error(request, 'This lock has already been posted or released.')
 
         # Redirect to the locked products page
         return redirect('locked_products')
@@ -445,39 +551,36 @@ def unlock_product(request, lock_id):
     # Fetch the locked product instance
     lock = get_object_or_404(LockedProduct, id=lock_id)
 
-    # Add the locked quantity back to the drug's stock
+    # Delete the lock and add the locked quantity back to the drug's stock
     drug = lock.drug
-    if lock.quantity:  # Ensure the quantity is not None or empty
-        drug.stock += int(lock.quantity)  # Adding the locked quantity back to the stock
-        drug.save()  # Save the updated stock to the database
-
-    # Fetch the last sale entry for this drug
-    # last_sale = Sale.objects.filter(drug_sold=drug).order_by('-date_sold').first()
-
-    # # If a sale exists, add the locked quantity to the remaining_quantity
-    # if last_sale:
-    #     if last_sale.remaining_quantity is None:
-    #         last_sale.remaining_quantity = 0  # Ensure it's initialized
-    #     last_sale.remaining_quantity = drug.stock
-    #     last_sale.save()  # Save the updated remaining quantity
-
-    # Delete the locked product after updating the stock and sales
-    lock.delete()
+    if stock.unlock(lock, request.user):
+        messages.success(request, f"{lock.quantity} {drug.name} unlocked and added back to stock.")
+    else:
+        messages.error(request, 'This lock has already been posted or released.')
 
     # Redirect to the locked products page
-    messages.success(request, f"{lock.quantity} {drug.name} unlocked and added back to stock.")
     return redirect('locked_products')
 
 
 @login_required
 def locked_search(request):
-    query = request.POST.get('quiz', '')  # Retrieve the search query from the form
-    locked_products = LockedProduct.objects.filter(
-        Q(drug__name__icontains=query) | Q(locked_by__username__icontains=query)
-    ).order_by('-date_locked')  # Search for drug name or locked_by username containing the query (case-insensitive)
+    params = filter_params(request, 'quiz')
+    query = params.get('quiz', '')  # Retrieve the search query from the form or the page links
+    locked_products = LockedProduct.objects.select_related('drug', 'locked_by')
+    if fulltext.match_expression(query, ['name']):
+        # Search for drug name or locked_by username
+        locked_products = locked_products.filter(
+            Q(drug__in=fulltext.match_ids(Drug, query, ['name'])) | Q(locked_by__username__icontains=query)
+        )
 
-    return render(request, 'Inventory/locked.html', {'locked_products': locked_products})
+    page_obj = keyset_page(request, locked_products, ('-date_locked', '-id'), params=params)
+    return render(request, 'Inventory/locked.html', {'locked_products': page_obj})
 
+def _local(value):
+    return localtime(value).strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+
+@query_budget(8)
 @login_required
 def user_management(request):
     """
@@ -507,24 +610,18 @@ def user_management(request):
     # # Update last activity timestamp as a string
     # request.session['last_activity'] = current_time.strftime('%Y-%m-%d %H:%M:%S')
 
-    # Get all users
-    users = User.objects.all()
-
-    # Get session information to track online users and their login times
-    sessions = Session.objects.filter(expire_date__gte=now())
-    online_user_ids = [session.get_decoded().get('_auth_user_id') for session in sessions]
+    # Get all users with their online/offline status from the presence table
+    users = presence.with_status(User.objects.order_by('username'))
 
-    # Annotate users with their online/offline status, login time, and logout time
+    # Login time for online users, logout time for offline ones
     for user in users:
-        user.is_online = str(user.id) in online_user_ids
+        state = getattr(user, 'presence', None)
         if user.is_online:
-            # If the user is online, show login time
-            user.login_time = localtime(user.last_login).strftime('%Y-%m-%d %H:%M:%S') if user.last_login else None
+            user.login_time = _local(state.online_since)
             user.logout_time = None  # No logout time for online users
         else:
-            # If the user is offline, show logout time
             user.login_time = None  # No login time for offline users
-            user.logout_time = localtime(user.last_login).strftime('%Y-%m-%d %H:%M:%S') if user.last_login else "N/A"
+            user.logout_time = _local((state.offline_since or state.last_seen) if state else None) or "N/A"
 
     context = {
         'users': users,
@@ -562,16 +659,30 @@ def user_logout(request):
     logout(request)
     return HttpResponseRedirect('/login')  # Redirect to login page or home page
 
+@query_budget(8)
 @login_required
 def out_of_stock(request):
     out_of_stock_products = Drug.objects.filter(stock=0)
-    return render(request, 'Inventory/out_of_stock.html', {'out_of_stock': out_of_stock_products})
+    page_obj = caching.cached('out_of_stock', [Drug], lambda: keyset_page(request, out_of_stock_products, ('name', 'id')),
+                              request.GET.urlencode())
+    return render(request, 'Inventory/out_of_stock.html', {
+        'out_of_stock': page_obj,
+        'cache_version': caching.versions(Drug),
+    })
 
+@query_budget(8)
 @login_required
 def expiring_soon(request):
     today = timezone.now().date()
-    expiring_products = Drug.objects.filter(expiry_date__lte=today + timedelta(days=180), stock__gt=0).order_by('expiry_date')
-    return render(request, 'Inventory/expiring_soon.html', {'expiring_soon': expiring_products})
+    expiring_products = Drug.objects.filter(expiry_date__lte=today + timedelta(days=180), stock__gt=0)
+    page_obj = caching.cached('expiring_soon', [Drug],
+                              lambda: keyset_page(request, expiring_products, ('expiry_date', 'id')),
+                              today, request.GET.urlencode())
+    return render(request, 'Inventory/expiring_soon.html', {
+        'expiring_soon': page_obj,
+        # The six-month window moves with the date
+        'cache_version': f'{caching.versions(Drug)}-{today}',
+    })
 
 blue_shades = [
     {"hex": "#0047AB", "rgba": "rgba(0, 71, 171, 1)"},
@@ -601,32 +712,29 @@ def show_colors(request):
 @login_required
 def bin_filter(request):
     """
-    Filters sales data based on the date range provided by the user.
+    Filters sales data based on the date range provided by the user, a page
+    at a time. The page links carry the dates.
     """
-    if request.method == 'POST':
-        start_date = request.POST.get('start_date', None)
-        end_date = request.POST.get('end_date', None)
-        
-        # Convert string dates to Python date objects
-        if start_date:
-            start_date = parse_date(start_date)
-        if end_date:
-            end_date = parse_date(end_date)
-
-        # Filter the sales by date range
-        if start_date and end_date:
-            sales = Sale.objects.filter(date_sold__range=[start_date, end_date]).order_by('date_sold')
-        elif start_date:
-            sales = Sale.objects.filter(date_sold__gte=start_date).order_by('date_sold')
-        elif end_date:
-            sales = Sale.objects.filter(date_sold__lte=end_date).order_by('date_sold')
-        else:
-            sales = Sale.objects.all().order_by('date_sold')  # Default to all if no dates provided
+    params = filter_params(request, 'start_date', 'end_date')
 
-    else:
-        sales = Sale.objects.all().order_by('date_sold')  # Default to all sales if not a POST request
+    # Convert string dates to Python date objects; invalid ones are ignored
+    try:
+        start_date = parse_date(params.get('start_date', ''))
+        end_date = parse_date(params.get('end_date', ''))
+    except ValueError:
+        start_date = end_date = None
 
-    return render(request, 'Inventory/bin.html', {'sales': sales})
+    # Filter the sales by date range
+    sales = Sale.objects.select_related('seller')
+    if start_date and end_date:
+        sales = sales.filter(date_sold__range=[start_date, end_date])
+    elif start_date:
+        sales = sales.filter(date_sold__gte=start_date)
+    elif end_date:
+        sales = sales.filter(date_sold__lte=end_date)
+
+    page_obj = keyset_page(request, sales, ('date_sold', 'id'), params=params)
+    return render(request, 'Inventory/bin.html', {'sales': page_obj})
 
 @csrf_exempt  # Temporarily disable CSRF for this AJAX endpoint
 def logout_due_to_inactivity(request):
@@ -635,31 +743,38 @@ def logout_due_to_inactivity(request):
         return JsonResponse({"message": "User logged out due to inactivity"})
     return JsonResponse({"message": "Invalid request"}, status=400)
 
+@query_budget(8)
 @login_required
 def marketing_items(request):
-    """Display the list of marketing items."""
-    marketing_items = MarketingItem.objects.all()
+    """Display the list of marketing items, a page at a time."""
+    marketing_items = caching.cached(
+        'marketing_items', [MarketingItem],
+        lambda: keyset_page(request, MarketingItem.objects.all(), ('name', 'id')), request.GET.urlencode())
     context = {
         'marketing_items': marketing_items
     }
     return render(request, 'Inventory/marketing_items.html', context)
 
+@query_budget(8)
 @login_required
 def marketing_search(request):
-    if request.method == 'POST':
-        search_query = request.POST.get('search', '').strip()  # Get the search query from the form
-        marketing_items = MarketingItem.objects.filter(name__icontains=search_query)  # Perform a case-insensitive search
-
-        # Pass the search results and query back to the template
-        return render(request, 'Inventory/marketing_items.html', {
-            'marketing_items': marketing_items,
-            'search_query': search_query,
-        })
-    else:
-        return render(request, 'Inventory/marketing_items.html', {
-            'marketing_items': [],
-            'search_query': '',
-        })
+    """
+    Marketing items whose name contains the search, a page at a time. The
+    form posts the search and the page links carry it.
+    """
+    params = filter_params(request, 'search')
+    search_query = params.get('search', '').strip()
+    if not search_query:
+        return redirect('marketing_items')
+
+    marketing_items = MarketingItem.objects.filter(name__icontains=search_query)  # Perform a case-insensitive search
+    page_obj = keyset_page(request, marketing_items, ('name', 'id'), params=params)
+
+    # Pass the search results and query back to the template
+    return render(request, 'Inventory/marketing_items.html', {
+        'marketing_items': page_obj,
+        'search_query': search_query,
+    })
 
 @login_required
 def issue_item(request):
@@ -673,25 +788,14 @@ def issue_item(request):
             quantity_issued = int(quantity_issued)
             marketing_item = get_object_or_404(MarketingItem, id=item_id)
 
-            if quantity_issued > marketing_item.stock:
-                messages.error(request, f"Cannot issue more than the available stock for {marketing_item.name}.")
-            elif quantity_issued <= 0:
+            if quantity_issued <= 0:
                 messages.error(request, f"Invalid quantity issued for {marketing_item.name}.")
             else:
-                # Deduct the stock from MarketingItem
-                marketing_item.stock -= quantity_issued
-                marketing_item.save()
-
-                # Create a new IssuedItem entry
-                IssuedItem.objects.create(
-                    item=marketing_item.name,
-                    stock=marketing_item.stock,
-                    issued_to=issued_to,
-                    quantity_issued=quantity_issued,
-                    issued_by=request.user,
-                )
-
+                # Deduct the stock and create the IssuedItem entry together
+                stock.issue_item(marketing_item, quantity_issued, issued_to, request.user)
                 messages.success(request, f"Issued {quantity_issued} of {marketing_item.name} to {issued_to}.")
+        except InsufficientStock as e:
+            messages.error(request, str(e))
         except ValueError:
             messages.error(request, "Invalid quantity issued. Please enter a valid number.")
         except Exception as e:
@@ -700,23 +804,17 @@ def issue_item(request):
     # Redirect back to the marketing items page
     return redirect("marketing_items")
 
+@query_budget(8)
+@reads_from_replica
 def issued_items_report(request):
     """
     View to display all issued items with pagination.
     """
-    # Fetch all issued items ordered by date
-    issued_items = IssuedItem.objects.all().order_by('-date_issued')
+    # Fetch all issued items, newest first
+    issued_items = IssuedItem.objects.select_related('issued_by')
     
-    # Pagination (default 10 items per page)
-    paginator = Paginator(issued_items, 10)  # Change '10' to your desired items per page
-    page_number = request.GET.get('page', 1)
-    per_page = request.GET.get('per_page', 10)
-    paginator.per_page = int(per_page)
-
-    try:
-        issued_items_page = paginator.page(page_number)
-    except Exception as e:
-        issued_items_page = paginator.page(1)
+    # Cursor pagination on (date_issued, id), default 10 items per page
+    issued_items_page = keyset_page(request, issued_items, ('-date_issued', '-id'))
 
     context = {
         'issued_items': issued_items_page,
@@ -725,80 +823,58 @@ def issued_items_report(request):
 
 def issued_items_search(request):
     """
-    View to search issued items by query.
+    View to search issued items by query. The form posts the query and the
+    page links carry it.
     """
-    if request.method == 'POST':
-        query = request.POST.get('query', '').strip()
-        if query:
-            # Search in item, issued_to, or issued_by fields
-            issued_items = IssuedItem.objects.filter(
-                Q(item__icontains=query) |
-                Q(issued_to__icontains=query) |
-                Q(issued_by__username__icontains=query)
-            ).order_by('-date_issued')
-        else:
-            issued_items = IssuedItem.objects.all()
-
-        # Pagination (default 10 items per page)
-        paginator = Paginator(issued_items, 10)
-        page_number = request.GET.get('page', 1)
-        per_page = request.GET.get('per_page', 10)
-        paginator.per_page = int(per_page)
-
-        try:
-            issued_items_page = paginator.page(page_number)
-        except Exception as e:
-            issued_items_page = paginator.page(1)
+    params = filter_params(request, 'query')
+    query = params.get('query', '').strip()
+    if query:
+        # Search in item, issued_to, or issued_by fields
+        issued_items = fulltext.matching(IssuedItem.objects.all(), query)
+    else:
+        issued_items = IssuedItem.objects.all()
 
-        context = {
-            'issued_items': issued_items_page,
-            'query': query,  # Pass the query back to the template
-        }
-        return render(request, 'Inventory/issued_items_report.html', context)
+    # Cursor pagination (default 10 items per page)
+    issued_items_page = keyset_page(request, issued_items, ('-date_issued', '-id'), params=params)
 
-    return render(request, 'Inventory/issued_items_report.html', {'issued_items': []})
+    context = {
+        'issued_items': issued_items_page,
+        'query': query,  # Pass the query back to the template
+    }
+    return render(request, 'Inventory/issued_items_report.html', context)
 
 def issued_items_filter(request):
     """
-    View to filter issued items by a date range.
+    View to filter issued items by a date range. The form posts the dates
+    and the page links carry them.
     """
-    if request.method == 'POST':
-        start_date = request.POST.get('start_date')
-        end_date = request.POST.get('end_date')
-
-        # If both dates are provided, filter by range
-        if start_date and end_date:
-            try:
-                start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-                end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-                issued_items = IssuedItem.objects.filter(
-                    date_issued__range=(start_date_obj, end_date_obj)
-                ).order_by('-date_issued')
-            except ValueError:
-                issued_items = IssuedItem.objects.all().order_by('-date_issued')
-        else:
-            # If no valid date range is provided, show all items
-            issued_items = IssuedItem.objects.all().order_by('-date_issued')
-
-        # Pagination (default 10 items per page)
-        paginator = Paginator(issued_items, 10)
-        page_number = request.GET.get('page', 1)
-        per_page = request.GET.get('per_page', 10)
-        paginator.per_page = int(per_page)
+    params = filter_params(request, 'start_date', 'end_date')
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
 
+    # If both dates are provided, filter by range
+    if start_date and end_date:
         try:
-            issued_items_page = paginator.page(page_number)
-        except Exception as e:
-            issued_items_page = paginator.page(1)
+            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
+            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
+            issued_items = IssuedItem.objects.filter(
+                date_issued__range=(start_date_obj, end_date_obj)
+            )
+        except ValueError:
+            issued_items = IssuedItem.objects.all()
+    else:
+        # If no valid date range is provided, show all items
+        issued_items = IssuedItem.objects.all()
 
-        context = {
-            'issued_items': issued_items_page,
-            'start_date': start_date,
-            'end_date': end_date,
-        }
-        return render(request, 'Inventory/issued_items_report.html', context)
+    # Cursor pagination (default 10 items per page)
+    issued_items_page = keyset_page(request, issued_items, ('-date_issued', '-id'), params=params)
 
-    return render(request, 'Inventory/issued_items_report.html', {'issued_items': []})
+    context = {
+        'issued_items': issued_items_page,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+    return render(request, 'Inventory/issued_items_report.html', context)
 
 def create_marketing_item(request):
     if request.method == "POST":
@@ -816,6 +892,7 @@ def create_marketing_item(request):
     # Render the creation form
     return render(request, 'Inventory/create_marketing_item.html')
 
+@query_budget(8)
 def picking_list_view(request):
     picking_list = PickingList.objects.all().order_by('-date')
     
@@ -837,11 +914,8 @@ def picking_list_view(request):
         picking_list = picking_list.filter(date__range=[start_date, end_date]).order_by('-date')
 
     
-    # Pagination
-    per_page = int(request.GET.get('per_page', 10))
-    paginator = Paginator(picking_list, per_page)
-    page_number = request.GET.get('page',1)
-    page_obj = paginator.get_page(page_number)
+    # Cursor pagination on (date, id)
+    page_obj = keyset_page(request, picking_list, ('-date', '-id'))
     
     return render(request, 'Inventory/picking_list.html', {'picking_list': page_obj})
 
@@ -878,6 +952,7 @@ def add_to_picking_list(request, drug_id):
         PickingList.objects.create(
             date=timezone.now(),
             client=client,
+            drug=drug,
             product=drug.name,
             batch_no=drug.batch_no,
             quantity=quantity,
@@ -889,8 +964,9 @@ def add_to_picking_list(request, drug_id):
     return HttpResponse("Invalid request", status=400)
 
 
+@query_budget(8)
 def cannister_list(request):
-    cannisters = Cannister.objects.all()
+    cannisters = keyset_page(request, Cannister.objects.all(), ('name', 'id'))
     return render(request, 'Inventory/cannister.html', {'cannisters': cannisters})
 
 @login_required
@@ -901,122 +977,120 @@ def issue_cannister(request, cannister_id):
         client = request.POST.get("client")
         quantity = int(request.POST.get("quantity"))
 
-        if quantity > 0 and quantity <= cannister.stock:
-            # Deduct stock
-            cannister.stock -= quantity
-            cannister.save()
-
-            # Save issuance record
-            IssuedCannister.objects.create(
-                name=cannister.name,
-                batch_no=cannister.batch_no,
-                staff_on_duty=request.user,
-                client=client,
-                quantity=quantity,
-                balance=cannister.stock
-            )
+        if quantity > 0:
+            # Deduct stock and save the issuance record together
+            try:
+                stock.issue_cannister(cannister, quantity, client, request.user)
+            except InsufficientStock as e:
+                messages.error(request, str(e))
     
     return redirect('cannister_list')
 
 
+@query_budget(8)
+@reads_from_replica
 @login_required
 def bin_card(request):
-    issued_cannisters = IssuedCannister.objects.all().order_by('-date_issued')
+    issued_cannisters = IssuedCannister.objects.select_related('staff_on_duty', 'returned_by')
 
-    # Pagination
-    per_page = request.GET.get('per_page', 10)
-    paginator = Paginator(issued_cannisters, per_page)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Cursor pagination on (date_issued, id)
+    page_obj = keyset_page(request, issued_cannisters, ('-date_issued', '-id'))
 
     return render(request, 'Inventory/cannister_bin.html', {'issued_cannisters': page_obj})
 
 @login_required
 def bin_search(request):
     query = request.GET.get('search', '')
-    issued_cannisters = IssuedCannister.objects.filter(
-        Q(name__icontains=query) | 
-        Q(batch_no__icontains=query) |
-        Q(client__icontains=query) |
-        Q(staff_on_duty__username__icontains=query)
-    ).order_by('-date_issued')
-
-    # Pagination
-    per_page = request.GET.get('per_page', 10)
-    paginator = Paginator(issued_cannisters, per_page)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    issued_cannisters = fulltext.matching(
+        IssuedCannister.objects.select_related('staff_on_duty', 'returned_by'), query)
+
+    # Cursor pagination on (date_issued, id)
+    page_obj = keyset_page(request, issued_cannisters, ('-date_issued', '-id'))
 
     return render(request, 'Inventory/cannister_bin.html', {'issued_cannisters': page_obj})
 
 @login_required
 def can_filter(request):
-    if request.method == "POST":
-        start_date = request.POST.get('start_date')
-        end_date = request.POST.get('end_date')
-
-        issued_cannisters = IssuedCannister.objects.all()
-        if start_date and end_date:
-            issued_cannisters = issued_cannisters.filter(date_issued__range=[start_date, end_date])
-
-        # Pagination
-        per_page = request.GET.get('per_page', 10)
-        paginator = Paginator(issued_cannisters, per_page)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
-
-        return render(request, 'Inventory/cannister_bin.html', {'issued_cannisters': page_obj})
-    
-    return redirect('bin_card')
+    # Dates from the form, or from the page links after it
+    params = filter_params(request, 'start_date', 'end_date')
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    if not (start_date and end_date):
+        return redirect('bin_card')
+
+    issued_cannisters = IssuedCannister.objects.filter(date_issued__range=[start_date, end_date])
+
+    # Cursor pagination on (date_issued, id)
+    page_obj = keyset_page(request, issued_cannisters, ('-date_issued', '-id'), params=params)
+
+    return render(request, 'Inventory/cannister_bin.html', {
+        'issued_cannisters': page_obj,
+        'start_date': start_date,
+        'end_date': end_date,
+    })
 
 @login_required
 def return_cannister(request, issued_cannister_id):
     issued_cannister = get_object_or_404(IssuedCannister, id=issued_cannister_id)
     
     if not issued_cannister.action:  # Ensure it's not already returned
-        issued_cannister.action = True
-        issued_cannister.returned_by = request.user
-        issued_cannister.date_returned = timezone.now()
-        issued_cannister.save()
-
-        # Restore stock in the cannister model
-        cannister = Cannister.objects.get(batch_no=issued_cannister.batch_no)
-        cannister.stock += issued_cannister.quantity
-        cannister.save()
+        # Mark it returned and restore stock in the cannister model
+        stock.return_cannister(issued_cannister, request.user)
 
     return redirect('bin_card')
 
+@query_budget(8)
 def search_cannister(request):
     query = request.POST.get('q', '')  # Get search input
     results = []
 
     if query:
-        results = Cannister.objects.filter(
-            Q(name__icontains=query) | 
-            Q(batch_no__icontains=query) | 
-            Q(stock__icontains=query) |   # Search by stock
-            Q(litres__icontains=query)    # Search by litres
-        )
+        # Name, batch number or litres; a bare number also matches stock.
+        # At most fulltext.SEARCH_LIMIT cannisters, best match first.
+        results = fulltext.ranked(Cannister.objects.all(), query)
+        if query.strip().isdigit() and len(results) < fulltext.SEARCH_LIMIT:
+            matched = [cannister.pk for cannister in results]
+            results += list(Cannister.objects.filter(stock=int(query)).exclude(pk__in=matched)
+                            .order_by('name', 'id')[:fulltext.SEARCH_LIMIT - len(results)])
 
     return render(request, 'Inventory/cannister.html', {'cannisters': results, 'query': query})
+@reads_from_replica
 @login_required
 def download_top_sold(request):
-    # Aggregate total quantity sold for each product
-    top_sold_products = (
-        Sale.objects.values('drug_sold')
-        .annotate(total_quantity=Sum('quantity'))
-        .order_by('-total_quantity')
-    )
-
-    # Create the HttpResponse object with CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="top_sold_products.csv"'
+    # Total quantity sold for each product, from the rollup
+    top_sold_products = rollup.top_sold().values_list('drug_sold', 'total_quantity')
 
-    writer = csv.writer(response)
-    writer.writerow(['Product Name', 'Total Quantity Sold'])
+    response = StreamingHttpResponse(
+        exports.csv_chunks(['Product Name', 'Total Quantity Sold'], top_sold_products.iterator()),
+        content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="top_sold_products.csv"'
+    return response
 
-    for product in top_sold_products:
-        writer.writerow([product['drug_sold'], product['total_quantity']])
 
+@reads_from_replica
+@login_required
+def export_report(request, kind):
+    """
+    Stream a full report as CSV, or gzip-compressed CSV with ?compress=gzip.
+    Accepts the start_date, end_date and search filters of the report pages.
+    """
+    spec = exports.EXPORTS.get(kind)
+    if spec is None:
+        raise Http404('Unknown export')
+
+    chunks = exports.csv_chunks(spec.headers(), exports.rows(spec, **exports.parse_filters(request.GET)))
+    if request.GET.get('compress') == 'gzip':
+        response = StreamingHttpResponse(exports.gzip_chunks(chunks), content_type='application/gzip')
+        response['Content-Disposition'] = f'attachment; filename="{spec.filename}.csv.gz"'
+    else:
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{spec.filename}.csv"'
     return response
 
+
+@staff_member_required
+def view_timings(request):
+    """
+    Rolling per-view timings from RequestTimingMiddleware, for this worker.
+    """
+    return render(request, 'Inventory/timings.html', {'views': timing.view_summary(), 'window': timing.WINDOW})